@@ -5,11 +5,13 @@ try:
     u = unicode
     string_types = (unicode, str)
     from StringIO import StringIO
+    from Queue import Queue, Empty
 
 except NameError:
     u = str
     string_types = (str,)
     from io import StringIO
+    from queue import Queue, Empty
 
 
 @contextmanager
@@ -24,5 +26,5 @@ def open_filelike(filelike, mode='r'):
 
 
 __all__ = (
-    list(map(lambda x: x.__name__, [StringIO, open_filelike])) +
+    list(map(lambda x: x.__name__, [StringIO, open_filelike, Queue, Empty])) +
     ['u', 'string_types'])
@@ -124,6 +124,9 @@ class ConfigFile(object):
                     profile_config['authorities'][service_name].get(
                         kw, authorities_cfg[service_name][kw])
 
+            profile_config['authorities'][service_name].update(
+                api._authorities[service_name].config)
+
         if api.cache:
             cache_cfg = {
                 'service': api.cache.fs.__class__.__name__,
@@ -137,6 +140,11 @@ class ConfigFile(object):
                 profile_config['cache'][kw] = profile_config[
                     'cache'].get(kw, cache_cfg[kw])
 
+            profile_config['cache'].update(api.cache.config)
+
+            if api.cache.index is not None:
+                profile_config['cache'].update(api.cache.index.config)
+
     def write_config_from_api(self, api, config_file=None, profile=None):
         '''
         Create/update the config file from a DataAPI object
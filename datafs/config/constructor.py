@@ -4,6 +4,11 @@ import importlib
 import fs
 import pkgutil
 
+# filesystems provided by DataFS, by module
+DataFSFilesystems = {
+    'Boto3FS': 'datafs.services.boto3fs'
+}
+
 
 class APIConstructor(object):
 
@@ -33,7 +38,9 @@ class APIConstructor(object):
                 'authorities', {}).items():
 
             service = cls._generate_service(service_config)
-            api.attach_authority(service_name, service)
+            api.attach_authority(service_name, service, **{
+                kw: service_config[kw] for kw in ['chunk_size']
+                if kw in service_config})
 
     @classmethod
     def attach_cache_from_config(cls, api, config):
@@ -41,7 +48,18 @@ class APIConstructor(object):
         if 'cache' in config:
 
             service = cls._generate_service(config['cache'])
-            api.attach_cache(service)
+
+            api.attach_cache(service, **{
+                kw: config['cache'][kw]
+                for kw in [
+                    'verify',
+                    'sample_rate',
+                    'chunk_size',
+                    'link',
+                    'max_size',
+                    'eviction',
+                    'prefix_quotas']
+                if kw in config['cache']})
 
     @staticmethod
     def _generate_manager(manager_config):
@@ -59,8 +77,9 @@ class APIConstructor(object):
         -------
 
         manager : object
-            datafs.managers.MongoDBManager or
-            datafs.managers.DynamoDBManager object
+            datafs.managers.MongoDBManager,
+            datafs.managers.DynamoDBManager, or
+            datafs.managers.SQLiteManager object
             initialized with *args, **kwargs
 
         Examples
@@ -110,10 +129,15 @@ class APIConstructor(object):
             from datafs.managers.manager_dynamo import (
                 DynamoDBManager as mgr_class)
 
+        elif mgr_class_name.lower()[:6] == 'sqlite':
+            from datafs.managers.manager_sqlite import (
+                SQLiteManager as mgr_class)
+
         else:
             raise KeyError(
                 'Manager class "{}" not recognized. Choose from {}'.format(
-                    mgr_class_name, 'MongoDBManager or DynamoDBManager'))
+                    mgr_class_name,
+                    'MongoDBManager, DynamoDBManager, or SQLiteManager'))
 
         manager = mgr_class(
             *manager_config.get('args', []),
@@ -200,8 +224,37 @@ class APIConstructor(object):
             >>> assert isinstance(s3, S3FS)
             >>> m.stop()
 
+        Use the boto3 S3 filesystem provided by DataFS:
+
+        .. code-block:: python
+
+            >>> m.start()
+            >>> s3 = APIConstructor._generate_service(
+            ...     {
+            ...         'service': 'Boto3FS',
+            ...         'args': ['bucket-name'],
+            ...         'kwargs': {
+            ...             'client_args': {'region_name': 'us-east-1'},
+            ...             'part_size': 16 * 2**20,
+            ...             'max_concurrency': 4
+            ...         }
+            ...     })
+            ...
+            >>> from datafs.services.boto3fs import Boto3FS
+            >>> assert isinstance(s3, Boto3FS)
+            >>> m.stop()
+
         '''
 
+        if service_config['service'] in DataFSFilesystems:
+            svc_module = importlib.import_module(
+                DataFSFilesystems[service_config['service']])
+            svc_class = svc_module.__dict__[service_config['service']]
+
+            return svc_class(
+                *service_config.get('args', []),
+                **service_config.get('kwargs', {}))
+
         filesystems = []
 
         for _, modname, _ in pkgutil.iter_modules(fs.__path__):
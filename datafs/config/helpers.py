@@ -1,6 +1,7 @@
 
 from datafs.config.config_file import ConfigFile
 from datafs.config.constructor import APIConstructor
+from datafs.core.versions import VersionSpecifier
 from datafs._compat import open_filelike
 
 import os
@@ -9,17 +10,41 @@ import click
 
 
 def _parse_requirement(requirement_line):
+    '''
+    Split a requirement line into an archive name and version specifier
+
+    Exact requirements (``name==version``) return the version string. Other
+    specifiers, such as ``name>=1.2,<2.0``, are returned whole and resolved
+    with :py:class:`~datafs.core.versions.VersionSpecifier`.
+
+    .. code-block:: python
+
+        >>> _parse_requirement('my_archive==1.0')
+        ('my_archive', '1.0')
+        >>> _parse_requirement('my_archive >= 1.2, <2.0')
+        ('my_archive', '>= 1.2, <2.0')
+        >>> _parse_requirement('my_archive')
+        ('my_archive', None)
+
+    '''
 
     # should we do archive name checking here? If the statement
     # doesn't split, the entire thing gets passed to api.create
     # or get_archive as the archive_name.
 
-    version_stmt = map(lambda s: s.strip(), requirement_line.split('=='))
+    archive_name, specifier = re.match(
+        r'^\s*([^\s=<>!~,]*)\s*(.*?)\s*$', requirement_line).groups()
 
-    if len(version_stmt) == 1:
-        return version_stmt[0], None
-    else:
-        return version_stmt[0], version_stmt[1]
+    if specifier == '':
+        return archive_name, None
+
+    # raise on malformed specifiers when the requirement is read
+    VersionSpecifier(specifier)
+
+    if re.match(r'^==[^,]*$', specifier):
+        return archive_name, specifier[2:].strip()
+
+    return archive_name, specifier
 
 
 def get_api(
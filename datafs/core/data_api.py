@@ -1,10 +1,12 @@
 from __future__ import absolute_import
 
 from datafs.services.service import DataService
+from datafs.services.cache_index import CacheIndex
 from datafs.core.data_archive import DataArchive
-from datafs._compat import open_filelike
+from datafs.core.versions import (
+    BumpableVersion, VersionIndex, VersionSpecifier)
+from datafs.core import hashing
 
-import hashlib
 import fnmatch
 import re
 
@@ -19,6 +21,18 @@ class DataAPI(object):
 
     DefaultAuthorityName = None
 
+    # files opened for writing are buffered in memory up to this many bytes
+    WriteBufferSize = 8 * 2**20
+
+    # checksum algorithm for new versions: 'md5', 'sha256', or 'blake2b'
+    # (see datafs.core.hashing.Algorithms)
+    HashAlgorithm = 'md5'
+
+    # if set, files are hashed as a tree of segments of this many bytes,
+    # hashed on HashThreads threads
+    HashSegmentSize = None
+    HashThreads = 4
+
     _ArchiveConstructor = DataArchive
 
     def __init__(self, default_versions=None, **kwargs):
@@ -37,12 +51,16 @@ class DataAPI(object):
         self._authorities_locked = False
         self._manager_locked = False
 
-    def attach_authority(self, service_name, service):
+        # reject unavailable hash algorithms before any files are written
+        self.get_hash_algorithm()
+
+    def attach_authority(self, service_name, service, chunk_size=None):
 
         if self._authorities_locked:
             raise PermissionError('Authorities locked')
 
-        self._authorities[service_name] = DataService(service)
+        self._authorities[service_name] = DataService(
+            service, chunk_size=chunk_size)
 
     def lock_authorities(self):
         self._authorities_locked = True
@@ -50,12 +68,73 @@ class DataAPI(object):
     def lock_manager(self):
         self._manager_locked = True
 
-    def attach_cache(self, service):
+    def attach_cache(
+            self,
+            service,
+            verify='on-change',
+            sample_rate=0.1,
+            chunk_size=None,
+            link=False,
+            max_size=None,
+            eviction='lru',
+            prefix_quotas=None):
+        '''
+        Attach a filesystem to use as a local cache
+
+        Parameters
+        ----------
+
+        service : object
+            :py:mod:`pyFilesystem` filesystem object
+
+        verify : str
+            When to re-hash cached files on read. See
+            :py:class:`~datafs.services.cache_index.CacheIndex` (default
+            ``'on-change'``)
+
+        sample_rate : float
+            Fraction of reads re-hashed with ``verify='sampled'`` (default
+            0.1)
+
+        chunk_size : int
+            Number of bytes read at a time when copying files into the cache
+            (default :py:data:`~datafs.services.transfer.DefaultChunkSize`)
+
+        link : bool
+            Hard link versioned files into the cache instead of copying them
+            when the authority is on the same local device. Cached files must
+            then never be modified in place (default False)
+
+        max_size : int
+            Number of bytes of archives kept in the cache. Files are evicted
+            once the cache is larger, except pinned files and files open in
+            this process. Files open in other processes sharing the cache
+            are not protected (default None, unbounded)
+
+        eviction : str
+            ``'lru'`` to evict the least recently used files first, or
+            ``'lfu'`` the least frequently used (default ``'lru'``)
+
+        prefix_quotas : dict
+            Number of bytes kept under each archive path prefix, e.g.
+            ``{'team1/': 2**30}`` (default None)
+
+        '''
 
         if service in self._authorities.values():
             raise ValueError('Cannot attach an authority as a cache')
         else:
-            self._cache = DataService(service)
+            self._cache = DataService(
+                service,
+                index=CacheIndex(
+                    service,
+                    verify=verify,
+                    sample_rate=sample_rate,
+                    max_size=max_size,
+                    eviction=eviction,
+                    prefix_quotas=prefix_quotas),
+                chunk_size=chunk_size,
+                link=link)
 
     @property
     def manager(self):
@@ -162,13 +241,193 @@ class DataAPI(object):
 
         res = self.manager.get_archive(archive_name)
 
-        default_version = self._default_versions.get(archive_name, None)
+        if default_version is None:
+            default_version = self._default_versions.get(archive_name, None)
 
         return self._ArchiveConstructor(
             api=self,
             default_version=default_version,
             **res)
 
+    def get_archives(self, archive_names, raise_on_err=True):
+        '''
+        Retrieve many archives with a single bulk manager lookup
+
+        Parameters
+        ----------
+
+        archive_names : list
+            Names of the archives to retrieve
+
+        raise_on_err : bool
+            Raise a :py:exc:`KeyError` listing every archive which was not
+            found (default True). If False, missing archives are returned as
+            ``None``.
+
+        Returns
+        -------
+
+        archives : list
+            :py:class:`~datafs.core.data_archive.DataArchive` objects in the
+            order of ``archive_names``
+
+        '''
+
+        archive_names = list(archive_names)
+
+        specs = self.manager.get_archives(archive_names)
+
+        missing = [
+            archive_name for archive_name in archive_names
+            if archive_name not in specs]
+
+        if raise_on_err and len(missing) > 0:
+            raise KeyError('Archives not found: {}'.format(
+                ', '.join(map('"{}"'.format, missing))))
+
+        # version ranges in the requirements file are resolved together
+        ranges = {
+            archive_name: self._default_versions[archive_name]
+            for archive_name in specs
+            if specs[archive_name]['versioned']
+            and self._is_range(self._default_versions.get(archive_name))}
+
+        default_versions = dict(self._default_versions)
+
+        for archive_name, version in self._resolve_ranges(ranges).items():
+            if version is not None:
+                default_versions[archive_name] = str(version)
+
+        archives = []
+
+        for archive_name in archive_names:
+            if archive_name not in specs:
+                archives.append(None)
+                continue
+
+            archives.append(self._ArchiveConstructor(
+                api=self,
+                default_version=default_versions.get(archive_name),
+                **specs[archive_name]))
+
+        return archives
+
+    def resolve_versions(self, requirements=None):
+        '''
+        Resolve version requirements for many archives at once
+
+        Archives are retrieved with a single bulk manager lookup. Exact pins
+        resolve to the pinned version, and are checked against the archive's
+        history when the version is read. Latest versions are read in bulk
+        from the archive records. Only version ranges need the archives'
+        version histories, which are retrieved in bulk and indexed.
+
+        Parameters
+        ----------
+
+        requirements : dict
+            Version specifiers (see
+            :py:class:`~datafs.core.versions.VersionSpecifier`), keyed by
+            archive name. A specifier of None or ``'latest'`` resolves to the
+            latest version. Defaults to the API's requirements file.
+
+        Returns
+        -------
+
+        versions : dict
+            :py:class:`~datafs.core.versions.BumpableVersion` objects keyed
+            by archive name. Unversioned archives map to None.
+
+        '''
+
+        if requirements is None:
+            requirements = self._default_versions
+
+        specs = self.manager.get_archives(list(requirements.keys()))
+
+        missing = [
+            archive_name for archive_name in requirements
+            if archive_name not in specs]
+
+        if len(missing) > 0:
+            raise KeyError('Archives not found: {}'.format(
+                ', '.join(map('"{}"'.format, missing))))
+
+        versions = {}
+        latest = []
+        ranges = {}
+
+        for archive_name, specifier in requirements.items():
+            if not specs[archive_name]['versioned']:
+                versions[archive_name] = None
+
+            elif specifier is None or specifier == 'latest':
+                latest.append(archive_name)
+
+            elif self._is_range(specifier):
+                ranges[archive_name] = specifier
+
+            else:
+                versions[archive_name] = BumpableVersion(
+                    VersionSpecifier(specifier).pinned)
+
+        if len(latest) > 0:
+            for archive_name, version in self.manager.get_latest_versions(
+                    latest).items():
+
+                versions[archive_name] = (
+                    None if version is None else BumpableVersion(version))
+
+        versions.update(self._resolve_ranges(ranges))
+
+        unresolved = [
+            archive_name for archive_name in requirements
+            if specs[archive_name]['versioned']
+            and versions.get(archive_name) is None]
+
+        if len(unresolved) > 0:
+            raise ValueError(
+                'Archive "{}" has no version matching "{}"'.format(
+                    unresolved[0], requirements[unresolved[0]]))
+
+        return versions
+
+    @staticmethod
+    def _is_range(specifier):
+        '''
+        Whether a requirement needs the version history to be resolved
+
+        .. code-block:: python
+
+            >>> DataAPI._is_range('>=1.2, <2.0')
+            True
+            >>> DataAPI._is_range('==1.2') or DataAPI._is_range('latest')
+            False
+
+        '''
+
+        return (
+            specifier not in (None, 'latest')
+            and VersionSpecifier(specifier).pinned is None)
+
+    def _resolve_ranges(self, ranges):
+        '''
+        Resolve version ranges against bulk-retrieved version histories
+
+        Ranges matching no version resolve to None.
+        '''
+
+        if len(ranges) == 0:
+            return {}
+
+        version_histories = self.manager.get_version_histories(
+            list(ranges.keys()))
+
+        return {
+            archive_name: VersionSpecifier(specifier).resolve(
+                VersionIndex(version_histories.get(archive_name, [])))
+            for archive_name, specifier in ranges.items()}
+
     def filter(self, pattern=None, engine='path', prefix=None):
         '''
 
@@ -287,12 +546,26 @@ class DataAPI(object):
 
         archive.delete()
 
-    @staticmethod
-    def hash_file(f):
+    @classmethod
+    def get_hash_algorithm(cls):
+        '''
+        Name of the algorithm recorded with the checksums of new versions
+
+        Combines :py:attr:`HashAlgorithm` and :py:attr:`HashSegmentSize`, e.g.
+        ``'md5'`` or ``'sha256-tree-67108864'``.
+        '''
+
+        return hashing.get_algorithm_name(
+            cls.HashAlgorithm, cls.HashSegmentSize)
+
+    @classmethod
+    def hash_file(cls, f, algorithm=None):
         '''
         Utility function for hashing file contents
 
-        Overload this function to change the file equality checking algorithm
+        Set :py:attr:`HashAlgorithm` and :py:attr:`HashSegmentSize` to change
+        the algorithm used for new versions. Existing versions are verified
+        with the algorithm recorded in their version metadata.
 
         Parameters
         ----------
@@ -300,21 +573,72 @@ class DataAPI(object):
         f : file-like
             File-like object or file path from which to compute checksum value
 
+        algorithm : str
+            Recorded algorithm name (default
+            :py:meth:`~DataAPI.get_hash_algorithm`)
 
         Returns
         -------
         checksum : dict
-            dictionary with {'algorithm': 'md5', 'checksum': hexdigest}
+            dictionary with {'algorithm': algorithm, 'checksum': hexdigest}
+
+        '''
+
+        if algorithm is None:
+            algorithm = cls.get_hash_algorithm()
+
+        return hashing.hash_file(f, algorithm, threads=cls.HashThreads)
+
+    @classmethod
+    def new_hash(cls, algorithm=None):
+        '''
+        Return a hash object for computing checksums incrementally
+
+        Used to hash files as they are written. Returns None, disabling
+        incremental hashing, if :py:meth:`~DataAPI.hash_file` is overloaded
+        by a subclass. Overload this function as well to return a matching
+        hash object.
+
+        Parameters
+        ----------
+
+        algorithm : str
+            Recorded algorithm name (default
+            :py:meth:`~DataAPI.get_hash_algorithm`)
+
+        Returns
+        -------
+        hash : object
+            hash object with ``name``, ``update``, and ``hexdigest``
+            attributes, or None
+
+        '''
+
+        # checksums from an overloaded hash_file can't be reproduced here
+        if cls._overloads_hash_file():
+            return None
+
+        if algorithm is None:
+            algorithm = cls.get_hash_algorithm()
+
+        return hashing.new_hash(algorithm)
+
+    @classmethod
+    def _overloads_hash_file(cls):
+        '''
+        Whether a subclass defines its own :py:meth:`~DataAPI.hash_file`
 
+        Overloads may be static, class or instance methods.
         '''
 
-        md5 = hashlib.md5()
+        for klass in cls.__mro__:
+            if klass is DataAPI:
+                return False
 
-        with open_filelike(f, 'rb') as f_obj:
-            for chunk in iter(lambda: f_obj.read(128 * md5.block_size), b''):
-                md5.update(chunk)
+            if 'hash_file' in vars(klass):
+                return True
 
-        return {'algorithm': 'md5', 'checksum': md5.hexdigest()}
+        return False
 
     def close(self):
         for service in self._authorities:
@@ -1,14 +1,20 @@
 from __future__ import absolute_import
 
 from datafs.core import data_file
-from datafs.core.versions import BumpableVersion
+from datafs.core.versions import (
+    BumpableVersion, VersionIndex, VersionSpecifier)
 from datafs._compat import string_types
+from datafs.services import transfer
 from contextlib import contextmanager
-import fs.utils
 import fs.path
 from fs.osfs import OSFS
+from fs.errors import FSError
+import inspect
+import mmap
 import os
 
+_getargspec = getattr(inspect, 'getfullargspec', None) or inspect.getargspec
+
 
 def _process_version(self, version):
     if not self.versioned and version is None:
@@ -30,6 +36,23 @@ def _process_version(self, version):
         return BumpableVersion(version)
 
 
+def _accepts_algorithm(hash_file):
+    '''
+    Whether a hash_file function takes an ``algorithm`` argument
+    '''
+
+    try:
+        spec = _getargspec(hash_file)
+
+    except TypeError:
+        return False
+
+    return (
+        'algorithm' in spec.args
+        or 'algorithm' in getattr(spec, 'kwonlyargs', [])
+        or spec[2] is not None)
+
+
 class DataArchive(object):
 
     def __init__(
@@ -50,6 +73,9 @@ class DataArchive(object):
         self._versioned = versioned
         self._default_version = default_version
 
+        self._version_index = None
+        self._version_index_count = None
+
     def __repr__(self):
         return "<{} {}://{}>".format(self.__class__.__name__,
                                      self.authority_name, self.archive_name)
@@ -60,47 +86,61 @@ class DataArchive(object):
 
     def get_latest_version(self):
 
-        versions = self.get_versions()
+        if not self.versioned:
+            return None
 
-        if len(versions) == 0:
+        version = self.api.manager.get_latest_version(self.archive_name)
+
+        if version is None:
             return None
 
-        else:
-            return max(versions)
+        return BumpableVersion(version)
 
-    def get_versions(self):
+    def get_version_index(self):
+        '''
+        Returns a :py:class:`~datafs.core.versions.VersionIndex` of the
+        archive's version history
 
-        versions = self.get_history()
+        The index is cached on the archive and rebuilt only when the
+        manager's version count shows the history has changed.
+        '''
 
-        if len(versions) == 0:
-            return []
+        count = self.api.manager.get_version_count(self.archive_name)
+
+        if self._version_index is None or count != self._version_index_count:
+            self._version_index = VersionIndex(self.get_history())
+            self._version_index_count = count
+
+        return self._version_index
+
+    def get_versions(self):
+
+        if not self.versioned:
+            if len(self.get_history()) == 0:
+                return []
 
-        elif not self.versioned:
             return [None]
 
-        else:
-            return sorted(map(BumpableVersion, set(
-                [v['version'] for v in versions])))
+        return self.get_version_index().versions
 
     def get_default_version(self):
 
         if not self.versioned:
             return None
 
-        versions = self.get_versions()
-
         if self._default_version is None or self._default_version == 'latest':
-            if len(versions) == 0:
-                return None
+            return self.get_latest_version()
+
+        specifier = VersionSpecifier(self._default_version)
 
-            return max(versions)
+        # exact pins are checked against the history when they are read
+        if specifier.pinned is not None:
+            return BumpableVersion(specifier.pinned)
 
-        matches = filter(
-            lambda v: v == self._default_version,
-            self.get_versions())
+        version = specifier.resolve(self.get_version_index())
 
-        if len(matches) > 0:
-            return max(matches)
+        if version is not None:
+            return version
 
         raise ValueError('Archive "{}" version {} not found'.format(
             self.archive_name, self._default_version))
@@ -165,8 +205,9 @@ class DataArchive(object):
     def get_metadata(self):
         return self.api.manager.get_metadata(self.archive_name)
 
-    def get_history(self):
-        return self.api.manager.get_version_history(self.archive_name)
+    def get_history(self, limit=None, after=None):
+        return self.api.manager.get_version_history(
+            self.archive_name, limit=limit, after=after)
 
     def get_latest_hash(self):
         return self.api.manager.get_latest_hash(self.archive_name)
@@ -178,9 +219,13 @@ class DataArchive(object):
             if version is None:
                 return None
 
-            for ver in self.get_history():
-                if BumpableVersion(ver['version']) == version:
-                    return ver['checksum']
+            if version == self.get_latest_version():
+                return self.get_latest_hash()
+
+            version_metadata = self.get_version_index().find(version)
+
+            if version_metadata is not None:
+                return version_metadata['checksum']
 
             raise ValueError(
                 'Version "{}" not found in archive history'.format(version))
@@ -188,6 +233,63 @@ class DataArchive(object):
         else:
             return self.get_latest_hash()
 
+    def get_version_algorithm(self, version=None):
+        '''
+        Hash algorithm recorded with a version's checksum
+        '''
+
+        version = _process_version(self, version)
+
+        if self.versioned:
+
+            if version is None:
+                return None
+
+            if version == self.get_latest_version():
+                return self.api.manager.get_latest_algorithm(self.archive_name)
+
+            version_metadata = self.get_version_index().find(version)
+
+            if version_metadata is not None:
+                return version_metadata.get('algorithm')
+
+            raise ValueError(
+                'Version "{}" not found in archive history'.format(version))
+
+        else:
+            return self.api.manager.get_latest_algorithm(self.archive_name)
+
+    def _get_hasher(self, algorithm=None):
+        '''
+        Return a function hashing files with ``algorithm``
+
+        Existing versions are checked with the algorithm recorded in their
+        metadata, which may differ from the API's current algorithm.
+        '''
+
+        hash_file = self.api.hash_file
+
+        # overloads of the original hash_file(f) use their own algorithm
+        if (algorithm is None
+                or algorithm == self.api.get_hash_algorithm()
+                or not _accepts_algorithm(hash_file)):
+            return hash_file
+
+        def hasher(f):
+            return hash_file(f, algorithm=algorithm)
+
+        return hasher
+
+    def _get_new_hash(self, algorithm=None):
+
+        if algorithm is None or algorithm == self.api.get_hash_algorithm():
+            return self.api.new_hash
+
+        def new_hash():
+            return self.api.new_hash(algorithm)
+
+        return new_hash
+
     def update(
             self,
             filepath,
@@ -237,19 +339,41 @@ class DataArchive(object):
             metadata = {}
 
         latest_version = self.get_latest_version()
+        latest_hash = self.get_latest_hash()
 
-        hashval = self.api.hash_file(filepath)
+        hash_obj = self.api.new_hash()
 
-        checksum = hashval['checksum']
-        algorithm = hashval['algorithm']
+        # A file which differs in size from the latest version must have
+        # changed, so it can be hashed while it is uploaded. Otherwise, hash
+        # it first to check whether an update is needed.
+        if hash_obj is None or self._may_match_latest(
+                filepath, latest_version, latest_hash):
 
-        if checksum == self.get_latest_hash():
-            self.update_metadata(metadata)
+            if latest_hash is not None:
+                latest_algorithm = self.api.manager.get_latest_algorithm(
+                    self.archive_name)
+            else:
+                latest_algorithm = None
 
-            if remove and os.path.isfile(filepath):
-                os.remove(filepath)
+            hashval = self._get_hasher(latest_algorithm)(filepath)
 
-            return
+            if hashval['checksum'] == latest_hash:
+                self.update_metadata(metadata)
+
+                if remove and os.path.isfile(filepath):
+                    os.remove(filepath)
+
+                return
+
+            # new versions are recorded with the API's current algorithm
+            if latest_algorithm not in (None, self.api.get_hash_algorithm()):
+                if hash_obj is None:
+                    hashval = self.api.hash_file(filepath)
+                else:
+                    hashval = None
+
+        else:
+            hashval = None
 
         if self.versioned:
             if latest_version is None:
@@ -268,27 +392,62 @@ class DataArchive(object):
         if cache:
             self.cache(next_version)
 
-        if self.is_cached(next_version):
+        cached = self.is_cached(next_version)
+
+        if hashval is None:
+            targets = [(self.authority, next_path)]
+
+            if cached:
+                targets.append((self.api.cache, next_path))
+
+            hashval = data_file.upload_and_hash(filepath, targets, hash_obj)
+
+            if remove and os.path.isfile(filepath):
+                os.remove(filepath)
+
+        elif cached:
             self.authority.upload(filepath, next_path)
             self.api.cache.upload(filepath, next_path, remove=remove)
 
         else:
             self.authority.upload(filepath, next_path, remove=remove)
 
+        if cached and self.api.cache.index is not None:
+            self.api.cache.index.record(next_path, hashval)
+
         self._update_manager(
             archive_metadata=metadata,
             version_metadata=dict(
-                checksum=checksum,
-                algorithm=algorithm,
+                checksum=hashval['checksum'],
+                algorithm=hashval['algorithm'],
                 version=next_version,
                 dependencies=dependencies))
 
+    def _may_match_latest(self, filepath, latest_version, latest_hash):
+        '''
+        Whether a local file could have the same contents as the latest
+        version, judged by comparing file sizes
+        '''
+
+        if latest_hash is None:
+            return False
+
+        try:
+            latest_size = self.authority.fs.getsize(
+                self.get_version_path(latest_version))
+
+        except FSError:
+            return True
+
+        return latest_size == os.path.getsize(filepath)
+
     def _get_default_dependencies(self):
         '''
         Get default dependencies for archive
 
         Get default dependencies from requirements file or (if no requirements
-        file) from previous version
+        file) from previous version. Version ranges in the requirements file
+        are resolved to the versions they currently match.
         '''
 
         # Get default dependencies from requirements file
@@ -296,6 +455,19 @@ class DataArchive(object):
             k: v for k,
             v in self.api._default_versions.items() if k != self.archive_name}
 
+        ranges = {
+            archive_name: specifier
+            for archive_name, specifier in default_dependencies.items()
+            if specifier not in (None, 'latest')
+            and VersionSpecifier(specifier).pinned is None}
+
+        if len(ranges) > 0:
+            for archive_name, version in self.api.resolve_versions(
+                    ranges).items():
+
+                default_dependencies[archive_name] = (
+                    None if version is None else str(version))
+
         # If no requirements file or is empty:
         if len(default_dependencies) == 0:
 
@@ -303,7 +475,8 @@ class DataArchive(object):
             history = self.get_history()
 
             if len(history) > 0:
-                default_dependencies = history[-1].get('dependencies', {})
+                default_dependencies = dict(
+                    history[-1].get('dependencies', {}))
 
         return default_dependencies
 
@@ -324,9 +497,11 @@ class DataArchive(object):
 
         self._set_version_defaults(version_metadata)
 
-        # update records in self.api.manager
-        self.api.manager.update(self.archive_name, version_metadata)
-        self.update_metadata(archive_metadata)
+        # update version history and archive metadata in one write
+        self.api.manager.update(
+            self.archive_name,
+            version_metadata,
+            archive_metadata=archive_metadata)
 
     def update_metadata(self, metadata):
 
@@ -390,6 +565,7 @@ class DataArchive(object):
         version = _process_version(self, version)
 
         version_hash = self.get_version_hash(version)
+        algorithm = self.get_version_algorithm(version)
 
         if self.versioned:
 
@@ -433,9 +609,12 @@ class DataArchive(object):
             self.api.cache,
             updater,
             version_check,
-            self.api.hash_file,
+            self._get_hasher(algorithm),
             read_path,
             write_path,
+            immutable=self.versioned,
+            spool_size=self.api.WriteBufferSize,
+            new_hash=self._get_new_hash(algorithm),
             mode=mode,
             *args,
             **kwargs)
@@ -450,7 +629,8 @@ class DataArchive(object):
             bumpversion=None,
             prerelease=None,
             dependencies=None,
-            metadata=None):
+            metadata=None,
+            mode='r+'):
         '''
         Returns a local path for read/write
 
@@ -459,6 +639,12 @@ class DataArchive(object):
         version : str
             Version number of the file to retrieve (default latest)
 
+        mode : str
+            ``'r'`` returns the path to the file in the cache or authority
+            for reading only, without a temporary copy. Changes made to the
+            file are not uploaded. ``'r+'`` returns a temporary copy which is
+            uploaded on exit if modified (default ``'r+'``).
+
         bumpversion : str
             Version component to update on write if archive is versioned. Valid
             bumpversion values are 'major', 'minor', and 'patch', representing
@@ -484,10 +670,17 @@ class DataArchive(object):
         if metadata is None:
             metadata = {}
 
+        if mode == 'r':
+            with self._get_local_read_path(version) as fp:
+                yield fp
+
+            return
+
         latest_version = self.get_latest_version()
         version = _process_version(self, version)
 
         version_hash = self.get_version_hash(version)
+        algorithm = self.get_version_algorithm(version)
 
         if self.versioned:
 
@@ -530,13 +723,102 @@ class DataArchive(object):
             self.api.cache,
             updater,
             version_check,
-            self.api.hash_file,
+            self._get_hasher(algorithm),
             read_path,
-            write_path)
+            write_path,
+            immutable=self.versioned)
+
+        with path as fp:
+            yield fp
+
+    @contextmanager
+    def _get_local_read_path(self, version=None):
+        '''
+        Returns a local path for reading, without a temporary copy
+        '''
+
+        version = _process_version(self, version)
+        version_hash = self.get_version_hash(version)
+        algorithm = self.get_version_algorithm(version)
+
+        # version_check returns true if fp's hash is current as of read
+        def version_check(chk):
+            return chk['checksum'] == version_hash
+
+        path = data_file.get_local_path(
+            self.authority,
+            self.api.cache,
+            None,
+            version_check,
+            self._get_hasher(algorithm),
+            self.get_version_path(version),
+            immutable=self.versioned,
+            mode='r')
 
         with path as fp:
             yield fp
 
+    @contextmanager
+    def open_mmap(self, version=None, as_memoryview=False):
+        '''
+        Memory-maps the archive for read-only access
+
+        The requested version is retrieved as with
+        ``get_local_path(mode='r')`` and mapped into memory without copying
+        its contents into python objects. Arrays can be created from the map
+        with no copies, e.g. using ``numpy.frombuffer``.
+
+        Parameters
+        ----------
+        version : str
+            Version number of the file to map (default latest)
+
+        as_memoryview : bool
+            Yield a read-only ``memoryview`` of the map rather than the
+            :py:class:`mmap.mmap` object (python 3 only, default False)
+
+        Examples
+        --------
+
+        .. code-block:: python
+
+            >>> with archive.open_mmap() as buf:  # doctest: +SKIP
+            ...     arr = np.frombuffer(buf, dtype='float64')
+
+        '''
+
+        with self._get_local_read_path(version) as fp:
+            with open(fp, 'rb') as f:
+
+                # empty files cannot be mapped
+                if os.fstat(f.fileno()).st_size == 0:
+                    yield memoryview(b'') if as_memoryview else b''
+                    return
+
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+                try:
+                    if as_memoryview:
+                        view = memoryview(mapped)
+
+                        try:
+                            yield view
+
+                        finally:
+                            view.release()
+
+                    else:
+                        yield mapped
+
+                finally:
+                    try:
+                        mapped.close()
+
+                    except BufferError:
+                        # buffers created from the map are still in use.
+                        # The map is closed once they are released.
+                        pass
+
     def download(self, filepath, version=None):
         '''
         Downloads a file from authority to local path
@@ -557,13 +839,14 @@ class DataArchive(object):
         local = OSFS(dirname)
 
         version_hash = self.get_version_hash(version)
+        algorithm = self.get_version_algorithm(version)
 
         # version_check returns true if fp's hash is current as of read
         def version_check(chk):
             return chk['checksum'] == version_hash
 
         if os.path.exists(filepath):
-            if version_check(self.api.hash_file(filepath)):
+            if version_check(self._get_hasher(algorithm)(filepath)):
                 return
 
         read_path = self.get_version_path(version)
@@ -573,13 +856,15 @@ class DataArchive(object):
                 self.api.cache,
                 read_path,
                 version_check,
-                self.api.hash_file) as read_fs:
+                self._get_hasher(algorithm),
+                immutable=self.versioned) as read_fs:
 
-            fs.utils.copyfile(
+            transfer.copy(
                 read_fs,
                 read_path,
                 local,
-                filename)
+                filename,
+                chunk_size=self.authority.chunk_size)
 
     def delete(self):
         '''
@@ -604,6 +889,10 @@ class DataArchive(object):
                 if self.api.cache.fs.exists(self.get_version_path(version)):
                     self.api.cache.fs.remove(self.get_version_path(version))
 
+                if self.api.cache.index is not None:
+                    self.api.cache.index.invalidate(
+                        self.get_version_path(version))
+
     def isfile(self, version=None, *args, **kwargs):
         '''
         Check whether the path exists and is a file
@@ -688,6 +977,42 @@ class DataArchive(object):
         if self.api.cache.fs.isfile(self.get_version_path(version)):
             self.api.cache.fs.remove(self.get_version_path(version))
 
+        if self.api.cache.index is not None:
+            self.api.cache.index.invalidate(self.get_version_path(version))
+
+    def pin(self, version=None):
+        '''
+        Keep a version in the cache regardless of the cache's quota
+
+        Pins are recorded in the cache's index, and apply to all APIs sharing
+        the cache. The version is cached when it is next read.
+        '''
+        version = _process_version(self, version)
+
+        if not self.api.cache or self.api.cache.index is None:
+            raise ValueError('No cache attached')
+
+        self.api.cache.index.pin(self.get_version_path(version))
+
+    def unpin(self, version=None):
+        '''
+        Allow a pinned version to be evicted from the cache
+        '''
+        version = _process_version(self, version)
+
+        if not self.api.cache or self.api.cache.index is None:
+            raise ValueError('No cache attached')
+
+        self.api.cache.index.unpin(self.get_version_path(version))
+
+    def is_pinned(self, version=None):
+        version = _process_version(self, version)
+
+        if not self.api.cache or self.api.cache.index is None:
+            return False
+
+        return self.api.cache.index.is_pinned(self.get_version_path(version))
+
     def get_dependencies(self, version=None):
         '''
         Parameters
@@ -698,11 +1023,16 @@ class DataArchive(object):
         '''
 
         version = _process_version(self, version)
-        history = self.get_history()
 
-        for v in reversed(history):
-            if BumpableVersion(v['version']) == version:
-                return v['dependencies']
+        if not self.versioned:
+            history = self.get_history()
+            version_metadata = history[-1] if len(history) > 0 else None
+
+        else:
+            version_metadata = self.get_version_index().find(version)
+
+        if version_metadata is not None:
+            return version_metadata['dependencies']
 
         raise ValueError('Version {} not found'.format(version))
 
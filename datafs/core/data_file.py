@@ -1,13 +1,16 @@
 
-import fs.utils
 import fs.path
+import io
+import os
 import tempfile
 import shutil
 import time
 from fs.osfs import OSFS
 from fs.multifs import MultiFS
 
-from fs.errors import (ResourceLockedError)
+from fs.errors import (ResourceLockedError, ResourceNotFoundError)
+
+from datafs.services import ranged, transfer
 
 from contextlib import contextmanager
 
@@ -40,11 +43,124 @@ def _touch(filesystem, path):
         filesystem.createfile(path)
 
 
+def _get_cached_checksum(cache, path, hasher, immutable=False):
+    '''
+    Checksum of a cached file, using the cache's checksum index if available
+    '''
+
+    if cache.index is None:
+        with cache.fs.open(path, 'rb') as f:
+            return hasher(f)
+
+    return cache.index.checksum(path, hasher, immutable=immutable)
+
+
+def _record_cached_checksum(cache, path, checksum):
+    if cache.index is not None:
+        cache.index.record(path, checksum)
+
+
+@contextmanager
+def _hold_cached(cache, path):
+    '''
+    Protect a cached file from eviction while it is in use
+    '''
+
+    if cache and cache.index is not None:
+        with cache.index.in_use(path):
+            yield
+
+    else:
+        yield
+
+
+def _get_checksum(hash_obj):
+    '''
+    Checksum dictionary of a completed hash object
+    '''
+
+    # hashlib names algorithms in upper case on python 2
+    return {
+        'algorithm': hash_obj.name.lower(),
+        'checksum': hash_obj.hexdigest()}
+
+
+class _HashingSpool(io.RawIOBase):
+    '''
+    Raw file object writing to a spooled temporary file
+
+    Bytes written sequentially from the start of the file are hashed as
+    they are written. If the file is rewritten after a seek or truncate,
+    incremental hashing is abandoned and ``hash_obj`` is set to None.
+    '''
+
+    def __init__(self, spool, hash_obj=None):
+        self.spool = spool
+        self.hash_obj = hash_obj
+
+        self._hashed = 0
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.spool.read(len(b))
+        b[:len(data)] = data
+
+        return len(data)
+
+    def write(self, b):
+        # bytes(memoryview) is the view's repr on python 2
+        b = memoryview(b).tobytes()
+
+        if self.hash_obj is not None:
+            if self.spool.tell() == self._hashed:
+                self.hash_obj.update(b)
+                self._hashed += len(b)
+
+            else:
+                self.hash_obj = None
+
+        self.spool.write(b)
+
+        return len(b)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.spool.seek(offset, whence)
+        return self.spool.tell()
+
+    def tell(self):
+        return self.spool.tell()
+
+    def truncate(self, size=None):
+        if size is None:
+            size = self.spool.tell()
+
+        if size < self._hashed:
+            self.hash_obj = None
+
+        self.spool.truncate(size)
+
+        return size
+
+
 # HELPER CONTEXT MANAGERS
 
 
 @contextmanager
-def _choose_read_fs(authority, cache, read_path, version_check, hasher):
+def _choose_read_fs(
+        authority,
+        cache,
+        read_path,
+        version_check,
+        hasher,
+        immutable=False):
     '''
     Context manager returning the appropriate up-to-date readable filesystem
 
@@ -52,30 +168,44 @@ def _choose_read_fs(authority, cache, read_path, version_check, hasher):
     ``read_path``, otherwise use ``authority``. If the file at
     ``read_path`` is out of date, update the file in ``cache`` before
     returning it.
+
+    The cached file's checksum is looked up in the cache's checksum index
+    where possible. ``immutable`` marks ``read_path`` as a versioned path
+    whose contents never change. The cached file is not evicted from a
+    bounded cache until the context exits.
     '''
 
-    if cache and cache.fs.isfile(read_path):
-        if version_check(hasher(cache.fs.open(read_path, 'rb'))):
-            yield cache.fs
+    with _hold_cached(cache, read_path):
+        if cache and cache.fs.isfile(read_path):
+            if version_check(_get_cached_checksum(
+                    cache, read_path, hasher, immutable=immutable)):
 
-        elif authority.fs.isfile(read_path):
-            fs.utils.copyfile(
-                authority.fs,
-                read_path,
-                cache.fs,
-                read_path)
-            yield cache.fs
+                yield cache.fs
 
-        else:
-            _makedirs(authority.fs, fs.path.dirname(read_path))
-            _makedirs(cache.fs, fs.path.dirname(read_path))
-            yield cache.fs
+            elif authority.fs.isfile(read_path):
+                transfer.copy(
+                    authority.fs,
+                    read_path,
+                    cache.fs,
+                    read_path,
+                    chunk_size=cache.chunk_size,
+                    link=(immutable and cache.link))
 
-    else:
-        if not authority.fs.isfile(read_path):
-            _makedirs(authority.fs, fs.path.dirname(read_path))
+                if cache.index is not None:
+                    cache.index.record(read_path)
+
+                yield cache.fs
+
+            else:
+                _makedirs(authority.fs, fs.path.dirname(read_path))
+                _makedirs(cache.fs, fs.path.dirname(read_path))
+                yield cache.fs
+
+        else:
+            if not authority.fs.isfile(read_path):
+                _makedirs(authority.fs, fs.path.dirname(read_path))
 
-        yield authority.fs
+            yield authority.fs
 
 
 @contextmanager
@@ -85,14 +215,9 @@ def _get_write_fs():
 
     Use a temporary directory and clean on exit.
 
-    .. todo::
-
-        Evaluate options for using a cached memoryFS or streaming object
-        instead of an OSFS(tmp). This could offer significant performance
-        improvements. Writing to the cache is less of a problem since this
-        would be done in any case, though performance could be improved by
-        writing to an in-memory filesystem and then writing to both cache and
-        auth.
+    New files opened with ``'w'`` modes are buffered in memory instead (see
+    :py:func:`_open_spooled_write`). This filesystem is used for read/write
+    and append modes, which need a copy of the existing file.
 
     '''
 
@@ -131,8 +256,7 @@ def _prepare_write_fs(read_fs, cache, read_path, readwrite_mode=True):
                 _touch(write_fs, read_path)
 
                 if read_fs.isfile(read_path):
-                    fs.utils.copyfile(
-                        read_fs, read_path, write_fs, read_path)
+                    transfer.copy(read_fs, read_path, write_fs, read_path)
 
         else:
             _touch(write_fs, read_path)
@@ -140,6 +264,229 @@ def _prepare_write_fs(read_fs, cache, read_path, readwrite_mode=True):
         yield write_fs
 
 
+@contextmanager
+def _get_read_path(
+        authority,
+        cache,
+        version_check,
+        hasher,
+        read_path,
+        immutable=False):
+    '''
+    Context manager returning a system path from which to read the archive
+
+    Yields the path to the up-to-date file in ``cache`` or ``authority``
+    directly. If neither filesystem has a system path for the file, it is
+    downloaded once into the cache, or, with no local cache, into a
+    temporary directory removed on exit.
+    '''
+
+    with _choose_read_fs(
+            authority,
+            cache,
+            read_path,
+            version_check,
+            hasher,
+            immutable=immutable) as read_fs:
+
+        if not read_fs.isfile(read_path):
+            raise ResourceNotFoundError(read_path)
+
+        if read_fs.hassyspath(read_path):
+            yield read_fs.getsyspath(read_path)
+
+        elif cache and cache.fs.hassyspath(read_path):
+            _makedirs(cache.fs, fs.path.dirname(read_path))
+            transfer.copy(
+                read_fs,
+                read_path,
+                cache.fs,
+                read_path,
+                chunk_size=cache.chunk_size)
+
+            if cache.index is not None:
+                cache.index.record(read_path)
+
+            yield cache.fs.getsyspath(read_path)
+
+        else:
+            with _get_write_fs() as tmp_fs:
+                _makedirs(tmp_fs, fs.path.dirname(read_path))
+                transfer.copy(read_fs, read_path, tmp_fs, read_path)
+
+                yield tmp_fs.getsyspath(read_path)
+
+
+@contextmanager
+def _open_spooled_write(
+        authority,
+        cache,
+        update,
+        version_check,
+        hasher,
+        read_path,
+        write_path,
+        cache_on_write,
+        mode,
+        spool_size,
+        new_hash=None,
+        encoding=None,
+        errors=None,
+        newline=None):
+    '''
+    Context manager opening a new file in memory and uploading on changes
+
+    Data is held in a :py:class:`tempfile.SpooledTemporaryFile`, which is
+    written to disk only once it grows beyond ``spool_size`` bytes. If
+    ``new_hash`` is provided, the file is hashed as it is written.
+    '''
+
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+
+    try:
+        raw = _HashingSpool(
+            spool, new_hash() if new_hash is not None else None)
+
+        f = io.BufferedRandom(raw)
+
+        if 'b' not in mode:
+            f = io.TextIOWrapper(
+                f,
+                encoding=encoding or 'utf-8',
+                errors=errors,
+                newline=newline)
+
+        with f:
+            yield f
+
+        spool.seek(0, io.SEEK_END)
+
+        if spool.tell() == 0:
+            return
+
+        if raw.hash_obj is not None:
+            checksum = _get_checksum(raw.hash_obj)
+
+        else:
+            spool.seek(0)
+            checksum = hasher(spool)
+
+        if version_check(checksum):
+            return
+
+        targets = [authority]
+
+        if (
+            cache_on_write or
+            (
+                cache
+                and (
+                    fs.path.abspath(read_path) ==
+                    fs.path.abspath(write_path))
+                and cache.fs.isfile(read_path)
+            )
+        ):
+            targets.append(cache)
+
+        spool.seek(0)
+        transfer.write_stream(
+            spool,
+            [(service.fs, write_path) for service in targets],
+            chunk_size=max(service.chunk_size for service in targets))
+
+        if len(targets) > 1:
+            _record_cached_checksum(cache, write_path, checksum)
+
+        update(**checksum)
+
+    finally:
+        spool.close()
+
+
+def upload_and_hash(filepath, targets, hash_obj, chunk_size=None):
+    '''
+    Copy a local file to one or more services in a single read, hashing it
+
+    Files are written with :py:func:`~datafs.services.transfer.write_stream`,
+    so existing files are only replaced once the copy has completed. Services
+    whose filesystem provides ``upload_file``, such as
+    :py:class:`~datafs.services.boto3fs.Boto3FS`, are uploaded to from
+    ``filepath`` with :py:func:`~datafs.services.transfer.copy` once the file
+    has been hashed.
+
+    Parameters
+    ----------
+    filepath : str
+
+        Path to the file on the local filesystem
+
+    targets : list
+
+        List of ``(service, path)`` tuples to write the file to. Targets
+        whose system path is ``filepath`` are skipped.
+
+    hash_obj : object
+
+        :py:mod:`hashlib` hash object updated with the file's contents
+
+    chunk_size : int
+
+        Number of bytes read at a time. Defaults to the largest chunk size
+        of the target services.
+
+    Returns
+    -------
+    checksum : dict
+
+        dictionary with keys ``algorithm`` and ``checksum``
+    '''
+
+    streamed = []
+    uploaded = []
+
+    for service, path in targets:
+        if service.fs.hassyspath(path) and (
+                os.path.abspath(service.fs.getsyspath(path)) ==
+                os.path.abspath(filepath)):
+
+            continue
+
+        if hasattr(service.fs, 'upload_file'):
+            uploaded.append((service, path))
+        else:
+            streamed.append((service, path))
+
+    if chunk_size is None:
+        chunk_size = max(
+            [service.chunk_size for service, _ in targets] +
+            [transfer.DefaultChunkSize])
+
+    with open(filepath, 'rb') as f:
+        transfer.write_stream(
+            f,
+            [(service.fs, path) for service, path in streamed],
+            chunk_size=chunk_size,
+            hash_obj=hash_obj)
+
+    local = OSFS(os.path.dirname(os.path.abspath(filepath)))
+
+    for service, path in uploaded:
+        transfer.copy(
+            local,
+            os.path.basename(filepath),
+            service.fs,
+            path,
+            chunk_size=service.chunk_size)
+
+    checksum = _get_checksum(hash_obj)
+
+    for service, path in streamed + uploaded:
+        if service.index is not None:
+            service.index.record(path, checksum)
+
+    return checksum
+
+
 # AVAILABLE I/O CONTEXT MANAGERS
 
 @contextmanager
@@ -152,6 +499,9 @@ def open_file(
         read_path,
         write_path=None,
         cache_on_write=False,
+        immutable=False,
+        spool_size=None,
+        new_hash=None,
         mode='r',
         *args,
         **kwargs):
@@ -159,6 +509,12 @@ def open_file(
 
     Context manager for reading/writing an archive and uploading on changes
 
+    Files opened for reading from a filesystem with a ``read_range`` method,
+    such as :py:class:`~datafs.services.boto3fs.Boto3FS`, are read in blocks
+    of the service's ``chunk_size`` with ranged requests (see
+    :py:class:`~datafs.services.ranged.RangedReader`), so seeking within a
+    large remote file only fetches the data read.
+
     Parameters
     ----------
     authority : object
@@ -171,6 +527,24 @@ def open_file(
         :py:mod:`pyFilesystem` filesystem object to use as the cache. Default
         ``None``.
 
+    immutable : bool
+
+        Whether ``read_path`` is a versioned path whose contents never change,
+        allowing the cache to trust a previously verified checksum. Default
+        ``False``.
+
+    spool_size : int
+
+        If set, files opened in ``'w'`` modes are buffered in memory up to
+        ``spool_size`` bytes rather than in a temporary directory. Default
+        ``None``.
+
+    new_hash : function
+
+        Function returning a new hash object, used to hash spooled writes as
+        they are written. Must produce checksums matching ``hasher``. Default
+        ``None``.
+
     use_cache : bool
 
          update, service_path, version_check, \*\*kwargs
@@ -179,8 +553,34 @@ def open_file(
     if write_path is None:
         write_path = read_path
 
+    if spool_size and ('w' in mode) and len(args) == 0 and set(
+            kwargs.keys()).issubset(['encoding', 'errors', 'newline']):
+
+        with _open_spooled_write(
+                authority,
+                cache,
+                update,
+                version_check,
+                hasher,
+                read_path,
+                write_path,
+                cache_on_write,
+                mode,
+                spool_size,
+                new_hash=new_hash,
+                **kwargs) as f:
+
+            yield f
+
+        return
+
     with _choose_read_fs(
-            authority, cache, read_path, version_check, hasher) as read_fs:
+            authority,
+            cache,
+            read_path,
+            version_check,
+            hasher,
+            immutable=immutable) as read_fs:
 
         write_mode = ('w' in mode) or ('a' in mode) or ('+' in mode)
 
@@ -222,20 +622,51 @@ def open_file(
                         )
                     ):
                         _makedirs(cache.fs, fs.path.dirname(write_path))
-                        fs.utils.copyfile(
-                            write_fs, read_path, cache.fs, write_path)
+                        transfer.copy(
+                            write_fs,
+                            read_path,
+                            cache.fs,
+                            write_path,
+                            chunk_size=cache.chunk_size)
+                        _record_cached_checksum(cache, write_path, checksum)
 
                         _makedirs(authority.fs, fs.path.dirname(write_path))
-                        fs.utils.copyfile(
-                            cache.fs, write_path, authority.fs, write_path)
+                        transfer.copy(
+                            cache.fs,
+                            write_path,
+                            authority.fs,
+                            write_path,
+                            chunk_size=authority.chunk_size)
 
                     else:
                         _makedirs(authority.fs, fs.path.dirname(write_path))
-                        fs.utils.copyfile(
-                            write_fs, read_path, authority.fs, write_path)
+                        transfer.copy(
+                            write_fs,
+                            read_path,
+                            authority.fs,
+                            write_path,
+                            chunk_size=authority.chunk_size)
 
                     update(**checksum)
 
+        elif hasattr(read_fs, 'read_range') and len(args) == 0 and set(
+                kwargs.keys()).issubset(['encoding', 'errors', 'newline']):
+
+            # remote files are read in blocks as needed, not downloaded
+            if cache and read_fs is cache.fs:
+                block_size = cache.chunk_size
+            else:
+                block_size = authority.chunk_size
+
+            with ranged.open_ranged(
+                    read_fs,
+                    read_path,
+                    mode,
+                    block_size=block_size,
+                    **kwargs) as f:
+
+                yield f
+
         else:
 
             with read_fs.open(read_path, mode, *args, **kwargs) as f:
@@ -252,10 +683,16 @@ def get_local_path(
         hasher,
         read_path,
         write_path=None,
-        cache_on_write=False):
+        cache_on_write=False,
+        immutable=False,
+        mode='r+'):
     '''
     Context manager for retrieving a system path for I/O and updating on change
 
+    With ``mode='r'`` the path is only read, and the file is not copied to a
+    temporary directory or checked for changes on exit (see
+    :py:func:`_get_read_path`).
+
 
     Parameters
     ----------
@@ -269,16 +706,45 @@ def get_local_path(
         :py:mod:`pyFilesystem` filesystem object to use as the cache. Default
         ``None``.
 
+    immutable : bool
+
+        Whether ``read_path`` is a versioned path whose contents never change,
+        allowing the cache to trust a previously verified checksum. Default
+        ``False``.
+
+    mode : str
+
+        ``'r'`` for a read-only path or ``'r+'`` to upload changes made to the
+        file (default ``'r+'``)
+
     use_cache : bool
 
          update, service_path, version_check, \*\*kwargs
     '''
 
+    if mode == 'r':
+        with _get_read_path(
+                authority,
+                cache,
+                version_check,
+                hasher,
+                read_path,
+                immutable=immutable) as path:
+
+            yield path
+
+        return
+
     if write_path is None:
         write_path = read_path
 
     with _choose_read_fs(
-            authority, cache, read_path, version_check, hasher) as read_fs:
+            authority,
+            cache,
+            read_path,
+            version_check,
+            hasher,
+            immutable=immutable) as read_fs:
 
         with _prepare_write_fs(
                 read_fs, cache, read_path, readwrite_mode=True) as write_fs:
@@ -309,16 +775,29 @@ def get_local_path(
                     ):
 
                         _makedirs(cache.fs, fs.path.dirname(write_path))
-                        fs.utils.copyfile(
-                            write_fs, read_path, cache.fs, write_path)
+                        transfer.copy(
+                            write_fs,
+                            read_path,
+                            cache.fs,
+                            write_path,
+                            chunk_size=cache.chunk_size)
+                        _record_cached_checksum(cache, write_path, checksum)
 
                         _makedirs(authority.fs, fs.path.dirname(write_path))
-                        fs.utils.copyfile(
-                            cache.fs, write_path, authority.fs, write_path)
+                        transfer.copy(
+                            cache.fs,
+                            write_path,
+                            authority.fs,
+                            write_path,
+                            chunk_size=authority.chunk_size)
                     else:
                         _makedirs(authority.fs, fs.path.dirname(write_path))
-                        fs.utils.copyfile(
-                            write_fs, read_path, authority.fs, write_path)
+                        transfer.copy(
+                            write_fs,
+                            read_path,
+                            authority.fs,
+                            write_path,
+                            chunk_size=authority.chunk_size)
                     update(**checksum)
 
             else:
@@ -0,0 +1,322 @@
+from __future__ import absolute_import
+
+import io
+import os
+import re
+import hashlib
+import threading
+
+from datafs.services import transfer
+from datafs._compat import open_filelike, string_types
+
+# hash constructors for algorithms missing from hashlib, e.g. blake2b on
+# python 2 with pyblake2 installed
+_fallbacks = {}
+
+try:
+    hashlib.new('blake2b')
+
+except ValueError:
+    try:
+        from pyblake2 import blake2b
+        _fallbacks['blake2b'] = blake2b
+
+    except ImportError:
+        pass
+
+
+def _is_available(algorithm):
+
+    if algorithm in _fallbacks:
+        return True
+
+    try:
+        hashlib.new(algorithm)
+        return True
+
+    except ValueError:
+        return False
+
+
+Algorithms = tuple(
+    algorithm for algorithm in ('md5', 'sha256', 'blake2b')
+    if _is_available(algorithm))
+
+_tree_pattern = re.compile(r'^(?P<base>\w+)-tree-(?P<segment_size>[0-9]+)$')
+
+
+def get_algorithm_name(algorithm, segment_size=None):
+    '''
+    Name under which checksums are recorded in version metadata
+
+    Raises a ValueError if ``algorithm`` is not available.
+
+    .. code-block:: python
+
+        >>> print(get_algorithm_name('md5'))
+        md5
+        >>> print(get_algorithm_name('sha256', segment_size=2**26))
+        sha256-tree-67108864
+
+    '''
+
+    _new(algorithm)
+
+    if segment_size:
+        return '{}-tree-{}'.format(algorithm, int(segment_size))
+
+    return algorithm
+
+
+def parse_algorithm_name(name):
+    '''
+    Split a recorded algorithm name into the base algorithm and segment size
+
+    .. code-block:: python
+
+        >>> parse_algorithm_name('sha256-tree-67108864')
+        ('sha256', 67108864)
+        >>> parse_algorithm_name('md5')
+        ('md5', None)
+
+    '''
+
+    match = _tree_pattern.match(name)
+
+    if match:
+        return match.group('base'), int(match.group('segment_size'))
+
+    return name, None
+
+
+def _new(algorithm):
+
+    if algorithm in _fallbacks:
+        return _fallbacks[algorithm]()
+
+    try:
+        return hashlib.new(algorithm)
+
+    except ValueError:
+        raise ValueError(
+            'Hash algorithm "{}" not available. Choose from {}'.format(
+                algorithm, ', '.join(Algorithms)))
+
+
+class TreeHash(object):
+    '''
+    Hash of a file as a tree of fixed-size segments
+
+    Each ``segment_size`` block of the file is hashed separately, and the
+    checksum is the hash of the concatenated segment digests. Segments can
+    therefore be hashed in parallel (see :py:func:`hash_file`), while
+    ``TreeHash`` computes the same checksum incrementally.
+
+    Parameters
+    ----------
+    algorithm : str
+        :py:mod:`hashlib` algorithm used for segments and the root
+
+    segment_size : int
+        number of bytes in each segment
+
+    Examples
+    --------
+
+    .. code-block:: python
+
+        >>> tree = TreeHash('sha256', 4)
+        >>> tree.update(b'0123')
+        >>> tree.update(b'456789')
+        >>> print(tree.name)
+        sha256-tree-4
+        >>> other = TreeHash('sha256', 4)
+        >>> other.update(b'0123456789')
+        >>> tree.hexdigest() == other.hexdigest()
+        True
+
+    '''
+
+    def __init__(self, algorithm, segment_size):
+        self.algorithm = algorithm
+        self.segment_size = int(segment_size)
+
+        self._segment = _new(algorithm)
+        self._filled = 0
+        self._digests = []
+
+    @property
+    def name(self):
+        return get_algorithm_name(self.algorithm, self.segment_size)
+
+    def update(self, data):
+        data = memoryview(data)
+
+        while len(data) > 0:
+            size = min(self.segment_size - self._filled, len(data))
+            self._segment.update(data[:size])
+            self._filled += size
+            data = data[size:]
+
+            if self._filled == self.segment_size:
+                self._digests.append(self._segment.digest())
+                self._segment = _new(self.algorithm)
+                self._filled = 0
+
+    def hexdigest(self):
+        digests = list(self._digests)
+
+        if self._filled > 0 or len(digests) == 0:
+            digests.append(self._segment.digest())
+
+        return _combine(self.algorithm, digests)
+
+
+def _combine(algorithm, digests):
+
+    root = _new(algorithm)
+
+    for digest in digests:
+        root.update(digest)
+
+    return root.hexdigest()
+
+
+def new_hash(algorithm='md5'):
+    '''
+    Return a hash object for a recorded algorithm name
+
+    Returns a :py:mod:`hashlib` object, or a :py:class:`TreeHash` for tree
+    algorithms such as ``'sha256-tree-67108864'``.
+    '''
+
+    base, segment_size = parse_algorithm_name(algorithm)
+
+    if segment_size:
+        return TreeHash(base, segment_size)
+
+    return _new(base)
+
+
+def _hash_segments(path, algorithm, segment_size, threads, chunk_size):
+    '''
+    Hash the segments of a local file on a pool of threads
+    '''
+
+    size = os.path.getsize(path)
+    count = max(1, -(-size // segment_size))
+
+    digests = [None] * count
+    remaining = list(range(count - 1, -1, -1))
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        try:
+            with io.open(path, 'rb') as f:
+                with transfer.borrow_buffer(chunk_size) as buf:
+                    while True:
+                        with lock:
+                            if not remaining or errors:
+                                return
+
+                            segment = remaining.pop()
+
+                        f.seek(segment * segment_size)
+                        to_read = min(segment_size, size - f.tell())
+                        hash_obj = _new(algorithm)
+
+                        while to_read > 0:
+                            read = f.readinto(buf[:min(chunk_size, to_read)])
+
+                            if not read:
+                                break
+
+                            hash_obj.update(buf[:read])
+                            to_read -= read
+
+                        digests[segment] = hash_obj.digest()
+
+        except Exception as e:
+            with lock:
+                errors.append(e)
+
+    workers = [
+        threading.Thread(target=worker) for _ in range(min(threads, count))]
+
+    for thread in workers:
+        thread.start()
+
+    for thread in workers:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return _combine(algorithm, digests)
+
+
+def hash_file(f, algorithm='md5', chunk_size=None, threads=1):
+    '''
+    Compute the checksum of a file
+
+    Files are read in ``chunk_size`` blocks into a reusable buffer. With a
+    tree algorithm (see :py:class:`TreeHash`), segments of a file given by
+    path are hashed on ``threads`` threads.
+
+    Parameters
+    ----------
+    f : file-like
+        File-like object or file path from which to compute checksum value
+
+    algorithm : str
+        Recorded algorithm name, e.g. ``'md5'``, ``'sha256'``, ``'blake2b'``
+        or ``'sha256-tree-67108864'`` (default ``'md5'``). ``'blake2b'``
+        requires :py:mod:`pyblake2` on python 2.
+
+    chunk_size : int
+        Number of bytes read at a time (default
+        :py:data:`~datafs.services.transfer.DefaultChunkSize`)
+
+    threads : int
+        Number of threads used to hash tree segments (default 1)
+
+    Returns
+    -------
+    checksum : dict
+        dictionary with keys ``algorithm`` and ``checksum``
+
+    Examples
+    --------
+
+    .. code-block:: python
+
+        >>> import tempfile
+        >>> with tempfile.NamedTemporaryFile(delete=False) as f:
+        ...     _ = f.write(b'0123456789' * 1000)
+        ...
+        >>> chk = hash_file(f.name, 'sha256-tree-1024', threads=4)
+        >>> chk == hash_file(f.name, 'sha256-tree-1024', chunk_size=100)
+        True
+        >>> print(hash_file(f.name)['checksum'])
+        2bb571599a4180e1d542f76904adc3df
+        >>> os.remove(f.name)
+
+    '''
+
+    chunk_size = chunk_size or transfer.DefaultChunkSize
+    base, segment_size = parse_algorithm_name(algorithm)
+
+    if segment_size and threads > 1 and isinstance(f, string_types):
+        checksum = _hash_segments(f, base, segment_size, threads, chunk_size)
+
+    else:
+        hash_obj = new_hash(algorithm)
+
+        with open_filelike(f, 'rb') as f_obj:
+            transfer.copy_stream(
+                f_obj, [], chunk_size=chunk_size, hash_obj=hash_obj)
+
+        checksum = hash_obj.hexdigest()
+
+    return {'algorithm': algorithm, 'checksum': checksum}
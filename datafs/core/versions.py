@@ -1,7 +1,9 @@
 
 from __future__ import absolute_import
 
+import bisect
 import distutils.version
+import re
 from datafs._compat import string_types
 
 
@@ -334,3 +336,385 @@ class BumpableVersion(distutils.version.StrictVersion):
             return distutils.version.StrictVersion.__cmp__(self, other)
         else:
             return distutils.version.StrictVersion.__cmp__(self, other)
+
+
+class VersionIndex(object):
+    '''
+    Sorted index of the versions in an archive's version history
+
+    Versions are parsed once when the index is built and held in sorted
+    order, so exact, latest, and range lookups are done by bisection rather
+    than by walking the history. Where a version appears more than once in
+    the history, the most recent entry is indexed.
+
+    Parameters
+    ----------
+
+    version_history : list
+        version history, oldest version first, as returned by
+        :py:meth:`~datafs.managers.manager.BaseDataManager.get_version_history`
+
+    Examples
+    --------
+
+    .. code-block:: python
+
+        >>> index = VersionIndex([
+        ...     {'version': '0.1', 'checksum': 'a'},
+        ...     {'version': '0.2a1', 'checksum': 'b'},
+        ...     {'version': '0.1.1', 'checksum': 'c'}])
+        >>> index.versions
+        [BumpableVersion ('0.1'), BumpableVersion ('0.1.1'), \
+BumpableVersion ('0.2a1')]
+        >>> index.latest()
+        BumpableVersion ('0.2a1')
+        >>> print(index.find('0.1.1')['checksum'])
+        c
+        >>> index.find('0.3') is None
+        True
+        >>> index.range('0.1', '0.2a1')
+        [BumpableVersion ('0.1'), BumpableVersion ('0.1.1')]
+
+    '''
+
+    def __init__(self, version_history):
+
+        entries = {}
+
+        for offset, version_metadata in enumerate(version_history):
+            version = version_metadata.get('version')
+
+            if version is None or version == 'None':
+                continue
+
+            version = BumpableVersion(version)
+            entries[self._key(version)] = (version, offset)
+
+        self._keys = sorted(entries.keys())
+        self._versions = [entries[key][0] for key in self._keys]
+        self._offsets = [entries[key][1] for key in self._keys]
+
+        self._history = version_history
+
+    @staticmethod
+    def _key(version):
+        '''
+        Tuple which sorts in the same order as the version
+        '''
+
+        if not isinstance(version, distutils.version.StrictVersion):
+            version = distutils.version.StrictVersion(version)
+
+        if version.prerelease is None:
+            return tuple(version.version) + (1, )
+
+        return tuple(version.version) + (0, ) + tuple(version.prerelease)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, version):
+        return self._position(version) is not None
+
+    @property
+    def versions(self):
+        '''
+        Sorted list of the unique versions in the history
+        '''
+
+        return list(self._versions)
+
+    def _position(self, version):
+
+        key = self._key(version)
+        i = bisect.bisect_left(self._keys, key)
+
+        if i < len(self._keys) and self._keys[i] == key:
+            return i
+
+        return None
+
+    def get(self, version):
+        '''
+        Return the indexed version equal to ``version``, or None
+        '''
+
+        i = self._position(version)
+
+        if i is None:
+            return None
+
+        return self._versions[i]
+
+    def find(self, version):
+        '''
+        Return the history entry for ``version``, or None if not found
+        '''
+
+        i = self._position(version)
+
+        if i is None:
+            return None
+
+        return self._history[self._offsets[i]]
+
+    def latest(self):
+        '''
+        Return the greatest version in the history, or None if empty
+        '''
+
+        if len(self._versions) == 0:
+            return None
+
+        return self._versions[-1]
+
+    def range(
+            self,
+            lower=None,
+            upper=None,
+            include_lower=True,
+            include_upper=False):
+        '''
+        Return the sorted versions between ``lower`` and ``upper``
+
+        Parameters
+        ----------
+
+        lower : str or BumpableVersion
+            lower bound, or None for no lower bound (default None)
+
+        upper : str or BumpableVersion
+            upper bound, or None for no upper bound (default None)
+
+        include_lower : bool
+            include versions equal to ``lower`` (default True)
+
+        include_upper : bool
+            include versions equal to ``upper`` (default False)
+
+        Returns
+        -------
+
+        versions : list
+            list of :py:class:`BumpableVersion` objects
+        '''
+
+        if lower is None:
+            start = 0
+
+        elif include_lower:
+            start = bisect.bisect_left(self._keys, self._key(lower))
+
+        else:
+            start = bisect.bisect_right(self._keys, self._key(lower))
+
+        if upper is None:
+            stop = len(self._keys)
+
+        elif include_upper:
+            stop = bisect.bisect_right(self._keys, self._key(upper))
+
+        else:
+            stop = bisect.bisect_left(self._keys, self._key(upper))
+
+        return self._versions[start:stop]
+
+
+class VersionSpecifier(object):
+    '''
+    Set of comma-separated version constraints, such as ``>=1.2,<2.0``
+
+    Supports the comparison operators ``==``, ``!=``, ``>=``, ``<=``, ``>``,
+    ``<`` and the compatible release operator ``~=``. A version with no
+    operator must match exactly.
+
+    Parameters
+    ----------
+
+    specifier : str or BumpableVersion
+        version constraints
+
+    Examples
+    --------
+
+    .. code-block:: python
+
+        >>> spec = VersionSpecifier('>=0.1, <0.2, !=0.1.1')
+        >>> '0.1.2' in spec
+        True
+        >>> '0.1.1' in spec
+        False
+        >>> index = VersionIndex([
+        ...     {'version': v} for v in ['0.1', '0.1.1', '0.1.2', '0.2']])
+        >>> spec.resolve(index)
+        BumpableVersion ('0.1.2')
+        >>> VersionSpecifier('~=0.1.1').resolve(index)
+        BumpableVersion ('0.1.2')
+        >>> VersionSpecifier('0.1.1').resolve(index)
+        BumpableVersion ('0.1.1')
+        >>> VersionSpecifier('>0.2').resolve(index) is None
+        True
+
+    '''
+
+    Operators = ('==', '!=', '>=', '<=', '~=', '>', '<')
+
+    def __init__(self, specifier):
+
+        if isinstance(specifier, distutils.version.StrictVersion):
+            specifier = str(specifier)
+
+        self._specifier = specifier.strip()
+        self._constraints = []
+
+        for clause in self._specifier.split(','):
+            clause = clause.strip()
+
+            if clause == '':
+                continue
+
+            for operator in self.Operators:
+                if clause.startswith(operator):
+                    version = clause[len(operator):].strip()
+                    break
+
+            else:
+                operator, version = '==', clause
+
+            if operator == '~=':
+                self._constraints.extend(self._compatible_release(version))
+
+            else:
+                self._constraints.append((operator, BumpableVersion(version)))
+
+        if len(self._constraints) == 0:
+            raise ValueError(
+                'Version specifier "{}" has no constraints'.format(specifier))
+
+    def __repr__(self):
+        return "{} ('{}')".format(self.__class__.__name__, self._specifier)
+
+    def __str__(self):
+        return self._specifier
+
+    @property
+    def pinned(self):
+        '''
+        Version required by a single exact constraint, or None
+
+        .. code-block:: python
+
+            >>> print(VersionSpecifier('==1.2').pinned)
+            1.2
+            >>> print(VersionSpecifier('>=1.2, <2.0').pinned)
+            None
+
+        '''
+
+        if len(self._constraints) == 1 and self._constraints[0][0] == '==':
+            return str(self._constraints[0][1])
+
+        return None
+
+    @staticmethod
+    def _compatible_release(version):
+        '''
+        Expand ``~=version`` into lower and upper bound constraints
+        '''
+
+        release = re.match(r'^\d+(\.\d+)*', version)
+        segments = release.group(0).split('.') if release else []
+
+        if len(segments) < 2:
+            raise ValueError(
+                'Compatible release "~={}" requires at least two version '
+                'segments'.format(version))
+
+        upper = segments[:-1]
+        upper[-1] = str(int(upper[-1]) + 1)
+
+        if len(upper) == 1:
+            upper.append('0')
+
+        return [
+            ('>=', BumpableVersion(version)),
+            ('<', BumpableVersion('.'.join(upper)))]
+
+    def __contains__(self, version):
+
+        key = VersionIndex._key(version)
+
+        for operator, bound in self._constraints:
+            bound = VersionIndex._key(bound)
+
+            if not {
+                    '==': key == bound,
+                    '!=': key != bound,
+                    '>=': key >= bound,
+                    '<=': key <= bound,
+                    '>': key > bound,
+                    '<': key < bound}[operator]:
+
+                return False
+
+        return True
+
+    def _bounds(self):
+        '''
+        Return the tightest lower and upper bounds as (version, inclusive)
+        '''
+
+        lower = (None, True)
+        upper = (None, True)
+
+        for operator, bound in self._constraints:
+            if operator in ('==', '>=', '>'):
+                inclusive = operator != '>'
+
+                if lower[0] is None or (
+                        (VersionIndex._key(bound), not inclusive) >
+                        (VersionIndex._key(lower[0]), not lower[1])):
+
+                    lower = (bound, inclusive)
+
+            if operator in ('==', '<=', '<'):
+                inclusive = operator != '<'
+
+                if upper[0] is None or (
+                        (VersionIndex._key(bound), inclusive) <
+                        (VersionIndex._key(upper[0]), upper[1])):
+
+                    upper = (bound, inclusive)
+
+        return lower, upper
+
+    def resolve(self, version_index):
+        '''
+        Return the greatest version in the index satisfying the specifier
+
+        Parameters
+        ----------
+
+        version_index : VersionIndex
+            index of the archive's versions
+
+        Returns
+        -------
+
+        version : BumpableVersion
+            matching version, or None if no version matches
+        '''
+
+        (lower, include_lower), (upper, include_upper) = self._bounds()
+
+        candidates = version_index.range(
+            lower,
+            upper,
+            include_lower=include_lower,
+            include_upper=include_upper)
+
+        for version in reversed(candidates):
+            if version in self:
+                return version
+
+        return None
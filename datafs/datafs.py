@@ -550,6 +550,35 @@ def search(ctx, tags, prefix=None):
         print('')
 
 
+@cli.command(short_help='Build the tag search index')
+@click.pass_context
+def build_tag_index(ctx):
+    '''
+    Build the tag search index for all existing archives
+    '''
+
+    _generate_api(ctx)
+
+    count = ctx.obj.api.manager.build_tag_index()
+    click.echo('indexed tags for {} archives'.format(count))
+
+
+@cli.command(short_help='Move version histories to the version store')
+@click.pass_context
+def migrate_version_store(ctx):
+    '''
+    Move version histories out of archive records into the version store
+
+    Set ``version_store: true`` in the manager configuration once the
+    migration completes.
+    '''
+
+    _generate_api(ctx)
+
+    count = ctx.obj.api.manager.migrate_version_store()
+    click.echo('migrated version history for {} archives'.format(count))
+
+
 @cli.command(short_help='Delete an archive')
 @click.argument('archive_name')
 @click.pass_context
@@ -0,0 +1,206 @@
+from __future__ import absolute_import
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class ListingCache(object):
+    '''
+    In-process LRU cache for archive listings
+
+    Stores the documents returned by a manager's ``_get_archive_listing`` so
+    that repeated accessor calls for the same archive (spec, history, tags,
+    metadata) do not each make a round trip to the database.
+
+    Listings fetched with a projection are cached by their fields, so that
+    an accessor only retrieves the fields it needs. A full listing serves
+    any projection. Listings are returned as shallow copies: the listing
+    and the lists and dictionaries it holds may be modified by callers, but
+    the documents nested within them (e.g. version history entries) are
+    shared with the cache and must not be.
+
+    Parameters
+    ----------
+    size : int
+        Maximum number of listings held in the cache. The least recently used
+        listing is evicted when the cache is full. A size of 0 disables
+        caching (default 0).
+
+    ttl : float
+        Number of seconds a listing remains valid after it is fetched. If
+        None, listings are valid until invalidated or evicted (default None).
+
+    Examples
+    --------
+
+    .. code-block:: python
+
+        >>> cache = ListingCache(size=2, ttl=None)
+        >>> cache.get('arch1') is None
+        True
+        >>> cache.set('arch1', {'tags': ['a']})
+        >>> cache.get('arch1')
+        {'tags': ['a']}
+        >>> cache.set('arch2', {'tags': ['b']}, fields=['tags'])
+        >>> cache.get('arch2', fields=['tags'])
+        {'tags': ['b']}
+        >>> cache.get('arch2') is None
+        True
+        >>> cache.invalidate('arch1')
+        >>> cache.get('arch1') is None
+        True
+        >>> cache.info()['hits'], cache.info()['misses']
+        (2, 3)
+
+    '''
+
+    def __init__(self, size=0, ttl=None):
+        self._size = int(size)
+        self._ttl = ttl
+
+        self._listings = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def enabled(self):
+        return self._size > 0
+
+    @property
+    def config(self):
+        return {'size': self._size, 'ttl': self._ttl}
+
+    def get(self, archive_name, fields=None):
+        '''
+        Return a copy of the cached listing, or None if unavailable
+
+        If ``fields`` is provided, only these top-level fields (and ``_id``)
+        are returned, from a listing cached with the same fields or from a
+        full listing.
+        '''
+
+        if not self.enabled:
+            return None
+
+        key = self._get_key(fields)
+
+        with self._lock:
+            projections = self._listings.get(archive_name)
+
+            if projections is not None:
+                for projection in [key, None]:
+                    if projection not in projections:
+                        continue
+
+                    fetched, listing = projections[projection]
+
+                    if (self._ttl is not None and
+                            (time.time() - fetched) >= self._ttl):
+                        del projections[projection]
+                        continue
+
+                    del self._listings[archive_name]
+                    self._listings[archive_name] = projections
+                    self._hits += 1
+
+                    return self._copy(listing, fields)
+
+                if len(projections) == 0:
+                    del self._listings[archive_name]
+
+            self._misses += 1
+
+        return None
+
+    def set(self, archive_name, listing, fields=None):
+        '''
+        Cache a listing, fetched with the projection ``fields`` if provided
+        '''
+
+        if not self.enabled or listing is None:
+            return
+
+        key = self._get_key(fields)
+        entry = (time.time(), self._copy(listing))
+
+        with self._lock:
+            projections = self._listings.pop(archive_name, {})
+
+            # a full listing supersedes any projections
+            if key is None:
+                projections = {}
+
+            projections[key] = entry
+            self._listings[archive_name] = projections
+
+            while len(self._listings) > self._size:
+                self._listings.popitem(last=False)
+
+    @staticmethod
+    def _get_key(fields):
+        if fields is None:
+            return None
+
+        return tuple(sorted(set(fields)))
+
+    @staticmethod
+    def _copy(listing, fields=None):
+        '''
+        Copy a listing and its top-level lists and dictionaries
+
+        .. code-block:: python
+
+            >>> listing = {'_id': 'a', 'tags': ['x'], 'versioned': True}
+            >>> copied = ListingCache._copy(listing, fields=['tags'])
+            >>> sorted(copied.items())
+            [('_id', 'a'), ('tags', ['x'])]
+            >>> copied['tags'] is listing['tags']
+            False
+
+        '''
+
+        copied = {}
+
+        for field, value in listing.items():
+            if fields is not None and field not in fields and field != '_id':
+                continue
+
+            if isinstance(value, list):
+                value = list(value)
+
+            elif isinstance(value, dict):
+                value = dict(value)
+
+            copied[field] = value
+
+        return copied
+
+    def invalidate(self, archive_name):
+        with self._lock:
+            self._listings.pop(archive_name, None)
+
+    def clear(self):
+        with self._lock:
+            self._listings.clear()
+
+    def info(self):
+        '''
+        Return cache statistics
+
+        Returns
+        -------
+        info : dict
+            dictionary with keys ``hits``, ``misses``, ``currsize``,
+            ``maxsize``, and ``ttl``
+        '''
+
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'currsize': len(self._listings),
+                'maxsize': self._size,
+                'ttl': self._ttl}
@@ -3,6 +3,8 @@ from __future__ import absolute_import
 
 import time
 from datafs.config.helpers import check_requirements
+from datafs.core.versions import BumpableVersion
+from datafs.managers.listing_cache import ListingCache
 
 
 class BaseDataManager(object):
@@ -10,15 +12,31 @@ class BaseDataManager(object):
     Base class for DataManager metadata store objects
 
     Should be subclassed. Not intended to be used directly.
+
+    Parameters
+    ----------
+    table_name : str
+        Name of the data archive table
+
+    listing_cache : dict
+        Keyword arguments used in initializing a
+        :py:class:`~datafs.managers.listing_cache.ListingCache`, e.g.
+        ``{'size': 1000, 'ttl': 30}``. Caches archive listings in-process so
+        that repeated reads of the same archive do not each query the
+        database. Disabled by default.
     '''
 
     TimestampFormat = '%Y%m%d-%H%M%S'
 
-    def __init__(self, table_name):
+    def __init__(self, table_name, listing_cache=None):
 
         self._table_name = table_name
         self._spec_table_name = table_name + '.spec'
 
+        self._listing_cache_config = listing_cache
+        self._listing_cache = ListingCache(
+            **(listing_cache if listing_cache is not None else {}))
+
         self._required_user_config = None
         self._required_archive_metadata = None
         self._valid_top_level_domains = None
@@ -28,6 +46,23 @@ class BaseDataManager(object):
     def table_names(self):
         return self._get_table_names()
 
+    @property
+    def listing_cache_info(self):
+        '''
+        Hit/miss statistics for the archive listing cache
+
+        See :py:meth:`~datafs.managers.listing_cache.ListingCache.info`
+        '''
+
+        return self._listing_cache.info()
+
+    def clear_listing_cache(self):
+        '''
+        Drop all archive listings held in the in-process cache
+        '''
+
+        self._listing_cache.clear()
+
     @property
     def required_user_config(self):
         if self._required_user_config is None:
@@ -85,12 +120,14 @@ class BaseDataManager(object):
             self._create_archive_table(table_name)
             self._create_archive_table(table_name+'.spec')
             self._create_spec_config(table_name, spec_documents)
+            self._create_auxiliary_tables(table_name)
 
         else:
             try:
                 self._create_archive_table(table_name)
                 self._create_archive_table(table_name+'.spec')
                 self._create_spec_config(table_name, spec_documents)
+                self._create_auxiliary_tables(table_name)
             except KeyError:
                 pass
 
@@ -174,6 +211,8 @@ class BaseDataManager(object):
         if table_name is None:
             table_name = self._table_name
 
+        self._listing_cache.clear()
+
         if table_name not in self._get_table_names():
             if raise_on_err:
                 raise KeyError('Table "{}" not found'.format(table_name))
@@ -189,10 +228,44 @@ class BaseDataManager(object):
         else:
             self._delete_table(table_name + '.spec')
 
-    def update(self, archive_name, version_metadata):
+        for aux_table_name in self._get_auxiliary_table_names(table_name):
+            if aux_table_name in self._get_table_names():
+                self._delete_table(aux_table_name)
+
+    def build_tag_index(self):
+        '''
+        Build or rebuild the index used to serve tag searches
+
+        Managers which maintain a tag index keep it up to date on every
+        write. Use this method to index archives created before the index
+        was enabled.
+
+        Returns
+        -------
+        count : int
+            number of archives indexed
+        '''
+
+        return self._build_tag_index()
+
+    def update(self, archive_name, version_metadata, archive_metadata=None):
         '''
         Register a new version for archive ``archive_name``
 
+        Parameters
+        ----------
+        archive_name : str
+            Name of the archive to update
+
+        version_metadata : dict
+            Metadata for the new version
+
+        archive_metadata : dict
+            Updates to the archive's metadata to commit along with the new
+            version (optional). Pass {key: None} to remove a key. Managers
+            which support it write the version and metadata in a single
+            request.
+
         .. note ::
 
             need to implement hash checking to prevent duplicate writes
@@ -201,13 +274,28 @@ class BaseDataManager(object):
         version_metadata['version'] = str(
             version_metadata.get('version', None))
 
-        self._update(archive_name, version_metadata)
+        if archive_metadata:
+            self._validate_metadata_update(archive_metadata)
+            self._update_with_metadata(
+                archive_name, version_metadata, archive_metadata)
+
+        else:
+            self._update(archive_name, version_metadata)
+
+        self._listing_cache.invalidate(archive_name)
 
     def update_metadata(self, archive_name, archive_metadata):
         '''
         Update metadata for archive ``archive_name``
         '''
 
+        self._validate_metadata_update(archive_metadata)
+
+        self._update_metadata(archive_name, archive_metadata)
+        self._listing_cache.invalidate(archive_name)
+
+    def _validate_metadata_update(self, archive_metadata):
+
         required_metadata_keys = self.required_archive_metadata.keys()
         for key, val in archive_metadata.items():
             if key in required_metadata_keys and val is None:
@@ -215,8 +303,6 @@ class BaseDataManager(object):
                     'Cannot remove required metadata attribute "{}"'.format(
                         key))
 
-        self._update_metadata(archive_name, archive_metadata)
-
     def create_archive(
             self,
             archive_name,
@@ -258,8 +344,44 @@ class BaseDataManager(object):
                 archive_name,
                 archive_metadata)
 
+        self._listing_cache.invalidate(archive_name)
+
         return self.get_archive(archive_name)
 
+    def create_archives(self, archives, helper=False):
+        '''
+        Create many data archives in bulk
+
+        Parameters
+        ----------
+        archives : list
+            list of dictionaries of keyword arguments to
+            :py:meth:`~BaseDataManager.create_archive`. Each must include
+            ``archive_name``, ``authority_name``, ``archive_path``, and
+            ``versioned``.
+
+        helper : bool
+            If true, interactively prompt for required metadata (default
+            False)
+
+        Returns
+        -------
+        conflicts : list
+            names of archives which were not created because they already
+            exist
+        '''
+
+        archive_metadata = [
+            self._create_archive_metadata(helper=helper, **archive)
+            for archive in archives]
+
+        conflicts = self._create_archives(archive_metadata)
+
+        for metadata in archive_metadata:
+            self._listing_cache.invalidate(metadata['_id'])
+
+        return conflicts
+
     def _create_archive_metadata(
             self,
             archive_name,
@@ -297,6 +419,7 @@ class BaseDataManager(object):
             'archive_path': archive_path,
             'versioned': versioned,
             'version_history': [],
+            'version_count': 0,
             'archive_metadata': metadata,
             'tags': tags
         }
@@ -327,6 +450,38 @@ class BaseDataManager(object):
         except KeyError:
             raise KeyError('Archive "{}" not found'.format(archive_name))
 
+    def get_archives(self, archive_names):
+        '''
+        Get data archive specifications for many archives at once
+
+        Archives are retrieved in as few requests to the database as the
+        manager allows. Names which are not found are omitted from the
+        result rather than raising an error.
+
+        Parameters
+        ----------
+        archive_names : list
+            names of the archives to be retrieved
+
+        Returns
+        -------
+        archive_specifications : dict
+            Dictionary of archive specifications (see
+            :py:meth:`~BaseDataManager.get_archive`), keyed by archive name
+        '''
+
+        spec = ['authority_name', 'archive_path', 'versioned']
+
+        listings = self._get_cached_listings(archive_names, fields=spec)
+
+        specs = {}
+
+        for archive_name, res in listings.items():
+            specs[archive_name] = {k: v for k, v in res.items() if k in spec}
+            specs[archive_name]['archive_name'] = archive_name
+
+        return specs
+
     def get_metadata(self, archive_name):
         '''
         Retrieve the metadata for a given archive
@@ -362,6 +517,112 @@ class BaseDataManager(object):
 
         return self._get_latest_hash(archive_name)
 
+    def get_latest_algorithm(self, archive_name):
+        '''
+        Retrieve the hash algorithm of the latest version of an archive
+
+        Parameters
+        ----------
+        archive_name : str
+            name of the archive
+
+        Returns
+        -------
+        algorithm : str
+            algorithm used to compute the latest checksum, or None if the
+            archive has no versions
+
+        '''
+
+        return self._get_latest_algorithm(archive_name)
+
+    def get_latest_version(self, archive_name):
+        '''
+        Retrieve the most recently registered version of an archive
+
+        The version is read from the ``latest_version`` field maintained on
+        the archive record by :py:meth:`~BaseDataManager.update`. Archives
+        written before this field was introduced fall back to the version
+        history.
+
+        Parameters
+        ----------
+        archive_name : str
+            name of the archive
+
+        Returns
+        -------
+        version : str
+            latest version string, or None if the archive has no versions
+        '''
+
+        return self._get_latest_version(archive_name)
+
+    def get_latest_versions(self, archive_names):
+        '''
+        Retrieve the most recently registered versions of many archives
+
+        The ``latest_version`` fields of all archives are read with a single
+        bulk lookup. Archives written before this field was introduced fall
+        back to their version histories, which are also retrieved in bulk.
+        Names which are not found are omitted from the result.
+
+        Parameters
+        ----------
+        archive_names : list
+            names of the archives
+
+        Returns
+        -------
+        versions : dict
+            latest version strings, or None for archives with no versions,
+            keyed by archive name
+        '''
+
+        listings = self._get_cached_listings(
+            archive_names, fields=['latest_version'])
+
+        versions = {
+            archive_name: listing['latest_version']
+            for archive_name, listing in listings.items()
+            if 'latest_version' in listing}
+
+        legacy = [
+            archive_name for archive_name in listings
+            if archive_name not in versions]
+
+        if len(legacy) > 0:
+            for archive_name, version_history in self._get_version_histories(
+                    legacy).items():
+
+                versions[archive_name] = self._get_max_version(
+                    version_history)
+
+        return versions
+
+    def get_version_count(self, archive_name):
+        '''
+        Retrieve the number of versions registered to an archive
+
+        The count is read from the ``version_count`` field maintained on the
+        archive record by :py:meth:`~BaseDataManager.update`, and can be used
+        to check whether a previously fetched version history is current.
+        Archives written before this field was introduced fall back to the
+        length of the version history.
+
+        Parameters
+        ----------
+        archive_name : str
+            name of the archive
+
+        Returns
+        -------
+        count : int
+            number of entries in the archive's version history
+        '''
+
+        return self._get_version_count(archive_name)
+
     def delete_archive_record(self, archive_name):
         '''
         Deletes an archive from the database
@@ -375,9 +636,74 @@ class BaseDataManager(object):
         '''
 
         self._delete_archive_record(archive_name)
+        self._listing_cache.invalidate(archive_name)
+
+    def get_version_history(self, archive_name, limit=None, after=None):
+        '''
+        Retrieve the version history of an archive, oldest version first
+
+        Parameters
+        ----------
+        archive_name : str
+            name of the archive
+
+        limit : int
+            maximum number of versions to return (default None, all
+            versions)
+
+        after : int
+            number of versions to skip. To page through a long history, pass
+            the number of versions already retrieved (default None)
+
+        Returns
+        -------
+        version_history : list
+            list of version metadata dictionaries
+        '''
+
+        return self._get_version_history(
+            archive_name, limit=limit, after=after)
+
+    def get_version_histories(self, archive_names):
+        '''
+        Retrieve the version histories of many archives at once
+
+        Histories are retrieved in as few requests to the database as the
+        manager allows. Names which are not found are omitted from the
+        result rather than raising an error.
+
+        Parameters
+        ----------
+        archive_names : list
+            names of the archives
+
+        Returns
+        -------
+        version_histories : dict
+            lists of version metadata dictionaries, oldest version first,
+            keyed by archive name
+        '''
+
+        return self._get_version_histories(list(archive_names))
+
+    def migrate_version_store(self):
+        '''
+        Move version histories out of archive documents into the version
+        store
+
+        Existing ``version_history`` entries are written as one record per
+        version in the version store table and removed from the archive
+        document. Version store reads are enabled on this manager once the
+        migration completes. Run this while no other clients are writing to
+        the table.
+
+        Returns
+        -------
+        count : int
+            number of archives migrated
+        '''
 
-    def get_version_history(self, archive_name):
-        return self._get_version_history(archive_name)
+        return self._migrate_version_store()
 
     @classmethod
     def create_timestamp(cls):
@@ -407,6 +733,11 @@ class BaseDataManager(object):
     def get_tags(self, archive_name):
         '''
         Returns the list of tags associated with an archive
+
+        Tags are returned in the order they were added, except by managers
+        which store them as unordered sets, such as
+        :py:class:`~datafs.managers.manager_dynamo.DynamoDBManager`, which
+        return them sorted.
         '''
 
         return self._get_tags(archive_name)
@@ -424,12 +755,9 @@ class BaseDataManager(object):
             tags to add to the archive
 
         '''
-        updated_tag_list = list(self._get_tags(archive_name))
-        for tag in tags:
-            if tag not in updated_tag_list:
-                updated_tag_list.append(tag)
 
-        self._set_tags(archive_name, updated_tag_list)
+        self._add_tags(archive_name, tags)
+        self._listing_cache.invalidate(archive_name)
 
     def delete_tags(self, archive_name, tags):
         '''
@@ -444,45 +772,139 @@ class BaseDataManager(object):
             tags to delete from the archive
 
         '''
-        updated_tag_list = list(self._get_tags(archive_name))
-        for tag in tags:
-            if tag in updated_tag_list:
-                updated_tag_list.remove(tag)
 
-        self._set_tags(archive_name, updated_tag_list)
+        self._delete_tags(archive_name, tags)
+        self._listing_cache.invalidate(archive_name)
+
+    def _get_cached_listing(self, archive_name, fields=None):
+        '''
+        Return the archive listing, using the listing cache if enabled
+
+        If ``fields`` is provided, only these fields are retrieved, and the
+        projection is cached separately from other projections.
+        '''
+
+        if not self._listing_cache.enabled:
+            return self._get_archive_listing(archive_name, fields=fields)
+
+        listing = self._listing_cache.get(archive_name, fields=fields)
+
+        if listing is None:
+            listing = self._get_archive_listing(archive_name, fields=fields)
+            self._listing_cache.set(archive_name, listing, fields=fields)
+
+        return listing
+
+    def _get_cached_listings(self, archive_names, fields=None):
+        '''
+        Return listings for many archives, using the listing cache if enabled
+        '''
+
+        if not self._listing_cache.enabled:
+            return self._get_archive_listings(archive_names, fields=fields)
+
+        listings = {}
+        to_fetch = []
+
+        for archive_name in archive_names:
+            if archive_name in listings or archive_name in to_fetch:
+                continue
+
+            listing = self._listing_cache.get(archive_name, fields=fields)
+
+            if listing is None:
+                to_fetch.append(archive_name)
+            else:
+                listings[archive_name] = listing
+
+        if len(to_fetch) > 0:
+            fetched = self._get_archive_listings(to_fetch, fields=fields)
+
+            for archive_name, listing in fetched.items():
+                self._listing_cache.set(archive_name, listing, fields=fields)
+
+            listings.update(fetched)
+
+        return listings
 
     def _get_archive_spec(self, archive_name):
-        res = self._get_archive_listing(archive_name)
+        spec = ['authority_name', 'archive_path', 'versioned']
+
+        res = self._get_cached_listing(archive_name, fields=spec)
 
         if res is None:
             raise KeyError
 
-        spec = ['authority_name', 'archive_path', 'versioned']
-
         return {k: v for k, v in res.items() if k in spec}
 
     def _get_archive_metadata(self, archive_name):
 
-        return self._get_archive_listing(archive_name)['archive_metadata']
+        return self._get_cached_listing(
+            archive_name, fields=['archive_metadata'])['archive_metadata']
 
     def _get_authority_name(self, archive_name):
 
-        return self._get_archive_listing(archive_name)['authority_name']
+        return self._get_cached_listing(
+            archive_name, fields=['authority_name'])['authority_name']
 
     def _get_archive_path(self, archive_name):
 
-        return self._get_archive_listing(archive_name)['archive_path']
+        return self._get_cached_listing(
+            archive_name, fields=['archive_path'])['archive_path']
+
+    def _get_version_history(self, archive_name, limit=None, after=None):
+
+        version_history = self._get_cached_listing(
+            archive_name, fields=['version_history'])['version_history']
+
+        return self._page_version_history(version_history, limit, after)
+
+    def _get_version_histories(self, archive_names):
+
+        listings = self._get_cached_listings(
+            archive_names, fields=['version_history'])
 
-    def _get_version_history(self, archive_name):
+        return {
+            archive_name: listing.get('version_history', [])
+            for archive_name, listing in listings.items()}
 
-        return self._get_archive_listing(archive_name)['version_history']
+    @staticmethod
+    def _page_version_history(version_history, limit=None, after=None):
+        '''
+        Select a page of an in-document version history
+
+        .. code-block:: python
+
+            >>> BaseDataManager._page_version_history(
+            ...     [1, 2, 3, 4], limit=2, after=1)
+            [2, 3]
+
+        '''
+
+        start = after if after else 0
+        stop = None if limit is None else start + limit
+
+        return list(version_history[start:stop])
 
     def _get_tags(self, archive_name):
 
-        return self._get_archive_listing(archive_name)['tags']
+        return self._get_cached_listing(archive_name, fields=['tags'])['tags']
 
     def _get_latest_hash(self, archive_name):
 
+        listing = self._get_cached_listing(
+            archive_name, fields=['latest_checksum'])
+
+        if 'latest_checksum' in listing:
+            return listing['latest_checksum']
+
+        return self._get_latest_history_hash(archive_name)
+
+    def _get_latest_history_hash(self, archive_name):
+        '''
+        Return the checksum of the last entry in the version history
+        '''
+
         version_history = self._get_version_history(archive_name)
 
         if len(version_history) == 0:
@@ -491,6 +913,156 @@ class BaseDataManager(object):
         else:
             return version_history[-1]['checksum']
 
+    def _get_latest_algorithm(self, archive_name):
+
+        listing = self._get_cached_listing(
+            archive_name, fields=['latest_algorithm'])
+
+        if 'latest_algorithm' in listing:
+            return listing['latest_algorithm']
+
+        version_history = self._get_version_history(archive_name)
+
+        if len(version_history) == 0:
+            return None
+
+        return version_history[-1].get('algorithm')
+
+    def _get_latest_version(self, archive_name):
+
+        listing = self._get_cached_listing(
+            archive_name, fields=['latest_version'])
+
+        if 'latest_version' in listing:
+            return listing['latest_version']
+
+        return self._get_max_version(self._get_version_history(archive_name))
+
+    @staticmethod
+    def _get_max_version(version_history):
+        '''
+        Greatest version in a version history, or None
+
+        .. code-block:: python
+
+            >>> print(BaseDataManager._get_max_version(
+            ...     [{'version': '0.9'}, {'version': '0.10'}]))
+            0.10
+
+        '''
+
+        versions = [
+            v['version'] for v in version_history
+            if v.get('version') not in (None, 'None')]
+
+        if len(versions) == 0:
+            return None
+
+        return max(versions, key=BumpableVersion)
+
+    def _get_version_count(self, archive_name):
+
+        listing = self._get_cached_listing(
+            archive_name, fields=['version_count'])
+
+        if 'version_count' in listing:
+            return int(listing['version_count'])
+
+        return len(self._get_version_history(archive_name))
+
+    @staticmethod
+    def _get_latest_version_fields(version_metadata):
+        '''
+        Archive record fields pointing to the version being registered
+
+        .. code-block:: python
+
+            >>> fields = BaseDataManager._get_latest_version_fields(
+            ...     {'version': '0.1', 'checksum': 'abc'})
+            >>> print(fields['latest_version'])
+            0.1
+            >>> print(fields['latest_checksum'])
+            abc
+
+        '''
+
+        return {
+            'latest_version': version_metadata.get('version'),
+            'latest_checksum': version_metadata.get('checksum'),
+            'latest_algorithm': version_metadata.get('algorithm')}
+
+    def _get_archive_listings(self, archive_names, fields=None):
+        '''
+        Return documents for many archives, keyed by archive name
+
+        Missing archives are omitted. Subclasses should overload this method
+        to retrieve the listings in bulk.
+        '''
+
+        listings = {}
+
+        for archive_name in archive_names:
+            try:
+                listings[archive_name] = self._get_archive_listing(
+                    archive_name, fields=fields)
+            except KeyError:
+                pass
+
+        return listings
+
+    def _update_with_metadata(
+            self,
+            archive_name,
+            version_metadata,
+            archive_metadata):
+        '''
+        Register a new version and update archive metadata
+
+        Overload this method in managers which can commit both changes in a
+        single write.
+        '''
+
+        self._update(archive_name, version_metadata)
+        self._update_metadata(archive_name, archive_metadata)
+
+    def _add_tags(self, archive_name, tags):
+        '''
+        Add tags to an archive
+
+        Reads the current tag list and writes the updated list with
+        ``_set_tags``. Overload this method in managers which can add tags
+        without a prior read.
+        '''
+
+        # read-modify-write must bypass the listing cache
+        updated_tag_list = list(
+            self._get_archive_listing(
+                archive_name, fields=['tags']).get('tags', []))
+        for tag in tags:
+            if tag not in updated_tag_list:
+                updated_tag_list.append(tag)
+
+        self._set_tags(archive_name, updated_tag_list)
+
+    def _delete_tags(self, archive_name, tags):
+        '''
+        Delete tags from an archive
+
+        Reads the current tag list and writes the updated list with
+        ``_set_tags``. Overload this method in managers which can remove tags
+        without a prior read.
+        '''
+
+        # read-modify-write must bypass the listing cache
+        updated_tag_list = list(
+            self._get_archive_listing(
+                archive_name, fields=['tags']).get('tags', []))
+        for tag in tags:
+            if tag in updated_tag_list:
+                updated_tag_list.remove(tag)
+
+        self._set_tags(archive_name, updated_tag_list)
+
     def _create_if_not_exists(
             self,
             archive_name,
@@ -504,9 +1076,49 @@ class BaseDataManager(object):
         except KeyError:
             pass
 
+    def _create_archives(self, archive_metadata):
+        '''
+        Create archives from a list of archive documents
+
+        Overload this method in managers which support bulk writes.
+
+        Returns
+        -------
+        conflicts : list
+            names of archives which already exist
+        '''
+
+        conflicts = []
+
+        for metadata in archive_metadata:
+            try:
+                self._create_archive(metadata['_id'], metadata)
+            except KeyError:
+                conflicts.append(metadata['_id'])
+
+        return conflicts
+
+    def _get_auxiliary_table_names(self, table_name):
+        '''
+        Names of any additional tables maintained alongside ``table_name``
+
+        Overload this method in managers which keep indexes or other data in
+        separate tables. These tables are removed by
+        :py:meth:`~BaseDataManager.delete_table`.
+        '''
+
+        return []
+
+    def _create_auxiliary_tables(self, table_name):
+        '''
+        Create any additional tables or indexes used with ``table_name``
+        '''
+
+        pass
+
     # Private methods (to be implemented by subclasses of DataManager)
 
-    def _get_archive_listing(self, archive_name):
+    def _get_archive_listing(self, archive_name, fields=None):
         raise NotImplementedError(
             'BaseDataManager cannot be used directly. Use a subclass.')
 
@@ -556,3 +1168,13 @@ class BaseDataManager(object):
     def _set_tags(self, archive_name, updated_tag_list):
         raise NotImplementedError(
             'BaseDataManager cannot be used directly. Use a subclass.')
+
+    def _build_tag_index(self):
+        raise NotImplementedError(
+            '{} does not maintain a tag index'.format(
+                self.__class__.__name__))
+
+    def _migrate_version_store(self):
+        raise NotImplementedError(
+            '{} does not support a version store'.format(
+                self.__class__.__name__))
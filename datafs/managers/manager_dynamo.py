@@ -1,10 +1,33 @@
 import boto3
+import threading
+import time
 
 from datafs.managers.manager import BaseDataManager
+from datafs._compat import Queue, Empty
 from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
 from functools import reduce
 
 
+def _get_error_code(err):
+    return err.response.get('Error', {}).get('Code')
+
+
+def _is_type_mismatch(err):
+    '''
+    Whether an update failed because an attribute has an unexpected type
+    '''
+
+    if _get_error_code(err) != 'ValidationException':
+        return False
+
+    message = err.response.get('Error', {}).get('Message', '').lower()
+
+    return (
+        'incorrect operand type' in message or
+        'incorrect data type' in message)
+
+
 class DynamoDBManager(BaseDataManager):
 
     """
@@ -21,15 +44,50 @@ class DynamoDBManager(BaseDataManager):
         Keyword arguments used in initializing a dynamodb
         :py:class:`~boto3.resources.factory.dynamodb.ServiceResource` object
 
+    listing_cache: dict
+        Keyword arguments used in initializing a
+        :py:class:`~datafs.managers.listing_cache.ListingCache` (default
+        None, no caching)
+
+    tag_index: bool
+        Maintain a tag index table (``<table_name>.tags``) keyed by tag and
+        archive name, and serve tag searches with ``Query`` requests against
+        it rather than scanning the archive table (default False). Use
+        :py:meth:`~DynamoDBManager.build_tag_index` to index an existing
+        table.
+
+    scan_segments: int
+        Number of segments used when a search must scan the archive table.
+        Values greater than one read the segments in parallel threads
+        (default 1). Throughput scales with the number of segments up to the
+        table's provisioned read capacity.
+
+    version_store: bool
+        Store each version as a separate item in a ``<table_name>.versions``
+        table, keyed by archive name (hash) and version sequence number
+        (range), rather than in the archive item's ``version_history`` list
+        (default False). This keeps archive items well below DynamoDB's item
+        size limit. Use :py:meth:`~BaseDataManager.migrate_version_store` to
+        move the histories of an existing table.
+
     """
 
+    # Maximum number of keys allowed in a single BatchGetItem request
+    BatchGetSize = 100
+
     def __init__(
             self,
             table_name,
             session_args=None,
-            resource_args=None):
+            resource_args=None,
+            listing_cache=None,
+            tag_index=False,
+            scan_segments=1,
+            version_store=False):
 
-        super(DynamoDBManager, self).__init__(table_name)
+        super(DynamoDBManager, self).__init__(
+            table_name,
+            listing_cache=listing_cache)
 
         self._session_args = {} if session_args is None else session_args
         self._resource_args = {} if resource_args is None else resource_args
@@ -39,6 +97,15 @@ class DynamoDBManager(BaseDataManager):
         self._table = self._resource.Table(self._table_name)
         self._spec_table = self._resource.Table(self._spec_table_name)
 
+        self._tag_index = tag_index
+        self._tag_table = self._resource.Table(self._table_name + '.tags')
+
+        self._scan_segments = int(scan_segments)
+
+        self._version_store = version_store
+        self._version_table = self._resource.Table(
+            self._table_name + '.versions')
+
     @property
     def config(self):
         config = {
@@ -47,8 +114,55 @@ class DynamoDBManager(BaseDataManager):
             'resource_args': self._resource_args
         }
 
+        if self._listing_cache_config is not None:
+            config['listing_cache'] = self._listing_cache_config
+
+        if self._tag_index:
+            config['tag_index'] = True
+
+        if self._scan_segments > 1:
+            config['scan_segments'] = self._scan_segments
+
+        if self._version_store:
+            config['version_store'] = True
+
         return config
 
+    def build_tag_index(self):
+        '''
+        Create and populate the tag index table from the archive table
+
+        Scans the archive table and writes one index item per archive tag.
+        The tag index is enabled on this manager once the backfill completes.
+
+        Returns
+        -------
+        count : int
+            number of archives indexed
+        '''
+
+        tag_table_name = self._table_name + '.tags'
+
+        if tag_table_name not in self._get_table_names():
+            self._create_tag_index_table(tag_table_name)
+
+        kwargs = dict(
+            ProjectionExpression='#id, tags',
+            ExpressionAttributeNames={'#id': '_id'})
+
+        count = 0
+
+        with self._tag_table.batch_writer() as batch:
+            for item in self._scan(**kwargs):
+                for tag in set(item.get('tags', [])):
+                    batch.put_item(Item={'tag': tag, '_id': item['_id']})
+
+                count += 1
+
+        self._tag_index = True
+
+        return count
+
     # Private methods
 
     def _search(self, search_terms, begins_with=None):
@@ -57,6 +171,13 @@ class DynamoDBManager(BaseDataManager):
 
         """
 
+        if self._tag_index and len(search_terms) > 0:
+            for archive_name in self._search_tag_index(
+                    search_terms, begins_with=begins_with):
+                yield archive_name
+
+            return
+
         kwargs = dict(
             ProjectionExpression='#id',
             ExpressionAttributeNames={"#id": "_id"})
@@ -75,8 +196,121 @@ class DynamoDBManager(BaseDataManager):
                 kwargs['FilterExpression'] = Key(
                     '_id').begins_with(begins_with)
 
+        for item in self._scan(**kwargs):
+            yield item['_id']
+
+    def _scan(self, **kwargs):
+        '''
+        Yields all items returned by a ``Scan`` of the archive table
+
+        If the manager was created with ``scan_segments`` greater than one,
+        the table is read with a parallel scan, with one thread per segment.
+        Pages are yielded as they arrive, so items are not returned in table
+        order.
+        '''
+
+        if self._scan_segments <= 1:
+            for page in self._scan_pages(self._table, kwargs):
+                for item in page:
+                    yield item
+
+            return
+
+        pages = Queue()
+        stop = threading.Event()
+        finished = object()
+
+        def scan_worker(segment):
+            try:
+                # boto3 resources are not thread safe, so each segment uses
+                # its own session
+                session = boto3.Session(**self._session_args)
+                table = session.resource(
+                    'dynamodb', **self._resource_args).Table(self._table_name)
+
+                segment_kwargs = dict(
+                    kwargs,
+                    Segment=segment,
+                    TotalSegments=self._scan_segments)
+
+                for page in self._scan_pages(table, segment_kwargs):
+                    if stop.is_set():
+                        break
+
+                    pages.put(page)
+
+            except Exception as e:
+                pages.put(e)
+
+            finally:
+                pages.put(finished)
+
+        workers = [
+            threading.Thread(target=scan_worker, args=(segment,))
+            for segment in range(self._scan_segments)]
+
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        try:
+            remaining = len(workers)
+
+            while remaining > 0:
+                try:
+                    page = pages.get(timeout=0.1)
+                except Empty:
+                    continue
+
+                if page is finished:
+                    remaining -= 1
+
+                elif isinstance(page, Exception):
+                    raise page
+
+                else:
+                    for item in page:
+                        yield item
+
+        finally:
+            stop.set()
+
+    @staticmethod
+    def _scan_pages(table, kwargs):
+        '''
+        Yields pages of items from ``table.scan``, following
+        ``LastEvaluatedKey``
+        '''
+
+        kwargs = dict(kwargs)
+
         while True:
-            res = self._table.scan(**kwargs)
+            res = table.scan(**kwargs)
+
+            yield res['Items']
+
+            if 'LastEvaluatedKey' in res:
+                kwargs['ExclusiveStartKey'] = res['LastEvaluatedKey']
+            else:
+                break
+
+    def _query_tag_index(self, tag, begins_with=None):
+        '''
+        Yields the names of all archives with tag ``tag``
+        '''
+
+        condition = Key('tag').eq(tag)
+
+        if begins_with:
+            condition = condition & Key('_id').begins_with(begins_with)
+
+        kwargs = dict(
+            KeyConditionExpression=condition,
+            ProjectionExpression='#id',
+            ExpressionAttributeNames={'#id': '_id'})
+
+        while True:
+            res = self._tag_table.query(**kwargs)
             for r in res['Items']:
                 yield r['_id']
             if 'LastEvaluatedKey' in res:
@@ -84,6 +318,53 @@ class DynamoDBManager(BaseDataManager):
             else:
                 break
 
+    def _search_tag_index(self, search_terms, begins_with=None):
+        '''
+        Yields the names of archives with all tags in ``search_terms``
+
+        Each tag is resolved with a ``Query`` on the tag index table and the
+        results are intersected.
+        '''
+
+        matches = None
+
+        for tag in set(search_terms):
+            tagged = set(self._query_tag_index(tag, begins_with=begins_with))
+
+            matches = tagged if matches is None else (matches & tagged)
+
+            if len(matches) == 0:
+                return
+
+        for archive_name in sorted(matches):
+            yield archive_name
+
+    def _index_tags(self, archive_name, add_tags=None, remove_tags=None):
+        '''
+        Add and remove tag index items for an archive
+        '''
+
+        with self._tag_table.batch_writer() as batch:
+            for tag in set(remove_tags if remove_tags else []):
+                batch.delete_item(Key={'tag': tag, '_id': archive_name})
+
+            for tag in set(add_tags if add_tags else []):
+                batch.put_item(Item={'tag': tag, '_id': archive_name})
+
+    def _get_current_tags(self, archive_name):
+        '''
+        Read an archive's tags directly from the table (bypasses the cache)
+        '''
+
+        res = self._table.get_item(
+            Key={'_id': archive_name},
+            ProjectionExpression='tags')
+
+        if 'Item' not in res:
+            raise KeyError('Archive "{}" not found'.format(archive_name))
+
+        return res['Item'].get('tags', [])
+
     def _update(self, archive_name, version_metadata):
         '''
         Updates the version specific metadata attribute in DynamoDB
@@ -103,17 +384,79 @@ class DynamoDBManager(BaseDataManager):
             list of dictionaries of version_history
         '''
 
-        command = "SET version_history = list_append(version_history, :v)"
-
-        self._table.update_item(
-            Key={'_id': archive_name},
-            UpdateExpression=command,
-            ExpressionAttributeValues={':v': [version_metadata]},
-            ReturnValues='ALL_NEW')
+        self._push_version(archive_name, version_metadata)
 
     def _get_table_names(self):
         return [t.name for t in self._resource.tables.all()]
 
+    def _get_auxiliary_table_names(self, table_name):
+
+        table_names = [table_name + '.versions']
+
+        if self._tag_index:
+            table_names.append(table_name + '.tags')
+
+        return table_names
+
+    def _create_auxiliary_tables(self, table_name):
+
+        if self._tag_index:
+            self._create_tag_index_table(table_name + '.tags')
+
+        if self._version_store:
+            self._create_version_store_table(table_name + '.versions')
+
+    def _create_tag_index_table(self, table_name):
+        '''
+        Create a tag index table keyed by ``tag`` (hash) and ``_id`` (range)
+        '''
+
+        self._create_composite_key_table(
+            table_name, ('tag', 'S'), ('_id', 'S'))
+
+    def _create_version_store_table(self, table_name):
+        '''
+        Create a version store table keyed by ``archive`` (hash) and ``seq``
+        (range)
+        '''
+
+        self._create_composite_key_table(
+            table_name, ('archive', 'S'), ('seq', 'N'))
+
+    def _create_composite_key_table(self, table_name, hash_key, range_key):
+        '''
+        Create a table with a composite primary key
+
+        ``hash_key`` and ``range_key`` are ``(attribute name, attribute
+        type)`` tuples.
+        '''
+
+        if table_name in self._get_table_names():
+            raise KeyError('Table "{}" already exists'.format(table_name))
+
+        try:
+            table = self._resource.create_table(
+                TableName=table_name,
+                KeySchema=[
+                    {'AttributeName': hash_key[0], 'KeyType': 'HASH'},
+                    {'AttributeName': range_key[0], 'KeyType': 'RANGE'}],
+                AttributeDefinitions=[
+                    {'AttributeName': hash_key[0],
+                        'AttributeType': hash_key[1]},
+                    {'AttributeName': range_key[0],
+                        'AttributeType': range_key[1]}],
+                ProvisionedThroughput={
+                    'ReadCapacityUnits': 123,
+                    'WriteCapacityUnits': 123})
+
+            table.meta.client.get_waiter('table_exists').wait(
+                TableName=table_name)
+
+        except ValueError:
+            # Error handling for windows incompatability issue
+            msg = 'Table creation failed'
+            assert table_name in self._get_table_names(), msg
+
     def _create_archive_table(self, table_name):
         '''
         Dynamo implementation of BaseDataManager create_archive_table
@@ -203,7 +546,11 @@ class DynamoDBManager(BaseDataManager):
 
     def _update_metadata(self, archive_name, archive_metadata):
         """
-        Appends the updated_metada dict to the Metadata Attribute list
+        Sets and removes keys in the archive_metadata map attribute
+
+        Each key is written with its own ``SET``/``REMOVE`` clause of a
+        single update expression, so no prior read is required and
+        concurrent updates to different keys are not lost.
 
         Parameters
         ----------
@@ -218,18 +565,225 @@ class DynamoDBManager(BaseDataManager):
 
         """
 
-        archive_metadata_current = self._get_archive_metadata(archive_name)
-        archive_metadata_current.update(archive_metadata)
-        for k, v in archive_metadata_current.items():
-            if v is None:
-                del archive_metadata_current[k]
+        set_clauses, remove_clauses, names, values = \
+            self._get_metadata_update_clauses(archive_metadata)
 
-        # add the updated archive_metadata object to Dynamo
-        self._table.update_item(
+        if len(set_clauses) + len(remove_clauses) == 0:
+            return
+
+        self._update_archive_item(
+            archive_name,
+            set_clauses=set_clauses,
+            remove_clauses=remove_clauses,
+            names=names,
+            values=values)
+
+    def _update_with_metadata(
+            self,
+            archive_name,
+            version_metadata,
+            archive_metadata):
+
+        set_clauses, remove_clauses, names, values = \
+            self._get_metadata_update_clauses(archive_metadata)
+
+        self._push_version(
+            archive_name,
+            version_metadata,
+            set_clauses=set_clauses,
+            remove_clauses=remove_clauses,
+            names=names,
+            values=values)
+
+    def _push_version(
+            self,
+            archive_name,
+            version_metadata,
+            set_clauses=None,
+            remove_clauses=None,
+            names=None,
+            values=None):
+        '''
+        Register a version, along with any other update clauses
+
+        The archive's latest version attributes and ``version_count`` are
+        updated in the same ``update_item`` request.
+        '''
+
+        set_clauses = list(set_clauses) if set_clauses else []
+        values = dict(values) if values else {}
+
+        if self._version_store:
+            self._store_version(
+                archive_name,
+                version_metadata,
+                set_clauses=set_clauses,
+                remove_clauses=remove_clauses,
+                names=names,
+                values=values)
+
+            return
+
+        self._add_latest_version_clauses(version_metadata, set_clauses, values)
+
+        set_clauses.insert(
+            0, 'version_history = list_append(version_history, :v)')
+        values[':v'] = [version_metadata]
+        values[':one'] = 1
+
+        kwargs = dict(
+            set_clauses=set_clauses,
+            remove_clauses=remove_clauses,
+            add_clauses=['version_count :one'],
+            names=names,
+            values=values)
+
+        try:
+            self._update_archive_item(
+                archive_name,
+                condition='attribute_exists(version_count)',
+                **kwargs)
+
+        except KeyError:
+            if not self._init_version_count(archive_name):
+                raise
+
+            self._update_archive_item(archive_name, **kwargs)
+
+    def _init_version_count(self, archive_name):
+        '''
+        Set a missing ``version_count`` from the archive's version history
+
+        Archives written before the count was introduced are initialised
+        before their first increment. Returns False if the archive does not
+        exist.
+        '''
+
+        item = self._table.get_item(
             Key={'_id': archive_name},
-            UpdateExpression="SET archive_metadata = :v",
-            ExpressionAttributeValues={':v': archive_metadata_current},
-            ReturnValues='ALL_NEW')
+            ProjectionExpression='version_history',
+            ConsistentRead=True).get('Item')
+
+        if item is None:
+            return False
+
+        try:
+            self._update_archive_item(
+                archive_name,
+                set_clauses=['version_count = :n'],
+                values={':n': len(item.get('version_history', []))},
+                condition='attribute_not_exists(version_count)')
+
+        except KeyError:
+            # already initialised by another writer
+            pass
+
+        return True
+
+    def _add_latest_version_clauses(
+            self, version_metadata, set_clauses, values):
+        '''
+        Add clauses setting the archive's latest version attributes
+        '''
+
+        latest = self._get_latest_version_fields(version_metadata)
+
+        for i, field in enumerate(sorted(latest.keys())):
+            set_clauses.append('{} = :l{}'.format(field, i))
+            values[':l{}'.format(i)] = latest[field]
+
+    @staticmethod
+    def _get_metadata_update_clauses(archive_metadata):
+        '''
+        Build update expression clauses for archive metadata changes
+
+        .. code-block:: python
+
+            >>> set_clauses, remove_clauses, names, values = (
+            ...     DynamoDBManager._get_metadata_update_clauses(
+            ...         {'source': 'NASA'}))
+            >>> set_clauses
+            ['archive_metadata.#m0 = :m0']
+            >>> names
+            {'#m0': 'source'}
+
+        '''
+
+        set_clauses = []
+        remove_clauses = []
+        names = {}
+        values = {}
+
+        for i, (key, val) in enumerate(sorted(archive_metadata.items())):
+            names['#m{}'.format(i)] = key
+
+            if val is None:
+                remove_clauses.append('archive_metadata.#m{}'.format(i))
+
+            else:
+                set_clauses.append('archive_metadata.#m{0} = :m{0}'.format(i))
+                values[':m{}'.format(i)] = val
+
+        return set_clauses, remove_clauses, names, values
+
+    def _update_archive_item(
+            self,
+            archive_name,
+            set_clauses=None,
+            remove_clauses=None,
+            add_clauses=None,
+            delete_clauses=None,
+            names=None,
+            values=None,
+            return_values=None,
+            condition=None):
+        '''
+        Apply an update expression to an existing archive item
+
+        Raises a KeyError if the archive does not exist, or does not meet the
+        additional ``condition``, rather than creating a new item. Returns the
+        ``update_item`` response.
+        '''
+
+        clauses = []
+
+        for action, action_clauses in [
+                ('SET', set_clauses),
+                ('REMOVE', remove_clauses),
+                ('ADD', add_clauses),
+                ('DELETE', delete_clauses)]:
+
+            if action_clauses:
+                clauses.append('{} {}'.format(
+                    action, ', '.join(action_clauses)))
+
+        names = dict(names) if names else {}
+        names['#id'] = '_id'
+
+        kwargs = dict(
+            Key={'_id': archive_name},
+            UpdateExpression=' '.join(clauses),
+            ConditionExpression='attribute_exists(#id)',
+            ExpressionAttributeNames=names)
+
+        if condition is not None:
+            kwargs['ConditionExpression'] = (
+                'attribute_exists(#id) AND ({})'.format(condition))
+
+        if values:
+            kwargs['ExpressionAttributeValues'] = values
+
+        if return_values is not None:
+            kwargs['ReturnValues'] = return_values
+
+        try:
+            return self._table.update_item(**kwargs)
+
+        except ClientError as e:
+            if _get_error_code(e) == 'ConditionalCheckFailedException':
+                raise KeyError('Archive "{}" not found'.format(archive_name))
+
+            raise
 
     def _create_archive(
             self,
@@ -250,42 +804,569 @@ class DynamoDBManager(BaseDataManager):
 
         '''
 
-        archive_exists = False
+        item = self._prepare_archive_item(metadata)
 
         try:
-            self.get_archive(archive_name)
-            archive_exists = True
-        except KeyError:
-            pass
+            self._table.put_item(
+                Item=item,
+                ConditionExpression='attribute_not_exists(#id)',
+                ExpressionAttributeNames={'#id': '_id'})
+
+        except ClientError as e:
+            if _get_error_code(e) == 'ConditionalCheckFailedException':
+                raise KeyError(
+                    "{} already exists. Use get_archive() to view".format(
+                        archive_name))
 
-        if archive_exists:
-            raise KeyError(
-                "{} already exists. Use get_archive() to view".format(
-                    archive_name))
+            raise
 
-        self._table.put_item(Item=metadata)
+        if self._tag_index:
+            self._index_tags(archive_name, add_tags=item.get('tags'))
 
-    def _get_archive_listing(self, archive_name):
+    def _create_archives(self, archive_metadata):
         '''
-        Return full document for ``{_id:'archive_name'}``
+        Write many new archive items with conditional ``PutItem`` requests
+
+        ``BatchWriteItem`` does not support condition expressions, so each
+        archive is written with ``attribute_not_exists(_id)`` and archives
+        created by another client in the meantime are reported as conflicts
+        rather than overwritten. Tag index entries for the new archives are
+        written in a batch.
+        '''
+
+        conflicts = []
+        items = []
+
+        for metadata in archive_metadata:
+            item = self._prepare_archive_item(metadata)
+
+            try:
+                self._table.put_item(
+                    Item=item,
+                    ConditionExpression='attribute_not_exists(#id)',
+                    ExpressionAttributeNames={'#id': '_id'})
+
+            except ClientError as e:
+                if _get_error_code(e) == 'ConditionalCheckFailedException':
+                    conflicts.append(metadata['_id'])
+                    continue
+
+                raise
+
+            items.append(item)
+
+        if self._tag_index:
+            with self._tag_table.batch_writer() as batch:
+                for item in items:
+                    for tag in item.get('tags', []):
+                        batch.put_item(Item={'tag': tag, '_id': item['_id']})
+
+        return conflicts
+
+    @staticmethod
+    def _prepare_archive_item(metadata):
+        '''
+        Convert an archive document into a DynamoDB item
+
+        Tags are stored as a string set, which cannot be empty.
+        '''
+
+        item = dict(metadata)
+
+        if item.get('tags'):
+            item['tags'] = set(item['tags'])
+        else:
+            item.pop('tags', None)
+
+        return item
+
+    def _get_archive_listing(self, archive_name, fields=None):
+        '''
+        Return document for ``{_id:'archive_name'}``
+
+        If ``fields`` is provided, only these top-level attributes are
+        requested using a ``ProjectionExpression``.
 
         .. note::
 
             DynamoDB specific results - do not expose to user
         '''
-        return self._table.get_item(Key={'_id': archive_name})['Item']
+
+        kwargs = {'Key': {'_id': archive_name}}
+
+        if fields is not None:
+            (kwargs['ProjectionExpression'],
+                kwargs['ExpressionAttributeNames']) = self._get_projection(
+                    fields)
+
+        return self._table.get_item(**kwargs)['Item']
+
+    def _get_archive_listings(self, archive_names, fields=None):
+        '''
+        Return documents for all archives in ``archive_names``
+
+        Keys are requested with ``BatchGetItem`` in chunks of
+        :py:attr:`~DynamoDBManager.BatchGetSize`. Unprocessed keys are retried
+        with exponential backoff.
+        '''
+
+        if fields is None:
+            return self._batch_get_items(archive_names)
+
+        projection, attribute_names = self._get_projection(fields)
+
+        return self._batch_get_items(
+            archive_names,
+            projection=projection,
+            attribute_names=attribute_names)
+
+    @staticmethod
+    def _get_projection(fields):
+        '''
+        Build a ``ProjectionExpression`` and attribute names from a list of
+        fields
+
+        Attribute names are always substituted, since several (e.g.
+        ``tags``) are DynamoDB reserved words.
+
+        .. code-block:: python
+
+            >>> expr, names = DynamoDBManager._get_projection(['tags'])
+            >>> expr
+            '#id, #f0'
+            >>> sorted(names.items())
+            [('#f0', 'tags'), ('#id', '_id')]
+
+        '''
+
+        names = {'#id': '_id'}
+        placeholders = ['#id']
+
+        for i, field in enumerate(fields):
+            if field == '_id':
+                continue
+
+            names['#f{}'.format(i)] = field
+            placeholders.append('#f{}'.format(i))
+
+        return ', '.join(placeholders), names
+
+    def _batch_get_items(
+            self,
+            archive_names,
+            projection=None,
+            attribute_names=None):
+        '''
+        Return items for ``archive_names`` using ``BatchGetItem``
+
+        Parameters
+        ----------
+        archive_names : list
+            primary keys to retrieve
+
+        projection : str
+            optional ``ProjectionExpression`` applied to each request
+
+        attribute_names : dict
+            ``ExpressionAttributeNames`` used in ``projection``
+
+        Returns
+        -------
+        items : dict
+            items keyed by archive name. Missing archives are omitted.
+        '''
+
+        listings = {}
+        archive_names = list(archive_names)
+
+        for st_ind in range(0, len(archive_names), self.BatchGetSize):
+            batch = archive_names[st_ind:st_ind+self.BatchGetSize]
+
+            keys_and_attrs = {
+                'Keys': [
+                    {'_id': archive_name} for archive_name in set(batch)]}
+
+            if projection is not None:
+                keys_and_attrs['ProjectionExpression'] = projection
+
+            if attribute_names is not None:
+                keys_and_attrs['ExpressionAttributeNames'] = attribute_names
+
+            request = {self._table_name: keys_and_attrs}
+
+            retries = 0
+
+            while len(request) > 0:
+                res = self._resource.batch_get_item(RequestItems=request)
+
+                for item in res['Responses'].get(self._table_name, []):
+                    listings[item['_id']] = item
+
+                request = res.get('UnprocessedKeys', {})
+
+                if len(request) > 0:
+                    time.sleep(min(0.05 * (2 ** retries), 5))
+                    retries += 1
+
+        return listings
+
+    def _store_version(
+            self,
+            archive_name,
+            version_metadata,
+            set_clauses=None,
+            remove_clauses=None,
+            names=None,
+            values=None):
+        '''
+        Write a version to the version store
+
+        The version item is put first, under the next free sequence number,
+        so that the archive's ``version_count`` and latest version attributes
+        never refer to an item which was not written. The count and latest
+        version attributes are then advanced, along with any metadata
+        updates, unless a later version has been stored in the meantime.
+        '''
+
+        set_clauses = list(set_clauses) if set_clauses else []
+        values = dict(values) if values else {}
+
+        item = self._table.get_item(
+            Key={'_id': archive_name},
+            ProjectionExpression='version_count',
+            ConsistentRead=True).get('Item')
+
+        if item is None:
+            raise KeyError('Archive "{}" not found'.format(archive_name))
+
+        record = dict(version_metadata)
+        record['archive'] = archive_name
+        record['seq'] = int(item.get('version_count', 0)) + 1
+
+        # each sequence number is written once. Numbers taken by concurrent
+        # or interrupted writes are skipped.
+        while True:
+            try:
+                self._version_table.put_item(
+                    Item=record,
+                    ConditionExpression='attribute_not_exists(seq)')
+                break
+
+            except ClientError as e:
+                if _get_error_code(e) != 'ConditionalCheckFailedException':
+                    raise
+
+                record['seq'] += 1
+
+        latest_clauses = list(set_clauses)
+        latest_values = dict(values)
+
+        self._add_latest_version_clauses(
+            version_metadata, latest_clauses, latest_values)
+
+        latest_clauses.append('version_count = :seq')
+        latest_values[':seq'] = record['seq']
+
+        try:
+            self._update_archive_item(
+                archive_name,
+                set_clauses=latest_clauses,
+                remove_clauses=remove_clauses,
+                names=names,
+                values=latest_values,
+                condition=(
+                    'attribute_not_exists(version_count) OR '
+                    'version_count < :seq'))
+
+        except KeyError:
+            # a later version is already recorded. Apply only the metadata.
+            if set_clauses or remove_clauses:
+                self._update_archive_item(
+                    archive_name,
+                    set_clauses=set_clauses,
+                    remove_clauses=remove_clauses,
+                    names=names,
+                    values=values)
+
+    def _query_version_store(
+            self, archive_name, limit=None, after=None, last=None):
+        '''
+        Yields version store items for an archive in sequence order
+
+        Items with ``seq`` greater than ``after`` are returned, up to and
+        including ``last`` if given.
+        '''
+
+        after = after if after else 0
+
+        if last is None:
+            seq_condition = Key('seq').gt(after)
+        elif last <= after:
+            return
+        else:
+            seq_condition = Key('seq').between(after + 1, last)
+
+        kwargs = dict(
+            KeyConditionExpression=(
+                Key('archive').eq(archive_name) & seq_condition))
+
+        if limit is not None:
+            kwargs['Limit'] = limit
+
+        count = 0
+
+        while limit is None or count < limit:
+            res = self._version_table.query(**kwargs)
+
+            for item in res['Items']:
+                if limit is not None and count >= limit:
+                    break
+
+                yield item
+                count += 1
+
+            if 'LastEvaluatedKey' in res:
+                kwargs['ExclusiveStartKey'] = res['LastEvaluatedKey']
+            else:
+                break
+
+    def _get_version_history(self, archive_name, limit=None, after=None):
+
+        if not self._version_store:
+            return super(DynamoDBManager, self)._get_version_history(
+                archive_name, limit=limit, after=after)
+
+        count = self._get_stored_version_count(archive_name)
+
+        if limit == 0:
+            return []
+
+        version_history = []
+
+        # every seq up to the archive's version_count holds a committed
+        # version, so skipping ``after`` versions starts at seq after + 1
+        for item in self._query_version_store(
+                archive_name, limit=limit, after=after, last=count):
+
+            item.pop('archive')
+            item.pop('seq')
+            version_history.append(item)
+
+        return version_history
+
+    def _get_stored_version_count(self, archive_name):
+        '''
+        Number of versions recorded in the version store for an archive
+
+        Records above this sequence number were written by an update which
+        has not yet advanced the archive's ``version_count``, or which was
+        interrupted, and are not read. Raises a KeyError if the archive does
+        not exist.
+        '''
+
+        return int(self._get_archive_listing(
+            archive_name, fields=['version_count']).get('version_count', 0))
+
+    def _get_version_histories(self, archive_names):
+
+        if not self._version_store:
+            return super(DynamoDBManager, self)._get_version_histories(
+                archive_names)
+
+        version_histories = {}
+
+        # version records are partitioned by archive, so each history is
+        # read with its own query
+        for archive_name, listing in self._get_archive_listings(
+                archive_names, fields=['version_count']).items():
+
+            version_histories[archive_name] = []
+
+            for item in self._query_version_store(
+                    archive_name,
+                    last=int(listing.get('version_count', 0))):
+                item.pop('archive')
+                item.pop('seq')
+                version_histories[archive_name].append(item)
+
+        return version_histories
+
+    def _get_latest_history_hash(self, archive_name):
+
+        if not self._version_store:
+            return super(
+                DynamoDBManager, self)._get_latest_history_hash(archive_name)
+
+        count = self._get_stored_version_count(archive_name)
+
+        if count == 0:
+            return None
+
+        res = self._version_table.query(
+            KeyConditionExpression=(
+                Key('archive').eq(archive_name) & Key('seq').lte(count)),
+            ScanIndexForward=False,
+            Limit=1)
+
+        if len(res['Items']) == 0:
+            return None
+
+        return res['Items'][0]['checksum']
+
+    def _migrate_version_store(self):
+
+        table_name = self._table_name + '.versions'
+
+        if table_name not in self._get_table_names():
+            self._create_version_store_table(table_name)
+
+        kwargs = dict(
+            ProjectionExpression='#id, version_history, version_count',
+            ExpressionAttributeNames={'#id': '_id'})
+
+        count = 0
+
+        for item in self._scan(**kwargs):
+            version_history = item.get('version_history', [])
+
+            if len(version_history) == 0:
+                continue
+
+            # version_count already includes the in-document versions
+            start = max(
+                int(item.get('version_count', 0)) - len(version_history), 0)
+
+            with self._version_table.batch_writer() as batch:
+                for i, version_metadata in enumerate(version_history):
+                    record = dict(version_metadata)
+                    record['archive'] = item['_id']
+                    record['seq'] = start + i + 1
+                    batch.put_item(Item=record)
+
+            latest = self._get_latest_version_fields(version_history[-1])
+
+            self._update_archive_item(
+                item['_id'],
+                set_clauses=[
+                    'version_history = :h',
+                    'version_count = :n',
+                    'latest_version = :lv',
+                    'latest_checksum = :lc',
+                    'latest_algorithm = :la'],
+                values={
+                    ':h': [],
+                    ':n': start + len(version_history),
+                    ':lv': latest['latest_version'],
+                    ':lc': latest['latest_checksum'],
+                    ':la': latest['latest_algorithm']})
+
+            self._listing_cache.invalidate(item['_id'])
+
+            count += 1
+
+        self._version_store = True
+
+        return count
 
     def _delete_archive_record(self, archive_name):
 
+        if self._version_store:
+            with self._version_table.batch_writer() as batch:
+                for item in list(self._query_version_store(archive_name)):
+                    batch.delete_item(
+                        Key={'archive': archive_name, 'seq': item['seq']})
+
+        if self._tag_index:
+            try:
+                self._index_tags(
+                    archive_name,
+                    remove_tags=self._get_current_tags(archive_name))
+            except KeyError:
+                pass
+
         return self._table.delete_item(Key={'_id': archive_name})
 
     def _get_spec_documents(self, table_name):
         return self._resource.Table(table_name + '.spec').scan()['Items']
 
+    def _get_tags(self, archive_name):
+
+        tags = self._get_cached_listing(
+            archive_name, fields=['tags']).get('tags', [])
+
+        # string sets are unordered
+        if isinstance(tags, set):
+            return sorted(tags)
+
+        return list(tags)
+
     def _set_tags(self, archive_name, updated_tag_list):
 
-        self._table.update_item(
-                Key={'_id': archive_name},
-                UpdateExpression="SET tags = :t",
-                ExpressionAttributeValues={':t': updated_tag_list},
-                ReturnValues='ALL_NEW')
+        if self._tag_index:
+            current_tags = set(self._get_current_tags(archive_name))
+
+            self._index_tags(
+                archive_name,
+                add_tags=set(updated_tag_list) - current_tags,
+                remove_tags=current_tags - set(updated_tag_list))
+
+        if len(updated_tag_list) > 0:
+            self._update_archive_item(
+                archive_name,
+                set_clauses=['tags = :t'],
+                values={':t': set(updated_tag_list)})
+
+        else:
+            self._update_archive_item(archive_name, remove_clauses=['tags'])
+
+    def _add_tags(self, archive_name, tags):
+        '''
+        Add tags with a single ``ADD`` on the tags string set
+        '''
+
+        if len(tags) == 0:
+            return
+
+        try:
+            self._update_archive_item(
+                archive_name,
+                add_clauses=['tags :t'],
+                values={':t': set(tags)})
+
+        except ClientError as e:
+            if not _is_type_mismatch(e):
+                raise
+
+            # tags stored as a list by an earlier version of DataFS. Rewrite
+            # them as a string set.
+            super(DynamoDBManager, self)._add_tags(archive_name, tags)
+            return
+
+        if self._tag_index:
+            self._index_tags(archive_name, add_tags=tags)
+
+    def _delete_tags(self, archive_name, tags):
+        '''
+        Remove tags with a single ``DELETE`` on the tags string set
+        '''
+
+        if len(tags) == 0:
+            return
+
+        try:
+            self._update_archive_item(
+                archive_name,
+                delete_clauses=['tags :t'],
+                values={':t': set(tags)})
+
+        except ClientError as e:
+            if not _is_type_mismatch(e):
+                raise
+
+            # tags stored as a list by an earlier version of DataFS. Rewrite
+            # them as a string set.
+            super(DynamoDBManager, self)._delete_tags(archive_name, tags)
+            return
+
+        if self._tag_index:
+            self._index_tags(archive_name, remove_tags=tags)
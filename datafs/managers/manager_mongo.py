@@ -3,8 +3,27 @@ from __future__ import absolute_import
 
 from datafs.managers.manager import BaseDataManager
 
-from pymongo import MongoClient
-from pymongo.errors import DuplicateKeyError
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+
+import re
+
+
+def _prefix_regex(prefix):
+    '''
+    Anchored regular expression matching strings beginning with ``prefix``
+
+    Only regex metacharacters are escaped so MongoDB can recognize the
+    pattern as a simple prefix and bound the ``_id`` index scan.
+
+    .. code-block:: python
+
+        >>> print(_prefix_regex('team1_project(2).'))
+        ^team1_project\\(2\\)\\.
+
+    '''
+
+    return '^' + re.sub(r'([\\.^$|?*+()\[\]{}])', r'\\\1', prefix)
 
 
 class MongoDBManager(BaseDataManager):
@@ -21,10 +40,44 @@ class MongoDBManager(BaseDataManager):
     client_kwargs : dict
         Keyword arguments used in initializing a
         :py:class:`pymongo.MongoClient` object
+
+    listing_cache : dict
+        Keyword arguments used in initializing a
+        :py:class:`~datafs.managers.listing_cache.ListingCache` (default
+        None, no caching)
+
+    index_fields : list
+        Archive metadata fields to index in addition to ``tags``. Indexes
+        are built by :py:meth:`~BaseDataManager.create_archive_table` and
+        can be added to existing tables with
+        :py:meth:`~BaseDataManager.build_tag_index`.
+
+    version_store : bool
+        Store each version as a separate document in a
+        ``<table_name>.versions`` collection, keyed by archive name and
+        version sequence number, rather than in the archive document's
+        ``version_history`` array (default False). Use
+        :py:meth:`~BaseDataManager.migrate_version_store` to move the
+        histories of an existing table.
     '''
 
-    def __init__(self, database_name, table_name, client_kwargs=None):
-        super(MongoDBManager, self).__init__(table_name)
+    BatchSize = 1000
+
+    def __init__(
+            self,
+            database_name,
+            table_name,
+            client_kwargs=None,
+            listing_cache=None,
+            index_fields=None,
+            version_store=False):
+
+        super(MongoDBManager, self).__init__(
+            table_name,
+            listing_cache=listing_cache)
+
+        self._index_fields = index_fields
+        self._version_store = version_store
 
         if client_kwargs is None:
             client_kwargs = {}
@@ -48,8 +101,39 @@ class MongoDBManager(BaseDataManager):
             'client_kwargs': self._client_kwargs
         }
 
+        if self._listing_cache_config is not None:
+            config['listing_cache'] = self._listing_cache_config
+
+        if self._index_fields is not None:
+            config['index_fields'] = self._index_fields
+
+        if self._version_store:
+            config['version_store'] = True
+
         return config
 
+    def build_tag_index(self):
+        '''
+        Build the ``tags`` and metadata indexes on an existing table
+
+        Returns
+        -------
+        count : int
+            number of archives indexed
+        '''
+
+        self._create_auxiliary_tables(self._table_name)
+
+        return self.collection.count()
+
+    @property
+    def version_collection(self):
+        '''
+        Version store collection handle
+        '''
+
+        return self.db[self._table_name + '.versions']
+
     @property
     def database_name(self):
         return self._database_name
@@ -67,30 +151,95 @@ class MongoDBManager(BaseDataManager):
 
         self.db.create_collection(table_name)
 
+    def _create_auxiliary_tables(self, table_name):
+        '''
+        Build a multikey index on ``tags`` and on any configured metadata
+        fields
+        '''
+
+        coll = self.db[table_name]
+
+        coll.create_index('tags')
+
+        for field in (
+                self._index_fields if self._index_fields is not None else []):
+            coll.create_index('archive_metadata.{}'.format(field))
+
+        if self._version_store:
+            self._create_version_store(table_name)
+
+    def _create_version_store(self, table_name):
+
+        self.db[table_name + '.versions'].create_index(
+            [('archive', ASCENDING), ('seq', ASCENDING)],
+            unique=True)
+
+    def _get_auxiliary_table_names(self, table_name):
+
+        return [table_name + '.versions']
+
     def _delete_table(self, table_name):
         if table_name not in self._get_table_names():
             raise KeyError('Table "{}" not found'.format(table_name))
 
         self.db.drop_collection(table_name)
+        self.refresh()
 
     @property
     def collection(self):
-        table_name = self.table_name
+        '''
+        Archive collection handle
 
-        if table_name not in self._get_table_names():
-            raise KeyError('Table "{}" not found'.format(table_name))
+        The handle is validated against the database's collection list on
+        first access and reused afterwards. See
+        :py:meth:`~MongoDBManager.refresh`.
+        '''
 
-        return self.db[table_name]
+        if self._coll is None:
+            self._coll = self._get_validated_collection(self.table_name)
+
+        return self._coll
 
     @property
     def spec_collection(self):
+        '''
+        Spec collection handle
 
-        spec_table_name = self._spec_table_name
+        Validated on first access and reused afterwards.
+        '''
 
-        if spec_table_name not in self._get_table_names():
-            raise KeyError('Table "{}" not found'.format(spec_table_name))
+        if self._spec_coll is None:
+            self._spec_coll = self._get_validated_collection(
+                self._spec_table_name)
+
+        return self._spec_coll
+
+    def refresh(self):
+        '''
+        Drop cached collection handles
 
-        return self.db[spec_table_name]
+        Collections are checked for existence again the next time they are
+        accessed. Handles are refreshed automatically when this manager
+        deletes a table or an operation finds no matching archive.
+        '''
+
+        self._coll = None
+        self._spec_coll = None
+
+    def _get_validated_collection(self, table_name):
+
+        if table_name not in self._get_table_names():
+            raise KeyError('Table "{}" not found'.format(table_name))
+
+        return self.db[table_name]
+
+    def _revalidate(self):
+        '''
+        Refresh collection handles and raise KeyError if the table is gone
+        '''
+
+        self.refresh()
+        self.collection
 
     @property
     def db(self):
@@ -102,23 +251,276 @@ class MongoDBManager(BaseDataManager):
     # Private methods (to be implemented!)
 
     def _update(self, archive_name, version_metadata):
-        self.collection.update(
-            {"_id": archive_name},
-            {"$push": {"version_history": version_metadata}})
+
+        self._push_version(archive_name, version_metadata, {})
+
+    def _update_with_metadata(
+            self,
+            archive_name,
+            version_metadata,
+            archive_metadata):
+
+        self._push_version(
+            archive_name,
+            version_metadata,
+            self._get_metadata_update(archive_metadata))
+
+    def _push_version(self, archive_name, version_metadata, update):
+        '''
+        Register a version, along with any other changes in ``update``
+
+        The archive's latest version fields and ``version_count`` are
+        updated in the same write.
+        '''
+
+        update.setdefault('$set', {}).update(
+            self._get_latest_version_fields(version_metadata))
+        update['$inc'] = {'version_count': 1}
+
+        if self._version_store:
+            self._store_version(archive_name, version_metadata, update)
+            return
+
+        update['$push'] = {"version_history": version_metadata}
+
+        res = self.collection.update_one(
+            {"_id": archive_name, "version_count": {"$exists": True}}, update)
+
+        if res.matched_count == 0 and self._init_version_count(archive_name):
+            res = self.collection.update_one({"_id": archive_name}, update)
+
+        if res.matched_count == 0:
+            self._revalidate()
+
+    def _init_version_count(self, archive_name):
+        '''
+        Set a missing ``version_count`` from the archive's version history
+
+        Archives written before the count was introduced are initialised
+        before their first increment. Returns False if the archive does not
+        exist.
+        '''
+
+        doc = self.collection.find_one(
+            {'_id': archive_name}, projection={'version_history': True})
+
+        if doc is None:
+            return False
+
+        self.collection.update_one(
+            {'_id': archive_name, 'version_count': {'$exists': False}},
+            {'$set': {'version_count': len(doc.get('version_history', []))}})
+
+        return True
 
     def _update_metadata(self, archive_name, archive_metadata):
 
-        for key, val in archive_metadata.items():
+        update = self._get_metadata_update(archive_metadata)
 
-            if val is None:
-                self.collection.update(
-                    {"_id": archive_name},
-                    {"$unset": {"archive_metadata.{}".format(key): ""}})
+        if len(update) == 0:
+            return
+
+        res = self.collection.update_one({"_id": archive_name}, update)
+
+        if res.matched_count == 0:
+            self._revalidate()
+
+    def _store_version(self, archive_name, version_metadata, update=None):
+        '''
+        Write a version to the version store
+
+        The version record is inserted first, under the next free sequence
+        number, so that the archive's ``version_count`` and latest version
+        fields never refer to a record which was not written. The count and
+        latest version fields are then advanced, along with any metadata
+        ``update``, unless a later version has been stored in the meantime.
+        '''
+
+        update = dict(update) if update else {}
+        update.pop('$inc', None)
+
+        archive = self.collection.find_one(
+            {'_id': archive_name}, projection={'version_count': True})
+
+        if archive is None:
+            self._revalidate()
+            raise KeyError('Archive "{}" not found'.format(archive_name))
+
+        record = dict(version_metadata)
+        record['archive'] = archive_name
+        record['seq'] = archive.get('version_count', 0) + 1
+
+        # the unique index on (archive, seq) assigns each sequence number
+        # once. Numbers taken by concurrent or interrupted writes are skipped.
+        while True:
+            try:
+                self.version_collection.insert_one(dict(record))
+                break
+
+            except DuplicateKeyError:
+                record['seq'] += 1
+
+        latest = {'$set': dict(update.get('$set', {}))}
+        latest['$set']['version_count'] = record['seq']
+
+        res = self.collection.update_one(
+            {
+                '_id': archive_name,
+                '$or': [
+                    {'version_count': {'$lt': record['seq']}},
+                    {'version_count': {'$exists': False}}]},
+            dict(update, **latest))
+
+        if res.matched_count == 0:
+            # a later version is already recorded. Apply only the metadata.
+            for key in self._get_latest_version_fields(version_metadata):
+                update.get('$set', {}).pop(key, None)
 
+            update = {k: v for k, v in update.items() if len(v) > 0}
+
+            if len(update) > 0:
+                self.collection.update_one({'_id': archive_name}, update)
+
+    def _get_version_history(self, archive_name, limit=None, after=None):
+
+        if not self._version_store:
+            return super(MongoDBManager, self)._get_version_history(
+                archive_name, limit=limit, after=after)
+
+        count = self._get_stored_version_count(archive_name)
+
+        if limit == 0:
+            return []
+
+        cursor = self.version_collection.find(
+            {'archive': archive_name, 'seq': {'$lte': count}},
+            {'_id': False, 'archive': False, 'seq': False}).sort(
+                'seq', ASCENDING)
+
+        if after:
+            cursor = cursor.skip(after)
+
+        if limit is not None:
+            cursor = cursor.limit(limit)
+
+        return list(cursor)
+
+    def _get_stored_version_count(self, archive_name):
+        '''
+        Number of versions recorded in the version store for an archive
+
+        Records above this sequence number were written by an update which
+        has not yet advanced the archive's ``version_count``, or which was
+        interrupted, and are not read. Raises a KeyError if the archive does
+        not exist.
+        '''
+
+        return self._get_archive_listing(
+            archive_name, fields=['version_count']).get('version_count', 0)
+
+    def _get_version_histories(self, archive_names):
+
+        if not self._version_store:
+            return super(MongoDBManager, self)._get_version_histories(
+                archive_names)
+
+        counts = {
+            archive_name: listing.get('version_count', 0)
+            for archive_name, listing in self._get_archive_listings(
+                archive_names, fields=['version_count']).items()}
+
+        version_histories = {archive_name: [] for archive_name in counts}
+
+        names = list(version_histories.keys())
+
+        for st_ind in range(0, len(names), self.BatchSize):
+            batch = names[st_ind:st_ind+self.BatchSize]
+
+            for record in self.version_collection.find(
+                    {'archive': {'$in': batch}},
+                    {'_id': False}).sort(
+                        [('archive', ASCENDING), ('seq', ASCENDING)]):
+
+                archive_name = record.pop('archive')
+
+                if record.pop('seq') <= counts[archive_name]:
+                    version_histories[archive_name].append(record)
+
+        return version_histories
+
+    def _migrate_version_store(self):
+
+        self._create_version_store(self._table_name)
+
+        count = 0
+
+        for doc in self.collection.find(
+                {'version_history.0': {'$exists': True}},
+                {'version_history': True, 'version_count': True}):
+
+            # version_count already includes the in-document versions
+            start = max(
+                doc.get('version_count', 0) - len(doc['version_history']), 0)
+
+            records = []
+
+            for i, version_metadata in enumerate(doc['version_history']):
+                record = dict(version_metadata)
+                record['archive'] = doc['_id']
+                record['seq'] = start + i + 1
+                records.append(record)
+
+            self.version_collection.insert_many(records)
+
+            update = self._get_latest_version_fields(
+                doc['version_history'][-1])
+            update['version_history'] = []
+            update['version_count'] = start + len(records)
+
+            self.collection.update_one({'_id': doc['_id']}, {'$set': update})
+
+            self._listing_cache.invalidate(doc['_id'])
+
+            count += 1
+
+        self._version_store = True
+
+        return count
+
+    @staticmethod
+    def _get_metadata_update(archive_metadata):
+        '''
+        Build a single update document setting and unsetting metadata keys
+
+        .. code-block:: python
+
+            >>> update = MongoDBManager._get_metadata_update(
+            ...     {'source': 'NASA', 'notes': None})
+            >>> update['$set']
+            {'archive_metadata.source': 'NASA'}
+            >>> update['$unset']
+            {'archive_metadata.notes': ''}
+
+        '''
+
+        to_set = {}
+        to_unset = {}
+
+        for key, val in archive_metadata.items():
+            if val is None:
+                to_unset['archive_metadata.{}'.format(key)] = ''
             else:
-                self.collection.update(
-                    {"_id": archive_name},
-                    {"$set": {"archive_metadata.{}".format(key): val}})
+                to_set['archive_metadata.{}'.format(key)] = val
+
+        update = {}
+
+        if len(to_set) > 0:
+            update['$set'] = to_set
+
+        if len(to_unset) > 0:
+            update['$unset'] = to_unset
+
+        return update
 
     def _update_spec_config(self, document_name, spec):
 
@@ -136,54 +538,184 @@ class MongoDBManager(BaseDataManager):
         except DuplicateKeyError:
             raise KeyError('Archive "{}" already exists'.format(archive_name))
 
-    def _create_spec_config(self, table_name, spec_documents):
+    def _create_archives(self, archive_metadata):
+        '''
+        Insert many archive documents with a single unordered ``insert_many``
+        '''
 
-        if self._spec_coll is None:
-            self._spec_coll = self.db[table_name + '.spec']
+        if len(archive_metadata) == 0:
+            return []
+
+        try:
+            self.collection.insert_many(
+                [dict(metadata) for metadata in archive_metadata],
+                ordered=False)
+
+        except BulkWriteError as e:
+            write_errors = e.details.get('writeErrors', [])
+
+            if any(err.get('code') != 11000 for err in write_errors):
+                raise
+
+            return [
+                archive_metadata[err['index']]['_id']
+                for err in write_errors]
 
-        self.spec_collection.insert_many(spec_documents)
+        return []
 
-    def _get_archive_listing(self, archive_name):
+    def _create_spec_config(self, table_name, spec_documents):
+
+        self.db[table_name + '.spec'].insert_many(spec_documents)
+
+    def _get_archive_listing(self, archive_name, fields=None):
         '''
-        Return full document for ``{_id:'archive_name'}``
+        Return document for ``{_id:'archive_name'}``
+
+        If ``fields`` is provided, only these top-level fields are returned.
 
         .. note::
 
             MongoDB specific results - do not expose to user
         '''
 
-        res = self.collection.find_one({'_id': archive_name})
+        res = self.collection.find_one(
+            {'_id': archive_name},
+            self._get_projection(fields))
 
         if res is None:
+            self._revalidate()
             raise KeyError
 
         return res
 
+    def _get_archive_listings(self, archive_names, fields=None):
+        '''
+        Return documents for all archives in ``archive_names``
+
+        Uses a single ``$in`` query per batch of
+        :py:attr:`~MongoDBManager.BatchSize` names.
+        '''
+
+        listings = {}
+        archive_names = list(archive_names)
+
+        for st_ind in range(0, len(archive_names), self.BatchSize):
+            batch = archive_names[st_ind:st_ind+self.BatchSize]
+
+            for res in self.collection.find(
+                    {'_id': {'$in': batch}},
+                    self._get_projection(fields)):
+                listings[res['_id']] = res
+
+        return listings
+
+    def _get_latest_history_hash(self, archive_name):
+        '''
+        Return the latest checksum, fetching only the last version entry
+        '''
+
+        if self._version_store:
+            count = self._get_stored_version_count(archive_name)
+
+            res = self.version_collection.find_one(
+                {'archive': archive_name, 'seq': {'$lte': count}},
+                {'checksum': True},
+                sort=[('seq', DESCENDING)])
+
+            if res is None:
+                return None
+
+            return res['checksum']
+
+        if self._listing_cache.enabled:
+            return super(
+                MongoDBManager, self)._get_latest_history_hash(archive_name)
+
+        res = self.collection.find_one(
+            {'_id': archive_name},
+            {'_id': True, 'version_history': {'$slice': -1}})
+
+        if res is None:
+            self._revalidate()
+            raise KeyError
+
+        if len(res.get('version_history', [])) == 0:
+            return None
+
+        return res['version_history'][-1]['checksum']
+
+    @staticmethod
+    def _get_projection(fields):
+        '''
+        Build a find projection from a list of fields
+
+        .. code-block:: python
+
+            >>> MongoDBManager._get_projection(None) is None
+            True
+            >>> sorted(MongoDBManager._get_projection(['tags']).items())
+            [('_id', True), ('tags', True)]
+
+        '''
+
+        if fields is None:
+            return None
+
+        projection = {field: True for field in fields}
+        projection['_id'] = True
+
+        return projection
+
     def _delete_archive_record(self, archive_name):
 
+        if self._version_store:
+            self.version_collection.delete_many({'archive': archive_name})
+
         return self.collection.remove({'_id': archive_name})
 
     def _search(self, search_terms, begins_with=None):
 
-        if len(search_terms) == 0:
-            query = {}
-        elif len(search_terms) == 1:
-            query = {'tags': {'$in': [search_terms[0]]}}
-        else:
-            query = {
-                '$and': [{'tags': {'$in': [tag]}} for tag in search_terms]}
+        query = {}
+
+        if len(search_terms) > 0:
+            query['tags'] = {'$all': list(search_terms)}
+
+        if begins_with:
+            query['_id'] = {'$regex': _prefix_regex(begins_with)}
 
         res = self.collection.find(query, {"_id": 1})
 
         for r in res:
-            if (not begins_with) or r['_id'].startswith(begins_with):
-                yield r['_id']
+            yield r['_id']
 
     def _set_tags(self, archive_name, updated_tag_list):
 
-        self.collection.update(
+        res = self.collection.update_one(
             {"_id": archive_name},
             {"$set": {"tags": updated_tag_list}})
 
+        if res.matched_count == 0:
+            self._revalidate()
+
+    def _add_tags(self, archive_name, tags):
+
+        res = self.collection.update_one(
+            {"_id": archive_name},
+            {"$addToSet": {"tags": {"$each": list(tags)}}})
+
+        if res.matched_count == 0:
+            self._revalidate()
+            raise KeyError('Archive "{}" not found'.format(archive_name))
+
+    def _delete_tags(self, archive_name, tags):
+
+        res = self.collection.update_one(
+            {"_id": archive_name},
+            {"$pullAll": {"tags": list(tags)}})
+
+        if res.matched_count == 0:
+            self._revalidate()
+            raise KeyError('Archive "{}" not found'.format(archive_name))
+
     def _get_spec_documents(self, table_name):
         return [item for item in self.spec_collection.find({})]
@@ -0,0 +1,637 @@
+from __future__ import absolute_import
+
+from datafs.managers.manager import BaseDataManager
+
+from contextlib import contextmanager
+
+import json
+import re
+import sqlite3
+import threading
+
+
+def _quote(table_name):
+    '''
+    Quote a table name for use in an SQL statement
+
+    .. code-block:: python
+
+        >>> print(_quote('my-table.spec'))
+        "my-table.spec"
+
+    '''
+
+    return '"{}"'.format(table_name.replace('"', '""'))
+
+
+def _prefix_glob(prefix):
+    '''
+    GLOB pattern matching strings beginning with ``prefix``
+
+    GLOB is case sensitive, so SQLite can bound the primary key index scan
+    with the prefix. Wildcard characters in the prefix are escaped by
+    wrapping them in a character class.
+
+    .. code-block:: python
+
+        >>> print(_prefix_glob('team1_*.nc'))
+        team1_[*].nc*
+
+    '''
+
+    return re.sub(r'([*?\[])', r'[\1]', prefix) + '*'
+
+
+@contextmanager
+def _missing_tables_as_key_errors():
+    '''
+    Raise a KeyError if a statement refers to a table which does not exist
+    '''
+
+    try:
+        yield
+
+    except sqlite3.OperationalError as e:
+        if 'no such table' in str(e):
+            raise KeyError(str(e))
+
+        raise
+
+
+class SQLiteManager(BaseDataManager):
+    '''
+    Local metadata manager backed by an SQLite database
+
+    Archive documents, tags, and versions are stored in separate tables
+    (``<table_name>``, ``<table_name>.tags``, and ``<table_name>.versions``),
+    indexed by archive name, tag, and version timestamp. The database is
+    opened in WAL mode so that readers are not blocked by a writer.
+
+    Parameters
+    ----------
+
+    database : str
+        Path to the SQLite database file. Use ``':memory:'`` for a
+        temporary in-memory database.
+
+    table_name : str
+        Name of the data archive table
+
+    connect_kwargs : dict
+        Keyword arguments passed to :py:func:`sqlite3.connect`, e.g.
+        ``{'timeout': 30}``
+
+    listing_cache : dict
+        Keyword arguments used in initializing a
+        :py:class:`~datafs.managers.listing_cache.ListingCache` (default
+        None, no caching)
+
+    Examples
+    --------
+
+    .. code-block:: python
+
+        >>> mgr = SQLiteManager(':memory:', 'my-archives')
+        >>> mgr.create_archive_table('my-archives')
+        >>> 'my-archives' in mgr.table_names
+        True
+
+    '''
+
+    # Maximum number of archive names bound in a single query
+    BatchSize = 500
+
+    def __init__(
+            self,
+            database,
+            table_name,
+            connect_kwargs=None,
+            listing_cache=None):
+
+        super(SQLiteManager, self).__init__(
+            table_name,
+            listing_cache=listing_cache)
+
+        self._database = database
+        self._connect_kwargs = (
+            {} if connect_kwargs is None else connect_kwargs)
+
+        self._lock = threading.RLock()
+
+        self._conn = sqlite3.connect(
+            database,
+            isolation_level=None,
+            check_same_thread=False,
+            **self._connect_kwargs)
+
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+
+    @property
+    def config(self):
+        config = {
+            'database': self._database,
+            'table_name': self._table_name,
+            'connect_kwargs': self._connect_kwargs
+        }
+
+        if self._listing_cache_config is not None:
+            config['listing_cache'] = self._listing_cache_config
+
+        return config
+
+    @property
+    def database(self):
+        return self._database
+
+    @property
+    def table_name(self):
+        return self._table_name
+
+    def close(self):
+        '''
+        Close the database connection
+        '''
+
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        '''
+        Context manager yielding a cursor inside a write transaction
+
+        The transaction takes the database write lock when it begins, so
+        reads made inside it are consistent with its writes.
+        '''
+
+        with self._lock, _missing_tables_as_key_errors():
+            cursor = self._conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+
+            try:
+                yield cursor
+
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+
+            else:
+                cursor.execute('COMMIT')
+
+    def _query(self, statement, parameters=()):
+
+        with self._lock, _missing_tables_as_key_errors():
+            return self._conn.execute(statement, parameters).fetchall()
+
+    def _get_table_names(self):
+
+        return [row[0] for row in self._query(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")]
+
+    def _create_archive_table(self, table_name):
+
+        if table_name in self._get_table_names():
+            raise KeyError('Table "{}" already exists'.format(table_name))
+
+        with self._transaction() as cursor:
+            cursor.execute(
+                'CREATE TABLE {} ('
+                '_id TEXT PRIMARY KEY NOT NULL, '
+                'document TEXT NOT NULL, '
+                'version_count INTEGER NOT NULL DEFAULT 0, '
+                'latest_version TEXT, '
+                'latest_checksum TEXT, '
+                'latest_algorithm TEXT)'.format(
+                    _quote(table_name)))
+
+    def _get_auxiliary_table_names(self, table_name):
+
+        return [table_name + '.tags', table_name + '.versions']
+
+    def _create_auxiliary_tables(self, table_name):
+        '''
+        Create the tag and version tables and their indexes
+        '''
+
+        tags = table_name + '.tags'
+        versions = table_name + '.versions'
+
+        with self._transaction() as cursor:
+            cursor.execute(
+                'CREATE TABLE IF NOT EXISTS {} ('
+                'archive TEXT NOT NULL, '
+                'tag TEXT NOT NULL, '
+                'PRIMARY KEY (archive, tag))'.format(_quote(tags)))
+
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS {} ON {} (tag, archive)'.format(
+                    _quote(tags + '.tag'), _quote(tags)))
+
+            cursor.execute(
+                'CREATE TABLE IF NOT EXISTS {} ('
+                'archive TEXT NOT NULL, '
+                'seq INTEGER NOT NULL, '
+                'updated TEXT, '
+                'document TEXT NOT NULL, '
+                'PRIMARY KEY (archive, seq))'.format(_quote(versions)))
+
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS {} ON {} (updated)'.format(
+                    _quote(versions + '.updated'), _quote(versions)))
+
+    def _delete_table(self, table_name):
+
+        if table_name not in self._get_table_names():
+            raise KeyError('Table "{}" not found'.format(table_name))
+
+        with self._transaction() as cursor:
+            cursor.execute('DROP TABLE {}'.format(_quote(table_name)))
+
+    def _build_tag_index(self):
+        '''
+        Tags are always indexed. Ensures the index tables exist.
+        '''
+
+        self._create_auxiliary_tables(self._table_name)
+
+        return self._query(
+            'SELECT COUNT(*) FROM {}'.format(_quote(self._table_name)))[0][0]
+
+    def _migrate_version_store(self):
+        '''
+        Versions are always stored as separate rows. Nothing to migrate.
+        '''
+
+        return 0
+
+    def _create_spec_config(self, table_name, spec_documents):
+
+        with self._transaction() as cursor:
+            cursor.executemany(
+                'INSERT INTO {} (_id, document) VALUES (?, ?)'.format(
+                    _quote(table_name + '.spec')),
+                [(doc['_id'], json.dumps(doc)) for doc in spec_documents])
+
+    def _update_spec_config(self, document_name, spec):
+
+        with self._transaction() as cursor:
+            cursor.execute(
+                'INSERT OR REPLACE INTO {} (_id, document) '
+                'VALUES (?, ?)'.format(_quote(self._spec_table_name)),
+                (document_name, json.dumps(
+                    {'_id': document_name, 'config': spec})))
+
+    def _get_spec_documents(self, table_name):
+
+        return [json.loads(row[0]) for row in self._query(
+            'SELECT document FROM {}'.format(_quote(table_name + '.spec')))]
+
+    def _create_archive(
+            self,
+            archive_name,
+            metadata):
+
+        with self._transaction() as cursor:
+            if not self._insert_archive(cursor, metadata):
+                raise KeyError(
+                    'Archive "{}" already exists'.format(archive_name))
+
+    def _create_archives(self, archive_metadata):
+        '''
+        Insert many archives in a single transaction
+        '''
+
+        conflicts = []
+
+        with self._transaction() as cursor:
+            for metadata in archive_metadata:
+                if not self._insert_archive(cursor, metadata):
+                    conflicts.append(metadata['_id'])
+
+        return conflicts
+
+    def _insert_archive(self, cursor, metadata):
+        '''
+        Insert an archive document and its tags. Returns False if the
+        archive already exists.
+        '''
+
+        document = {
+            k: v for k, v in metadata.items()
+            if k not in ('_id', 'tags', 'version_history', 'version_count')}
+
+        cursor.execute(
+            'INSERT OR IGNORE INTO {} (_id, document) VALUES (?, ?)'.format(
+                _quote(self._table_name)),
+            (metadata['_id'], json.dumps(document)))
+
+        if cursor.rowcount == 0:
+            return False
+
+        self._insert_tags(cursor, metadata['_id'], metadata.get('tags', []))
+
+        for version_metadata in metadata.get('version_history', []):
+            self._insert_version(cursor, metadata['_id'], version_metadata)
+
+        return True
+
+    def _insert_tags(self, cursor, archive_name, tags):
+
+        cursor.executemany(
+            'INSERT OR IGNORE INTO {} (archive, tag) VALUES (?, ?)'.format(
+                _quote(self._table_name + '.tags')),
+            [(archive_name, tag) for tag in tags])
+
+    def _insert_version(self, cursor, archive_name, version_metadata):
+        '''
+        Append a version, incrementing the archive's ``version_count`` and
+        updating its latest version fields
+        '''
+
+        latest = self._get_latest_version_fields(version_metadata)
+
+        cursor.execute(
+            'UPDATE {} SET version_count = version_count + 1, '
+            'latest_version = ?, latest_checksum = ?, latest_algorithm = ? '
+            'WHERE _id = ?'.format(_quote(self._table_name)),
+            (
+                latest['latest_version'],
+                latest['latest_checksum'],
+                latest['latest_algorithm'],
+                archive_name))
+
+        if cursor.rowcount == 0:
+            raise KeyError('Archive "{}" not found'.format(archive_name))
+
+        cursor.execute(
+            'INSERT INTO {} (archive, seq, updated, document) '
+            'SELECT _id, version_count, ?, ? FROM {} WHERE _id = ?'.format(
+                _quote(self._table_name + '.versions'),
+                _quote(self._table_name)),
+            (
+                version_metadata.get('updated'),
+                json.dumps(version_metadata),
+                archive_name))
+
+    def _get_archive_listing(self, archive_name, fields=None):
+        '''
+        Return document for ``archive_name``
+
+        .. note::
+
+            SQLite specific results - do not expose to user
+        '''
+
+        listings = self._get_archive_listings([archive_name], fields=fields)
+
+        if archive_name not in listings:
+            raise KeyError('Archive "{}" not found'.format(archive_name))
+
+        return listings[archive_name]
+
+    def _get_archive_listings(self, archive_names, fields=None):
+        '''
+        Return documents for all archives in ``archive_names``
+
+        Tags and version histories are only read if requested in ``fields``.
+        '''
+
+        listings = {}
+        archive_names = list(set(archive_names))
+
+        for st_ind in range(0, len(archive_names), self.BatchSize):
+            batch = archive_names[st_ind:st_ind+self.BatchSize]
+            params = ', '.join('?' for _ in batch)
+
+            for row in self._query(
+                    'SELECT _id, document, version_count, latest_version, '
+                    'latest_checksum, latest_algorithm '
+                    'FROM {} WHERE _id IN ({})'.format(
+                        _quote(self._table_name), params),
+                    batch):
+
+                archive_name = row[0]
+
+                listing = json.loads(row[1])
+                listing['_id'] = archive_name
+                listing['version_count'] = row[2]
+
+                if row[3] is not None:
+                    listing['latest_version'] = row[3]
+                    listing['latest_checksum'] = row[4]
+
+                if row[5] is not None:
+                    listing['latest_algorithm'] = row[5]
+
+                if fields is not None:
+                    listing = {
+                        k: v for k, v in listing.items()
+                        if k in fields or k == '_id'}
+
+                listings[archive_name] = listing
+
+            if fields is None or 'tags' in fields:
+                for listing in listings.values():
+                    listing.setdefault('tags', [])
+
+                for archive_name, tag in self._query(
+                        'SELECT archive, tag FROM {} WHERE archive IN ({}) '
+                        'ORDER BY rowid'.format(
+                            _quote(self._table_name + '.tags'), params),
+                        batch):
+
+                    listings[archive_name]['tags'].append(tag)
+
+            if fields is None or 'version_history' in fields:
+                for listing in listings.values():
+                    listing.setdefault('version_history', [])
+
+                for archive_name, document in self._query(
+                        'SELECT archive, document FROM {} '
+                        'WHERE archive IN ({}) ORDER BY archive, seq'.format(
+                            _quote(self._table_name + '.versions'), params),
+                        batch):
+
+                    listings[archive_name]['version_history'].append(
+                        json.loads(document))
+
+        return listings
+
+    def _get_version_history(self, archive_name, limit=None, after=None):
+
+        if self._listing_cache.enabled:
+            return super(SQLiteManager, self)._get_version_history(
+                archive_name, limit=limit, after=after)
+
+        version_history = [json.loads(row[0]) for row in self._query(
+            'SELECT document FROM {} WHERE archive = ? '
+            'ORDER BY seq LIMIT ? OFFSET ?'.format(
+                _quote(self._table_name + '.versions')),
+            (archive_name, -1 if limit is None else limit,
+                after if after else 0))]
+
+        if len(version_history) == 0:
+            # distinguish an empty history from a missing archive
+            self._get_archive_listing(archive_name, fields=['_id'])
+
+        return version_history
+
+    def _get_latest_history_hash(self, archive_name):
+
+        res = self._query(
+            'SELECT document FROM {} WHERE archive = ? '
+            'ORDER BY seq DESC LIMIT 1'.format(
+                _quote(self._table_name + '.versions')),
+            (archive_name,))
+
+        if len(res) == 0:
+            self._get_archive_listing(archive_name, fields=['_id'])
+            return None
+
+        return json.loads(res[0][0])['checksum']
+
+    def _update(self, archive_name, version_metadata):
+
+        with self._transaction() as cursor:
+            self._insert_version(cursor, archive_name, version_metadata)
+
+    def _update_with_metadata(
+            self,
+            archive_name,
+            version_metadata,
+            archive_metadata):
+
+        with self._transaction() as cursor:
+            self._insert_version(cursor, archive_name, version_metadata)
+            self._write_metadata(cursor, archive_name, archive_metadata)
+
+    def _update_metadata(self, archive_name, archive_metadata):
+
+        with self._transaction() as cursor:
+            self._write_metadata(cursor, archive_name, archive_metadata)
+
+    def _write_metadata(self, cursor, archive_name, archive_metadata):
+        '''
+        Set and remove archive metadata keys inside a transaction
+        '''
+
+        res = cursor.execute(
+            'SELECT document FROM {} WHERE _id = ?'.format(
+                _quote(self._table_name)),
+            (archive_name,)).fetchone()
+
+        if res is None:
+            raise KeyError('Archive "{}" not found'.format(archive_name))
+
+        document = json.loads(res[0])
+        metadata = document.setdefault('archive_metadata', {})
+
+        for key, val in archive_metadata.items():
+            if val is None:
+                metadata.pop(key, None)
+            else:
+                metadata[key] = val
+
+        cursor.execute(
+            'UPDATE {} SET document = ? WHERE _id = ?'.format(
+                _quote(self._table_name)),
+            (json.dumps(document), archive_name))
+
+    def _delete_archive_record(self, archive_name):
+
+        with self._transaction() as cursor:
+            for table_name, key in [
+                    (self._table_name + '.tags', 'archive'),
+                    (self._table_name + '.versions', 'archive'),
+                    (self._table_name, '_id')]:
+
+                cursor.execute(
+                    'DELETE FROM {} WHERE {} = ?'.format(
+                        _quote(table_name), key),
+                    (archive_name,))
+
+    def _search(self, search_terms, begins_with=None):
+
+        search_terms = list(set(search_terms))
+
+        if len(search_terms) > 0:
+            statement = (
+                'SELECT archive FROM {} WHERE tag IN ({})'.format(
+                    _quote(self._table_name + '.tags'),
+                    ', '.join('?' for _ in search_terms)))
+
+            params = list(search_terms)
+
+            if begins_with:
+                statement += ' AND archive GLOB ?'
+                params.append(_prefix_glob(begins_with))
+
+            statement += (
+                ' GROUP BY archive HAVING COUNT(*) = ? ORDER BY archive')
+            params.append(len(search_terms))
+
+        else:
+            statement = 'SELECT _id FROM {}'.format(_quote(self._table_name))
+            params = []
+
+            if begins_with:
+                statement += ' WHERE _id GLOB ?'
+                params.append(_prefix_glob(begins_with))
+
+            statement += ' ORDER BY _id'
+
+        for row in self._query(statement, params):
+            yield row[0]
+
+    def _get_tags(self, archive_name):
+
+        if self._listing_cache.enabled:
+            return super(SQLiteManager, self)._get_tags(archive_name)
+
+        tags = [row[0] for row in self._query(
+            'SELECT tag FROM {} WHERE archive = ? ORDER BY rowid'.format(
+                _quote(self._table_name + '.tags')),
+            (archive_name,))]
+
+        if len(tags) == 0:
+            self._get_archive_listing(archive_name, fields=['_id'])
+
+        return tags
+
+    def _check_exists(self, cursor, archive_name):
+
+        res = cursor.execute(
+            'SELECT 1 FROM {} WHERE _id = ?'.format(_quote(self._table_name)),
+            (archive_name,)).fetchone()
+
+        if res is None:
+            raise KeyError('Archive "{}" not found'.format(archive_name))
+
+    def _set_tags(self, archive_name, updated_tag_list):
+
+        with self._transaction() as cursor:
+            self._check_exists(cursor, archive_name)
+
+            cursor.execute(
+                'DELETE FROM {} WHERE archive = ?'.format(
+                    _quote(self._table_name + '.tags')),
+                (archive_name,))
+
+            self._insert_tags(cursor, archive_name, updated_tag_list)
+
+    def _add_tags(self, archive_name, tags):
+
+        with self._transaction() as cursor:
+            self._check_exists(cursor, archive_name)
+            self._insert_tags(cursor, archive_name, tags)
+
+    def _delete_tags(self, archive_name, tags):
+
+        with self._transaction() as cursor:
+            self._check_exists(cursor, archive_name)
+
+            cursor.executemany(
+                'DELETE FROM {} WHERE archive = ? AND tag = ?'.format(
+                    _quote(self._table_name + '.tags')),
+                [(archive_name, tag) for tag in tags])
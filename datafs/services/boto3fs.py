@@ -0,0 +1,566 @@
+from __future__ import absolute_import
+
+import io
+import threading
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from datafs.services import ranged
+
+from fs.base import FS
+from fs.path import normpath, relpath, dirname
+from fs.remote import RemoteFileBuffer
+from fs import iotools
+from fs.errors import (
+    ResourceNotFoundError,
+    ResourceInvalidError,
+    DestinationExistsError,
+    DirectoryNotEmptyError,
+    ParentDirectoryMissingError)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _get_client(
+        session_args=None,
+        client_args=None,
+        max_pool_connections=None):
+    '''
+    Return an S3 client shared by all filesystems with the same arguments
+
+    boto3 clients are thread-safe, so one client (and its connection pool) is
+    used for every filesystem and transfer thread in the process.
+    '''
+
+    key = _freeze([session_args, client_args, max_pool_connections])
+
+    with _clients_lock:
+        if key not in _clients:
+            client_args = dict(client_args or {})
+
+            if max_pool_connections is not None:
+                config = Config(max_pool_connections=max_pool_connections)
+
+                if client_args.get('config') is not None:
+                    config = client_args['config'].merge(config)
+
+                client_args['config'] = config
+
+            _clients[key] = boto3.Session(**(session_args or {})).client(
+                's3', **client_args)
+
+        return _clients[key]
+
+
+def _freeze(value):
+    '''
+    Hashable form of client arguments, for use as a cache key
+
+    Objects such as botocore ``Config`` instances are compared by their
+    attributes.
+
+    .. code-block:: python
+
+        >>> _freeze({'config': Config(retries={'max_attempts': 3})}) == (
+        ...     _freeze({'config': Config(retries={'max_attempts': 3})}))
+        True
+
+    '''
+
+    if isinstance(value, dict):
+        return tuple(sorted(
+            (repr(k), _freeze(v)) for k, v in value.items()))
+
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+
+    if hasattr(value, '__dict__'):
+        return (value.__class__.__name__, _freeze(vars(value)))
+
+    return repr(value)
+
+
+def _is_missing(error):
+    return error.response.get('Error', {}).get('Code') in (
+        '404', 'NoSuchKey', 'NotFound')
+
+
+class _Unclosable(object):
+    '''
+    Readable file proxy which boto3's transfer manager cannot close
+    '''
+
+    def __init__(self, f):
+        self._f = f
+
+    def read(self, *args):
+        return self._f.read(*args)
+
+    def seek(self, *args):
+        return self._f.seek(*args)
+
+    def tell(self):
+        return self._f.tell()
+
+    def close(self):
+        pass
+
+
+class Boto3FS(FS):
+    '''
+    A filesystem stored in Amazon S3, using boto3
+
+    Files are uploaded and downloaded with boto3's transfer manager, which
+    splits large files into parts transferred in parallel. Files opened for
+    reading are read with ranged GET requests through a
+    :py:class:`~datafs.services.ranged.RangedReader`, so only the blocks of
+    a file which are read are downloaded. Directories are stored as empty
+    ``"path/"`` marker objects.
+
+    Use in a config file with ``service: Boto3FS``.
+
+    Parameters
+    ----------
+    bucket : str
+        name of the S3 bucket
+
+    prefix : str
+        key prefix under which files are stored (default ``''``)
+
+    session_args : dict
+        keyword arguments used to create the :py:class:`boto3.Session`
+
+    client_args : dict
+        keyword arguments passed to the session's S3 client, e.g.
+        ``endpoint_url`` or ``region_name``
+
+    part_size : int
+        size of the parts of multipart uploads and downloads. Smaller files
+        are transferred in a single request (default 8MB)
+
+    max_concurrency : int
+        number of threads used to transfer parts of a file (default 10)
+
+    max_pool_connections : int
+        size of the client's connection pool. Clients are shared between
+        filesystems created with the same arguments (default botocore's)
+
+    block_size : int
+        size of the blocks requested when reading files (default
+        :py:data:`~datafs.services.ranged.DefaultBlockSize`)
+
+    Examples
+    --------
+
+    .. code-block:: python
+
+        >>> import moto
+        >>> m = moto.mock_s3()
+        >>> m.start()
+        >>> boto3.client('s3', region_name='us-east-1').create_bucket(
+        ...     Bucket='my-bucket')  # doctest: +ELLIPSIS
+        {...}
+        >>> s3 = Boto3FS(
+        ...     'my-bucket',
+        ...     prefix='data',
+        ...     client_args={'region_name': 'us-east-1'})
+        >>> s3.makedir('dir')
+        >>> _ = s3.setcontents('dir/file.txt', b'hello world')
+        >>> s3.listdir('dir')
+        ['file.txt']
+        >>> s3.read_range('dir/file.txt', 6, 11) == b'world'
+        True
+        >>> m.stop()
+
+    '''
+
+    _meta = {
+        'thread_safe': True,
+        'virtual': False,
+        'read_only': False,
+        'unicode_paths': True,
+        'case_insensitive_paths': False,
+        'network': True,
+        'atomic.move': False,
+        'atomic.copy': True,
+        'atomic.makedir': True,
+        'atomic.rename': False,
+        'atomic.setcontents': True}
+
+    def __init__(
+            self,
+            bucket,
+            prefix='',
+            session_args=None,
+            client_args=None,
+            part_size=8 * 2**20,
+            max_concurrency=10,
+            max_pool_connections=None,
+            block_size=None):
+
+        self._bucket = bucket
+        self._block_size = block_size
+        self._prefix = relpath(normpath(prefix)).rstrip('/')
+
+        self._client = _get_client(
+            session_args, client_args, max_pool_connections)
+
+        self._transfer_config = TransferConfig(
+            multipart_threshold=part_size,
+            multipart_chunksize=part_size,
+            max_concurrency=max_concurrency)
+
+        super(Boto3FS, self).__init__(thread_synchronize=False)
+
+    def __repr__(self):
+        return '<Boto3FS: s3://{}/{}>'.format(self._bucket, self._prefix)
+
+    __str__ = __repr__
+
+    def _key(self, path):
+        path = relpath(normpath(path))
+
+        if path in ('', '.'):
+            return self._prefix
+
+        if self._prefix:
+            return self._prefix + '/' + path
+
+        return path
+
+    def _dir_prefix(self, path):
+        key = self._key(path)
+
+        if key:
+            return key + '/'
+
+        return ''
+
+    def _head(self, path):
+        try:
+            return self._client.head_object(
+                Bucket=self._bucket, Key=self._key(path))
+
+        except ClientError as e:
+            if _is_missing(e):
+                return None
+
+            raise
+
+    def _iter_keys(self, prefix, delimiter=None):
+        '''
+        Yield listed objects and common prefixes under ``prefix``
+        '''
+
+        kwargs = {'Bucket': self._bucket, 'Prefix': prefix}
+
+        if delimiter is not None:
+            kwargs['Delimiter'] = delimiter
+
+        paginator = self._client.get_paginator('list_objects_v2')
+
+        for page in paginator.paginate(**kwargs):
+            for item in page.get('CommonPrefixes', []):
+                yield item['Prefix'], True
+
+            for item in page.get('Contents', []):
+                yield item['Key'], False
+
+    def desc(self, path):
+        return 's3://{}/{}'.format(self._bucket, self._key(path))
+
+    def isfile(self, path):
+        return self._head(path) is not None
+
+    def isdir(self, path):
+
+        if relpath(normpath(path)) in ('', '.'):
+            return True
+
+        prefix = self._dir_prefix(path)
+
+        response = self._client.list_objects_v2(
+            Bucket=self._bucket, Prefix=prefix, MaxKeys=1)
+
+        return response.get('KeyCount', len(response.get('Contents', []))) > 0
+
+    def exists(self, path):
+        return self.isfile(path) or self.isdir(path)
+
+    def listdir(
+            self,
+            path='./',
+            wildcard=None,
+            full=False,
+            absolute=False,
+            dirs_only=False,
+            files_only=False):
+
+        if not self.isdir(path):
+            if self.isfile(path):
+                raise ResourceInvalidError(path)
+
+            raise ResourceNotFoundError(path)
+
+        prefix = self._dir_prefix(path)
+        entries = []
+
+        for key, is_dir in self._iter_keys(prefix, delimiter='/'):
+            name = key[len(prefix):].rstrip('/')
+
+            if name == '':
+                continue
+
+            if dirs_only and not is_dir:
+                continue
+
+            if files_only and is_dir:
+                continue
+
+            entries.append(name)
+
+        return self._listdir_helper(
+            path, entries, wildcard, full, absolute, False, False)
+
+    def makedir(self, path, recursive=False, allow_recreate=False):
+
+        if self.isdir(path):
+            if allow_recreate:
+                return
+
+            raise DestinationExistsError(path)
+
+        if self.isfile(path):
+            raise ResourceInvalidError(path)
+
+        if not self.isdir(dirname(path)):
+            if not recursive:
+                raise ParentDirectoryMissingError(path)
+
+            self.makedir(dirname(path), recursive=True, allow_recreate=True)
+
+        self._client.put_object(
+            Bucket=self._bucket, Key=self._dir_prefix(path), Body=b'')
+
+    def remove(self, path):
+
+        if not self.isfile(path):
+            if self.isdir(path):
+                raise ResourceInvalidError(path)
+
+            raise ResourceNotFoundError(path)
+
+        self._client.delete_object(Bucket=self._bucket, Key=self._key(path))
+
+    def removedir(self, path, recursive=False, force=False):
+
+        if not self.isdir(path):
+            raise ResourceNotFoundError(path)
+
+        prefix = self._dir_prefix(path)
+        keys = [key for key, _ in self._iter_keys(prefix)]
+
+        if not force and any(key != prefix for key in keys):
+            raise DirectoryNotEmptyError(path)
+
+        for start in range(0, len(keys), 1000):
+            self._client.delete_objects(
+                Bucket=self._bucket,
+                Delete={
+                    'Objects': [
+                        {'Key': key} for key in keys[start:start + 1000]]})
+
+        parent = dirname(path)
+
+        if recursive and self._dir_prefix(parent) and self.isdirempty(parent):
+            self.removedir(parent, recursive=True)
+
+    def rename(self, src, dst):
+
+        if not self.isfile(src):
+            raise ResourceNotFoundError(src)
+
+        self._client.copy(
+            {'Bucket': self._bucket, 'Key': self._key(src)},
+            self._bucket,
+            self._key(dst),
+            Config=self._transfer_config)
+
+        self._client.delete_object(Bucket=self._bucket, Key=self._key(src))
+
+    def getinfo(self, path):
+
+        head = self._head(path)
+
+        if head is not None:
+            return {
+                'size': head['ContentLength'],
+                'modified_time': head['LastModified'],
+                'etag': head.get('ETag')}
+
+        if self.isdir(path):
+            return {}
+
+        raise ResourceNotFoundError(path)
+
+    def read_range(self, path, start, end):
+        '''
+        Read bytes ``start`` up to ``end`` of a file with a ranged GET
+        '''
+
+        try:
+            response = self._client.get_object(
+                Bucket=self._bucket,
+                Key=self._key(path),
+                Range='bytes={}-{}'.format(start, end - 1))
+
+        except ClientError as e:
+            if _is_missing(e):
+                raise ResourceNotFoundError(path)
+
+            raise
+
+        return response['Body'].read()
+
+    def setcontents(
+            self,
+            path,
+            data=b'',
+            encoding=None,
+            errors=None,
+            chunk_size=None):
+
+        if not self.isdir(dirname(path)):
+            raise ParentDirectoryMissingError(path)
+
+        if not hasattr(data, 'read'):
+            if not isinstance(data, bytes):
+                data = data.encode(encoding or 'utf-8', errors or 'strict')
+
+            data = io.BytesIO(data)
+
+        self.upload_fileobj(path, data)
+
+    def upload_fileobj(self, path, f):
+        '''
+        Upload an open file, in parallel parts if it is large
+
+        The object is replaced only once the upload completes. ``f`` is left
+        open.
+        '''
+
+        self._client.upload_fileobj(
+            _Unclosable(f),
+            self._bucket,
+            self._key(path),
+            Config=self._transfer_config)
+
+    def upload_file(self, path, syspath):
+        '''
+        Upload a local file, in parallel parts if it is large
+        '''
+
+        self._client.upload_file(
+            syspath, self._bucket, self._key(path),
+            Config=self._transfer_config)
+
+    def download_file(self, path, syspath):
+        '''
+        Download a file to a local path, in parallel parts if it is large
+        '''
+
+        if not self.isfile(path):
+            raise ResourceNotFoundError(path)
+
+        self._client.download_file(
+            self._bucket, self._key(path), syspath,
+            Config=self._transfer_config)
+
+    def open(
+            self,
+            path,
+            mode='r',
+            buffering=-1,
+            encoding=None,
+            errors=None,
+            newline=None,
+            line_buffering=False,
+            **kwargs):
+
+        if self.isdir(path):
+            raise ResourceInvalidError(path)
+
+        head = self._head(path)
+
+        if head is None and 'w' not in mode and 'a' not in mode:
+            raise ResourceNotFoundError(path)
+
+        if head is not None and 'w' not in mode:
+
+            def read_range(start, end):
+                return self.read_range(path, start, end)
+
+            reader = io.BufferedReader(ranged.RangedReader(
+                read_range,
+                head['ContentLength'],
+                block_size=self._block_size))
+
+        else:
+            if not self.isdir(dirname(path)):
+                raise ParentDirectoryMissingError(path)
+
+            # new files are created when the buffer is uploaded on close
+            reader = None
+
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            # writes are buffered locally and uploaded when the file is closed
+            f = RemoteFileBuffer(
+                self, path, mode, rfile=reader, write_on_flush=False)
+
+            return iotools.make_stream(
+                path,
+                f,
+                mode=mode,
+                buffering=buffering,
+                encoding=encoding,
+                errors=errors,
+                newline=newline,
+                line_buffering=line_buffering)
+
+        if 'b' in mode:
+            return reader
+
+        return io.TextIOWrapper(
+            reader,
+            encoding=encoding or 'utf-8',
+            errors=errors,
+            newline=newline,
+            line_buffering=line_buffering)
+
+    def getcontents(
+            self,
+            path,
+            mode='rb',
+            encoding=None,
+            errors=None,
+            newline=None):
+
+        head = self._head(path)
+
+        if head is None:
+            raise ResourceNotFoundError(path)
+
+        data = b''
+
+        if head['ContentLength'] > 0:
+            data = self.read_range(path, 0, head['ContentLength'])
+
+        if 'b' in mode:
+            return data
+
+        return iotools.decode_binary(
+            data, encoding=encoding, errors=errors, newline=newline)
@@ -0,0 +1,698 @@
+from __future__ import absolute_import
+
+import os
+import json
+import time
+import uuid
+import random
+import threading
+import datetime
+import fs.path
+
+from contextlib import contextmanager
+from fs.errors import ResourceNotFoundError
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+class CacheIndex(object):
+    '''
+    Sidecar index of checksums for files held in a cache
+
+    Records the size, modification time, and checksum of each cached file
+    so that reads can check a cached file's contents against the archive's
+    checksum without hashing the whole file. The index is stored as a JSON
+    file at the root of the cache filesystem.
+
+    Several processes may share a cache. Each change re-reads the index
+    and applies the change under an exclusive lock on
+    :py:attr:`LockPath`, then replaces the index file whole, so that
+    checksums, pins and usage recorded by other processes are kept. The
+    lock is taken on systems providing :py:mod:`fcntl` when the cache has
+    a system path. The index is reloaded only when its file has changed.
+
+    With a ``max_size`` or ``prefix_quotas``, the index also records when
+    and how often each cached file is used, and evicts files from the cache
+    once a quota is exceeded. Pinned files are never evicted. Files open in
+    this process (see :py:meth:`in_use`) are not evicted by this index, but
+    open files are not recorded in the shared index, so another process may
+    evict them. Files cached before a quota was set are tracked from their
+    next use.
+
+    Uses of files already tracked at their current size do not change the
+    space used, so they are kept in memory and written to the index in
+    batches, every :py:attr:`FlushSize` uses or :py:attr:`FlushInterval`
+    seconds, whenever the index is next changed, or on :py:meth:`flush`.
+    Evictions by other processes sharing the cache may therefore not see
+    this process's most recent uses.
+
+    Parameters
+    ----------
+
+    filesystem : object
+        :py:mod:`pyFilesystem` filesystem object used as the cache
+
+    verify : str
+        When to re-hash a cached file which is already in the index. One of:
+
+        ``'always'``
+            hash the file on every read, ignoring the index
+
+        ``'on-change'``
+            re-hash only if the file's size or modification time has
+            changed. Files at immutable (versioned) paths are trusted after
+            one verification as long as their size is unchanged (default).
+
+        ``'sampled'``
+            as ``'on-change'``, but also re-hash a random ``sample_rate``
+            fraction of reads
+
+        ``'never'``
+            trust the recorded checksum once a file has been hashed
+
+    sample_rate : float
+        Fraction of reads re-hashed with the ``'sampled'`` policy (default
+        0.1)
+
+    max_size : int
+        Number of bytes of files kept in the cache (default None, unbounded)
+
+    eviction : str
+        Files evicted first when a quota is exceeded. ``'lru'`` evicts the
+        least recently used files (default), and ``'lfu'`` the least
+        frequently used.
+
+    prefix_quotas : dict
+        Number of bytes of files kept under each path prefix in the cache,
+        e.g. ``{'team1/': 2**30}`` (default None)
+
+    Examples
+    --------
+
+    .. code-block:: python
+
+        >>> from fs.tempfs import TempFS
+        >>> cache = TempFS()
+        >>> _ = cache.setcontents('arch1', b'hello')
+        >>> index = CacheIndex(cache)
+        >>>
+        >>> def hasher(f):
+        ...     hasher.calls += 1
+        ...     return {'algorithm': 'len', 'checksum': str(len(f.read()))}
+        ...
+        >>> hasher.calls = 0
+        >>> print(index.checksum('arch1', hasher)['checksum'])
+        5
+        >>> print(index.checksum('arch1', hasher)['checksum'])
+        5
+        >>> hasher.calls
+        1
+        >>> CacheIndex(cache).checksum('arch1', hasher) == {
+        ...     'algorithm': 'len', 'checksum': '5'}
+        True
+        >>> hasher.calls
+        1
+
+    Files beyond the quota are evicted, least recently used first:
+
+    .. code-block:: python
+
+        >>> index = CacheIndex(cache, max_size=8)
+        >>> _ = cache.setcontents('arch2', b'world')
+        >>> index.access('arch1')
+        >>> index.access('arch2')
+        >>> cache.isfile('arch1'), cache.isfile('arch2')
+        (False, True)
+        >>> index.size
+        5
+        >>> cache.close()
+
+    '''
+
+    Policies = ('always', 'on-change', 'sampled', 'never')
+
+    Evictions = ('lru', 'lfu')
+
+    IndexPath = '.datafs_cache_index.json'
+
+    LockPath = '.datafs_cache_index.lock'
+
+    # number of buffered file uses written to the index together
+    FlushSize = 100
+
+    # maximum age, in seconds, of buffered file uses
+    FlushInterval = 5
+
+    def __init__(
+            self,
+            filesystem,
+            verify='on-change',
+            sample_rate=0.1,
+            max_size=None,
+            eviction='lru',
+            prefix_quotas=None):
+
+        if verify not in self.Policies:
+            raise ValueError(
+                'Cache verification policy "{}" not understood. '
+                'Choose from {}'.format(verify, ', '.join(self.Policies)))
+
+        if eviction not in self.Evictions:
+            raise ValueError(
+                'Cache eviction policy "{}" not understood. '
+                'Choose from {}'.format(eviction, ', '.join(self.Evictions)))
+
+        self.fs = filesystem
+        self._verify = verify
+        self._sample_rate = sample_rate
+
+        self._max_size = max_size
+        self._eviction = eviction
+        self._prefix_quotas = dict(prefix_quotas or {})
+
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._stamp = None
+        self._refresh()
+
+        # number of times each file is currently open in this process
+        self._open = {}
+
+        # last access time and number of uses of files since the last flush
+        self._pending = {}
+        self._flushed = time.time()
+
+        # whether the last eviction left the cache over a quota, e.g. because
+        # files were open
+        self._over_quota = False
+
+    @property
+    def verify(self):
+        return self._verify
+
+    @property
+    def config(self):
+        config = {}
+
+        if self._verify != 'on-change':
+            config['verify'] = self._verify
+
+        if self._sample_rate != 0.1:
+            config['sample_rate'] = self._sample_rate
+
+        if self._max_size is not None:
+            config['max_size'] = self._max_size
+
+        if self._eviction != 'lru':
+            config['eviction'] = self._eviction
+
+        if self._prefix_quotas:
+            config['prefix_quotas'] = dict(self._prefix_quotas)
+
+        return config
+
+    @property
+    def bounded(self):
+        return self._max_size is not None or len(self._prefix_quotas) > 0
+
+    @property
+    def size(self):
+        '''
+        Number of bytes of tracked files in the cache
+        '''
+
+        with self._lock:
+            self._refresh()
+
+            return sum(
+                entry.get('bytes', 0) for entry in self._entries.values())
+
+    def _load(self):
+
+        try:
+            if self.fs.isfile(self.IndexPath):
+                return json.loads(
+                    self.fs.getcontents(self.IndexPath, 'rb').decode('utf-8'))
+
+        except (ValueError, ResourceNotFoundError):
+            # a corrupt index is discarded and rebuilt as files are read
+            pass
+
+        return {}
+
+    def _save(self, entries):
+        '''
+        Replace the index file, so that readers never see a partial write
+        '''
+
+        data = json.dumps(entries, sort_keys=True).encode('utf-8')
+        path = self.fs.getsyspath(self.IndexPath, allow_none=True)
+
+        if path is None:
+            self.fs.setcontents(self.IndexPath, data)
+            return
+
+        temp = '{}.{}.partial'.format(path, uuid.uuid4().hex)
+
+        try:
+            with open(temp, 'wb') as f:
+                f.write(data)
+
+            _replace(temp, path)
+
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def _get_stamp(self):
+        '''
+        Identify the current version of the index file
+        '''
+
+        try:
+            if self.fs.hassyspath(self.IndexPath):
+                stat = os.stat(self.fs.getsyspath(self.IndexPath))
+                return stat.st_ino, stat.st_size, stat.st_mtime
+
+            return self._stat(self.IndexPath)
+
+        except (OSError, ResourceNotFoundError):
+            return None
+
+    def _refresh(self):
+        '''
+        Reload the index if another writer has changed it
+        '''
+
+        stamp = self._get_stamp()
+
+        if stamp is None or stamp != self._stamp:
+            self._entries = self._load()
+            self._stamp = stamp
+
+    @contextmanager
+    def _file_lock(self):
+        '''
+        Hold an exclusive lock on the index, shared with other processes
+        '''
+
+        path = self.fs.getsyspath(self.LockPath, allow_none=True)
+
+        if path is None or fcntl is None:
+            yield
+            return
+
+        with open(path, 'a') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+            try:
+                yield
+
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    @contextmanager
+    def _transaction(self):
+        '''
+        Refresh the index, yield its entries for changes, and save them
+
+        Buffered file uses are applied first. The index is only written if
+        the entries were changed.
+        '''
+
+        with self._lock:
+            with self._file_lock():
+                self._refresh()
+
+                entries = self._entries
+                before = {key: dict(entry) for key, entry in entries.items()}
+
+                try:
+                    self._apply_pending(entries)
+
+                    yield entries
+
+                except Exception:
+                    # discard partial changes
+                    self._stamp = None
+                    raise
+
+                if entries != before:
+                    self._save(entries)
+
+                self._stamp = self._get_stamp()
+
+    def _apply_pending(self, entries):
+
+        for key, (accessed, hits) in self._pending.items():
+            entry = entries.get(key)
+
+            # skip files evicted by another process
+            if entry is None or 'bytes' not in entry:
+                continue
+
+            entry['accessed'] = max(entry.get('accessed', 0), accessed)
+            entry['hits'] = entry.get('hits', 0) + hits
+
+        self._pending = {}
+        self._flushed = time.time()
+
+    def flush(self):
+        '''
+        Write buffered file uses to the index
+        '''
+
+        with self._transaction():
+            pass
+
+    def _stat(self, path):
+        '''
+        Return the size and modification time of a cached file
+        '''
+
+        if self.fs.hassyspath(path):
+            stat = os.stat(self.fs.getsyspath(path))
+            return stat.st_size, stat.st_mtime
+
+        info = self.fs.getinfokeys(path, 'size', 'modified_time')
+        mtime = info.get('modified_time')
+
+        if isinstance(mtime, datetime.datetime):
+            mtime = mtime.isoformat()
+
+        return info.get('size'), mtime
+
+    def _is_current(self, entry, size, mtime, immutable):
+
+        if self._verify == 'never':
+            return True
+
+        if entry['size'] != size:
+            return False
+
+        if self._verify == 'sampled' and random.random() < self._sample_rate:
+            return False
+
+        return immutable or entry['mtime'] == mtime
+
+    def checksum(self, path, hasher, immutable=False):
+        '''
+        Return the checksum of a cached file, hashing it only if needed
+
+        Parameters
+        ----------
+
+        path : str
+            path of the file on the cache filesystem
+
+        hasher : function
+            function returning a checksum dictionary from a file object, such
+            as :py:meth:`~datafs.core.data_api.DataAPI.hash_file`
+
+        immutable : bool
+            whether the file's contents are fixed once written, as for
+            versioned archive paths (default False)
+
+        Returns
+        -------
+
+        checksum : dict
+            dictionary with keys ``algorithm`` and ``checksum``
+        '''
+
+        if self._verify == 'always':
+            with self.fs.open(path, 'rb') as f:
+                return hasher(f)
+
+        size, mtime = self._stat(path)
+
+        with self._lock:
+            self._refresh()
+            entry = self._entries.get(fs.path.abspath(path))
+
+        if entry is not None and 'checksum' in entry and self._is_current(
+                entry, size, mtime, immutable):
+
+            return dict(entry['checksum'])
+
+        with self.fs.open(path, 'rb') as f:
+            checksum = hasher(f)
+
+        self._set(path, size, mtime, checksum)
+
+        return checksum
+
+    def record(self, path, checksum=None):
+        '''
+        Record a file just written to the cache
+
+        If ``checksum`` is None, any checksum recorded for the file is
+        removed, and the file is hashed on its next read. The file's size
+        counts against the cache's quotas from now on.
+        '''
+
+        if checksum is None:
+            self.invalidate(path)
+
+        elif self._verify != 'always':
+            size, mtime = self._stat(path)
+            self._set(path, size, mtime, checksum)
+
+        self.access(path)
+
+    def _set(self, path, size, mtime, checksum):
+
+        with self._transaction() as entries:
+            entry = entries.setdefault(fs.path.abspath(path), {})
+            entry.update({
+                'size': size,
+                'mtime': mtime,
+                'checksum': dict(checksum)})
+
+    def invalidate(self, path):
+        '''
+        Remove a file's checksum from the index
+
+        Usage of files which are no longer in the cache is forgotten too.
+        Pins are kept.
+        '''
+
+        key = fs.path.abspath(path)
+
+        with self._transaction() as entries:
+            entry = entries.get(key)
+
+            if entry is None:
+                return
+
+            fields = ['size', 'mtime', 'checksum']
+
+            if not self.fs.isfile(path):
+                fields.extend(['bytes', 'accessed', 'hits'])
+
+            for field in fields:
+                entry.pop(field, None)
+
+            if len(entry) == 0:
+                del entries[key]
+
+    def access(self, path):
+        '''
+        Record a use of a cached file and evict other files if over quota
+        '''
+
+        if not self.bounded or not self.fs.isfile(path):
+            return
+
+        size, _ = self._stat(path)
+        key = fs.path.abspath(path)
+        now = time.time()
+
+        with self._lock:
+            self._refresh()
+            tracked = self._entries.get(key, {}).get('bytes') == size
+
+            if tracked and not self._over_quota:
+                hits = self._pending.get(key, (now, 0))[1]
+                self._pending[key] = (now, hits + 1)
+
+                if (len(self._pending) < self.FlushSize and
+                        now - self._flushed < self.FlushInterval):
+                    return
+
+        with self._transaction() as entries:
+            if not tracked:
+                entry = entries.setdefault(key, {})
+                entry['bytes'] = size
+                entry['accessed'] = now
+                entry['hits'] = entry.get('hits', 0) + 1
+
+            self._evict(entries, protect=set([key]))
+
+    @contextmanager
+    def in_use(self, path):
+        '''
+        Context manager protecting a cached file from eviction while open
+
+        The file's use is recorded on exit. Protection applies to evictions
+        by this index only. Other processes sharing the cache may still
+        evict the file.
+        '''
+
+        key = fs.path.abspath(path)
+
+        with self._lock:
+            self._open[key] = self._open.get(key, 0) + 1
+
+        try:
+            yield
+
+        finally:
+            with self._lock:
+                self._open[key] -= 1
+
+                if self._open[key] == 0:
+                    del self._open[key]
+
+            self.access(path)
+
+    def pin(self, path):
+        '''
+        Never evict a file from the cache
+        '''
+
+        with self._transaction() as entries:
+            entries.setdefault(fs.path.abspath(path), {})['pinned'] = True
+
+    def unpin(self, path):
+        '''
+        Allow a pinned file to be evicted again
+        '''
+
+        key = fs.path.abspath(path)
+
+        with self._transaction() as entries:
+            entry = entries.get(key)
+
+            if entry is None or not entry.pop('pinned', False):
+                return
+
+            if len(entry) == 0:
+                del entries[key]
+
+            if self.bounded:
+                self._evict(entries)
+
+    def is_pinned(self, path):
+        with self._lock:
+            self._refresh()
+
+            return self._entries.get(
+                fs.path.abspath(path), {}).get('pinned', False)
+
+    def _rank(self, entry):
+
+        if self._eviction == 'lfu':
+            return (entry.get('hits', 0), entry.get('accessed', 0))
+
+        return entry.get('accessed', 0)
+
+    def _select(self, entries, protect):
+        '''
+        Choose the files to evict to bring the cache within its quotas
+        '''
+
+        candidates = sorted(
+            [
+                (key, entry) for key, entry in entries.items()
+                if 'bytes' in entry
+                and not entry.get('pinned', False)
+                and key not in self._open
+                and key not in protect],
+            key=lambda item: self._rank(item[1]))
+
+        victims = set()
+
+        for prefix, quota in self._get_quotas():
+            used = self._get_usage(entries, prefix, exclude=victims)
+
+            for key, entry in candidates:
+                if used <= quota:
+                    break
+
+                if key.startswith(prefix) and key not in victims:
+                    victims.add(key)
+                    used -= entry['bytes']
+
+        return [key for key, _ in candidates if key in victims]
+
+    def _get_quotas(self):
+        '''
+        Return ``(prefix, quota)`` pairs, with prefixes as absolute paths
+        '''
+
+        quotas = sorted(self._prefix_quotas.items())
+
+        if self._max_size is not None:
+            quotas.append(('/', self._max_size))
+
+        return [
+            (fs.path.abspath(prefix).rstrip('/') + '/', quota)
+            for prefix, quota in quotas]
+
+    @staticmethod
+    def _get_usage(entries, prefix, exclude=()):
+
+        return sum(
+            entry.get('bytes', 0)
+            for key, entry in entries.items()
+            if key.startswith(prefix) and key not in exclude)
+
+    def evict(self, protect=None):
+        '''
+        Remove files from the cache until it is within its quotas
+
+        Parameters
+        ----------
+
+        protect : list
+            paths which must not be evicted (default None)
+
+        Returns
+        -------
+
+        evicted : list
+            paths of the files removed from the cache
+        '''
+
+        if not self.bounded:
+            return []
+
+        protect = set(fs.path.abspath(path) for path in (protect or []))
+
+        with self._transaction() as entries:
+            return self._evict(entries, protect)
+
+    def _evict(self, entries, protect=None):
+
+        victims = self._select(entries, protect or set())
+
+        for key in victims:
+            try:
+                self.fs.remove(key)
+
+            except ResourceNotFoundError:
+                pass
+
+            del entries[key]
+
+        self._over_quota = any(
+            self._get_usage(entries, prefix) > quota
+            for prefix, quota in self._get_quotas())
+
+        return victims
@@ -0,0 +1,268 @@
+from __future__ import absolute_import
+
+import io
+from collections import OrderedDict
+
+DefaultBlockSize = 2**20
+
+# number of blocks kept in each reader's block cache
+DefaultCacheBlocks = 16
+
+# largest number of blocks requested at once when reading sequentially
+DefaultMaxReadAhead = 8
+
+
+class RangedReader(io.RawIOBase):
+    '''
+    Seekable read-only file reading a remote file with ranged requests
+
+    The file is read in blocks of ``block_size`` bytes, which are kept in a
+    small least-recently-used cache. Sequential reads request increasingly
+    many blocks at once, up to ``max_read_ahead``, so that streaming a file
+    needs few requests, while seeking reads only the blocks around the new
+    position.
+
+    Parameters
+    ----------
+    read_range : function
+        function returning the bytes from ``start`` up to ``end`` of the file
+
+    size : int
+        size of the file in bytes
+
+    block_size : int
+        number of bytes in each block (default 1MB)
+
+    cache_blocks : int
+        number of blocks kept in the cache (default 16)
+
+    max_read_ahead : int
+        largest number of blocks fetched in one request (default 8)
+
+    Examples
+    --------
+
+    .. code-block:: python
+
+        >>> data = b'0123456789' * 10
+        >>> requests = []
+        >>> def read_range(start, end):
+        ...     requests.append((start, end))
+        ...     return data[start:end]
+        ...
+        >>> f = RangedReader(
+        ...     read_range, len(data), block_size=16, max_read_ahead=4)
+        >>> _ = f.seek(40)
+        >>> f.read(4) == b'0123'
+        True
+        >>> requests
+        [(32, 48)]
+
+    Reading on fetches the following blocks two at a time:
+
+    .. code-block:: python
+
+        >>> f.read(20) == data[44:64]
+        True
+        >>> requests
+        [(32, 48), (48, 80)]
+
+    '''
+
+    def __init__(
+            self,
+            read_range,
+            size,
+            block_size=None,
+            cache_blocks=None,
+            max_read_ahead=None):
+
+        self._read_range = read_range
+        self._size = size
+        self._block_size = block_size or DefaultBlockSize
+        self._max_read_ahead = max_read_ahead or DefaultMaxReadAhead
+
+        # the cache must hold a full read-ahead request
+        self._cache_blocks = max(
+            cache_blocks or DefaultCacheBlocks, self._max_read_ahead + 1)
+
+        self._blocks = OrderedDict()
+        self._pos = 0
+        self._last_block = None
+        self._window = 1
+
+        self.requests = 0
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def block_size(self):
+        return self._block_size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+
+        elif whence == io.SEEK_END:
+            offset += self._size
+
+        self._pos = max(offset, 0)
+
+        return self._pos
+
+    def _fetch(self, first, last):
+        '''
+        Fetch blocks ``first`` to ``last`` in a single request
+        '''
+
+        start = first * self._block_size
+        end = min((last + 1) * self._block_size, self._size)
+
+        data = self._read_range(start, end)
+        self.requests += 1
+
+        for index in range(first, last + 1):
+            offset = (index - first) * self._block_size
+            self._store(index, data[offset:offset + self._block_size])
+
+    def _store(self, index, block):
+        self._blocks.pop(index, None)
+        self._blocks[index] = block
+
+        while len(self._blocks) > self._cache_blocks:
+            self._blocks.popitem(last=False)
+
+    def _get_block(self, index):
+
+        if index in self._blocks:
+            block = self._blocks.pop(index)
+            self._blocks[index] = block
+
+        else:
+            if self._last_block is not None and (
+                    index == self._last_block + 1):
+
+                self._window = min(self._window * 2, self._max_read_ahead)
+
+            else:
+                self._window = 1
+
+            last = min(
+                index + self._window,
+                -(-self._size // self._block_size)) - 1
+
+            for ahead in range(index + 1, last + 1):
+                if ahead in self._blocks:
+                    last = ahead - 1
+                    break
+
+            self._fetch(index, last)
+            block = self._blocks[index]
+
+        self._last_block = index
+
+        return block
+
+    def readinto(self, b):
+
+        size = min(len(b), self._size - self._pos)
+
+        if size <= 0:
+            return 0
+
+        # reads larger than the cache bypass it
+        if size > self._cache_blocks * self._block_size:
+            data = self._read_range(self._pos, self._pos + size)
+            self.requests += 1
+            b[:len(data)] = data
+            self._pos += len(data)
+
+            return len(data)
+
+        read = 0
+
+        while read < size:
+            index, offset = divmod(self._pos, self._block_size)
+            block = self._get_block(index)
+
+            chunk = block[offset:offset + size - read]
+
+            if not chunk:
+                break
+
+            b[read:read + len(chunk)] = chunk
+            read += len(chunk)
+            self._pos += len(chunk)
+
+        return read
+
+    def readall(self):
+
+        if self._pos >= self._size:
+            return b''
+
+        data = self._read_range(self._pos, self._size)
+        self.requests += 1
+        self._pos += len(data)
+
+        return data
+
+
+def open_ranged(
+        filesystem,
+        path,
+        mode='rb',
+        block_size=None,
+        cache_blocks=None,
+        max_read_ahead=None,
+        encoding=None,
+        errors=None,
+        newline=None):
+    '''
+    Open a file for reading with ranged requests
+
+    ``filesystem`` must provide a ``read_range(path, start, end)`` method,
+    as :py:class:`~datafs.services.boto3fs.Boto3FS` does. See
+    :py:class:`RangedReader` for the remaining arguments.
+
+    Returns
+    -------
+    f : object
+        buffered binary file, or text file if ``'b'`` is not in ``mode``
+    '''
+
+    size = filesystem.getinfokeys(path, 'size')['size']
+
+    def read_range(start, end):
+        return filesystem.read_range(path, start, end)
+
+    raw = RangedReader(
+        read_range,
+        size,
+        block_size=block_size,
+        cache_blocks=cache_blocks,
+        max_read_ahead=max_read_ahead)
+
+    # buffer no more than a block, so that short reads fetch a single block
+    f = io.BufferedReader(raw, buffer_size=raw.block_size)
+
+    if 'b' in mode:
+        return f
+
+    return io.TextIOWrapper(
+        f,
+        encoding=encoding or 'utf-8',
+        errors=errors,
+        newline=newline)
@@ -2,15 +2,52 @@
 from __future__ import absolute_import
 
 import os
-import fs.utils
 import fs.path
 from fs.osfs import OSFS
 
+from datafs.services import transfer
+
 
 class DataService(object):
+    '''
+    A filesystem used by DataFS to store archive data
+
+    Parameters
+    ----------
+    fs : object
+        :py:mod:`pyFilesystem` filesystem object
+
+    index : object
+        :py:class:`~datafs.services.cache_index.CacheIndex` of checksums for
+        files on ``fs`` (default None)
 
-    def __init__(self, fs):
+    chunk_size : int
+        Number of bytes read at a time when copying to or from this service
+        (default :py:data:`~datafs.services.transfer.DefaultChunkSize`)
+
+    link : bool
+        Hard link files into this service instead of copying them where
+        possible. Only suitable for caches of versioned archives (default
+        False)
+    '''
+
+    def __init__(self, fs, index=None, chunk_size=None, link=False):
         self.fs = fs
+        self.index = index
+        self.chunk_size = chunk_size or transfer.DefaultChunkSize
+        self.link = link
+
+    @property
+    def config(self):
+        config = {}
+
+        if self.chunk_size != transfer.DefaultChunkSize:
+            config['chunk_size'] = self.chunk_size
+
+        if self.link:
+            config['link'] = self.link
+
+        return config
 
     def __repr__(self):
         return "<{}:{} object at {}>".format(
@@ -38,6 +75,11 @@ class DataService(object):
 
         remove : bool
             If true, the file is moved rather than copied
+
+        Returns
+        -------
+        stats : dict
+            transfer statistics from :py:func:`~datafs.services.transfer.copy`
         '''
 
         local = OSFS(os.path.dirname(filepath))
@@ -50,7 +92,7 @@ class DataService(object):
             if remove:
                 os.remove(filepath)
 
-            return
+            return None
 
         if not self.fs.isdir(fs.path.dirname(service_path)):
             self.fs.makedir(
@@ -58,16 +100,21 @@ class DataService(object):
                 recursive=True,
                 allow_recreate=True)
 
+        if self.index is not None:
+            self.index.invalidate(service_path)
+
         if remove:
-            fs.utils.movefile(
+            return transfer.move(
                 local,
                 os.path.basename(filepath),
                 self.fs,
-                service_path)
+                service_path,
+                chunk_size=self.chunk_size)
 
         else:
-            fs.utils.copyfile(
+            return transfer.copy(
                 local,
                 os.path.basename(filepath),
                 self.fs,
-                service_path)
+                service_path,
+                chunk_size=self.chunk_size)
@@ -0,0 +1,613 @@
+from __future__ import absolute_import
+
+import os
+import uuid
+import errno
+import shutil
+import threading
+import time
+
+import fs.path
+
+DefaultChunkSize = 2**20
+
+# number of idle buffers of each size kept for reuse
+_MaxPooledBuffers = 8
+
+_pool = {}
+_pool_lock = threading.Lock()
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+class _Buffer(object):
+    '''
+    Context manager borrowing a reusable bytearray from the buffer pool
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self.buffer = None
+
+    def __enter__(self):
+        with _pool_lock:
+            idle = _pool.get(self.size)
+
+            if idle:
+                self.buffer = idle.pop()
+
+        if self.buffer is None:
+            self.buffer = bytearray(self.size)
+
+        return memoryview(self.buffer)
+
+    def __exit__(self, *args):
+        with _pool_lock:
+            idle = _pool.setdefault(self.size, [])
+
+            if len(idle) < _MaxPooledBuffers:
+                idle.append(self.buffer)
+
+
+def borrow_buffer(size):
+    '''
+    Context manager lending a reusable buffer of ``size`` bytes
+
+    Yields a writable memoryview which is valid until the context exits.
+    '''
+
+    return _Buffer(size)
+
+
+def _write(f, chunk):
+    try:
+        f.write(chunk)
+
+    except TypeError:
+        # some remote file objects only accept bytes
+        f.write(chunk.tobytes())
+
+
+def copy_stream(
+        source,
+        destinations,
+        chunk_size=None,
+        hash_obj=None,
+        callback=None):
+    '''
+    Copy an open file to zero or more open files
+
+    Parameters
+    ----------
+    source : object
+
+        File-like object opened for binary reading
+
+    destinations : list
+
+        File-like objects opened for binary writing
+
+    chunk_size : int
+
+        Number of bytes read at a time (default :py:data:`DefaultChunkSize`)
+
+    hash_obj : object
+
+        :py:mod:`hashlib` hash object updated with the data copied (default
+        None)
+
+    callback : function
+
+        Called with the total number of bytes copied after each chunk
+        (default None)
+
+    Returns
+    -------
+    size : int
+
+        number of bytes copied
+
+    '''
+
+    chunk_size = chunk_size or DefaultChunkSize
+    total = 0
+
+    readinto = getattr(source, 'readinto', None)
+
+    with borrow_buffer(chunk_size) as buf:
+        while True:
+            if readinto is not None:
+                size = readinto(buf)
+                chunk = buf[:size]
+
+            else:
+                chunk = memoryview(source.read(chunk_size))
+                size = len(chunk)
+
+            if not size:
+                break
+
+            if hash_obj is not None:
+                hash_obj.update(chunk)
+
+            for destination in destinations:
+                _write(destination, chunk)
+
+            total += size
+
+            if callback is not None:
+                callback(total)
+
+    return total
+
+
+def _temp_path(path):
+    return fs.path.join(
+        fs.path.dirname(path),
+        '.{}.{}.partial'.format(fs.path.basename(path), uuid.uuid4().hex))
+
+
+class _Replacement(object):
+    '''
+    File written beside ``path`` and moved over it once complete
+    '''
+
+    def __init__(self, filesystem, path):
+        self.fs = filesystem
+        self.path = path
+        self.temp_path = _temp_path(path)
+
+        _makedirs(filesystem, path)
+        self.file = filesystem.open(self.temp_path, 'wb')
+
+    def commit(self, size):
+        self.file.close()
+
+        syspath = _get_syspath(self.fs, self.path)
+        temp_syspath = _get_syspath(self.fs, self.temp_path)
+
+        if syspath is None or temp_syspath is None:
+            self.fs.move(self.temp_path, self.path, overwrite=True)
+            return
+
+        if os.path.getsize(temp_syspath) != size:
+            self.discard()
+
+            raise IOError(
+                'Incomplete write to "{}": expected {} bytes'.format(
+                    self.path, size))
+
+        if os.path.isfile(syspath) and os.stat(syspath).st_nlink == 1:
+            # overwrite existing local files in place, so that readers
+            # holding the file open see the new contents
+            try:
+                _overwrite(temp_syspath, syspath)
+
+            finally:
+                os.remove(temp_syspath)
+
+        else:
+            _replace(temp_syspath, syspath)
+
+    def discard(self):
+        self.file.close()
+
+        if self.fs.isfile(self.temp_path):
+            self.fs.remove(self.temp_path)
+
+
+def write_stream(
+        source,
+        destinations,
+        chunk_size=None,
+        hash_obj=None,
+        callback=None):
+    '''
+    Write an open file to files on one or more filesystems
+
+    The source is read once. Each destination is written to a temporary file
+    beside it, which replaces the destination only once the whole source has
+    been copied, so a failed read or write never leaves a truncated file in
+    place. New files are renamed into place.
+
+    Local files which already exist are instead overwritten in place from
+    the complete temporary file, so that readers holding them open see the
+    new contents. This writes the data a second time, and a failure while
+    overwriting, such as a full disk, can leave the file partially
+    overwritten.
+    Filesystems providing an ``upload_fileobj`` method, such as
+    :py:class:`~datafs.services.boto3fs.Boto3FS`, are given a seekable
+    source directly once it has been read.
+
+    Parameters
+    ----------
+    source : object
+
+        File-like object opened for binary reading
+
+    destinations : list
+
+        List of ``(filesystem, path)`` tuples to write to
+
+    chunk_size, hash_obj, callback
+
+        See :py:func:`copy_stream`
+
+    Returns
+    -------
+    size : int
+
+        number of bytes copied
+
+    Examples
+    --------
+
+    .. code-block:: python
+
+        >>> import io
+        >>> from fs.memoryfs import MemoryFS
+        >>> mem = MemoryFS()
+        >>> size = write_stream(io.BytesIO(b'hello'), [(mem, 'dir/file.txt')])
+        >>> size == 5
+        True
+        >>> mem.listdir('dir') == ['file.txt']
+        True
+        >>> mem.getcontents('dir/file.txt', 'rb') == b'hello'
+        True
+
+    '''
+
+    uploads = []
+    streamed = []
+
+    seekable = hasattr(source, 'seek') and hasattr(source, 'tell')
+
+    for destination_fs, destination_path in destinations:
+        if hasattr(destination_fs, 'upload_fileobj') and seekable:
+            uploads.append((destination_fs, destination_path))
+        else:
+            streamed.append((destination_fs, destination_path))
+
+    start = source.tell() if uploads else None
+
+    replacements = []
+
+    try:
+        for destination_fs, destination_path in streamed:
+            replacements.append(
+                _Replacement(destination_fs, destination_path))
+
+        size = copy_stream(
+            source,
+            [replacement.file for replacement in replacements],
+            chunk_size=chunk_size,
+            hash_obj=hash_obj,
+            callback=callback)
+
+    except BaseException:
+        for replacement in replacements:
+            replacement.discard()
+
+        raise
+
+    for i, replacement in enumerate(replacements):
+        try:
+            replacement.commit(size)
+
+        except BaseException:
+            for remaining in replacements[i+1:]:
+                remaining.discard()
+
+            raise
+
+    for destination_fs, destination_path in uploads:
+        _makedirs(destination_fs, destination_path)
+        source.seek(start)
+        destination_fs.upload_fileobj(destination_path, source)
+
+    return size
+
+
+def _get_syspath(filesystem, path):
+    if filesystem.hassyspath(path):
+        return filesystem.getsyspath(path)
+
+    return None
+
+
+def _makedirs(filesystem, path):
+    dirname = fs.path.dirname(path)
+
+    if dirname.strip('/') and not filesystem.isdir(dirname):
+        filesystem.makedir(dirname, recursive=True, allow_recreate=True)
+
+
+def _overwrite(source_path, destination_path):
+    '''
+    Write a local file over another in place, truncating it only afterwards
+    '''
+
+    with open(source_path, 'rb') as source:
+        with open(destination_path, 'r+b') as destination:
+            size = copy_stream(source, [destination])
+            destination.truncate(size)
+
+
+def _copy_syspaths(source_path, destination_path, chunk_size):
+    '''
+    Copy between local files using the fastest method available
+
+    Returns the number of bytes copied and the name of the method used
+    '''
+
+    with open(source_path, 'rb') as source:
+        with open(destination_path, 'wb') as destination:
+            size = os.fstat(source.fileno()).st_size
+
+            for method in ['copy_file_range', 'sendfile']:
+                copier = getattr(os, method, None)
+
+                if copier is None:
+                    continue
+
+                offset = 0
+
+                try:
+                    while offset < size:
+                        if method == 'sendfile':
+                            copied = copier(
+                                destination.fileno(),
+                                source.fileno(),
+                                offset,
+                                size - offset)
+
+                        else:
+                            copied = copier(
+                                source.fileno(),
+                                destination.fileno(),
+                                size - offset,
+                                offset,
+                                offset)
+
+                        if copied == 0:
+                            break
+
+                        offset += copied
+
+                except OSError as e:
+                    # not supported between these files; try the next method
+                    if e.errno not in (
+                            errno.EXDEV,
+                            errno.ENOSYS,
+                            errno.EINVAL,
+                            errno.EOPNOTSUPP,
+                            errno.EBADF):
+                        raise
+
+                    destination.seek(0)
+                    destination.truncate()
+                    continue
+
+                if offset == size:
+                    return size, method
+
+                destination.seek(0)
+                destination.truncate()
+
+            source.seek(0)
+
+            return copy_stream(source, [destination], chunk_size), 'stream'
+
+
+def copy(
+        source_fs,
+        source_path,
+        destination_fs,
+        destination_path,
+        chunk_size=None,
+        hash_obj=None,
+        link=False,
+        callback=None):
+    '''
+    Copy a file between filesystems
+
+    Parent directories of ``destination_path`` are created if needed.
+
+    When both files have system paths and no hash is requested, the file is
+    copied by the operating system (``os.copy_file_range`` or
+    ``os.sendfile`` where available). With ``link=True``, the destination is
+    created as a hard link to the source if both are on the same device.
+    Between a local file and a filesystem providing ``upload_file`` and
+    ``download_file`` methods, such as
+    :py:class:`~datafs.services.boto3fs.Boto3FS`, those methods are used.
+    Otherwise the file is streamed in ``chunk_size`` blocks through a
+    reusable buffer.
+
+    Parameters
+    ----------
+    source_fs : object
+
+        :py:mod:`pyFilesystem` filesystem object to copy from
+
+    source_path : str
+
+        path of the file on ``source_fs``
+
+    destination_fs : object
+
+        :py:mod:`pyFilesystem` filesystem object to copy to
+
+    destination_path : str
+
+        path of the file on ``destination_fs``
+
+    chunk_size : int
+
+        Number of bytes read at a time (default :py:data:`DefaultChunkSize`)
+
+    hash_obj : object
+
+        :py:mod:`hashlib` hash object updated with the file's contents
+        (default None)
+
+    link : bool
+
+        Hard link the destination to the source where possible. Only use this
+        for files which are never modified in place (default False)
+
+    callback : function
+
+        Called with the total number of bytes copied after each chunk. Not
+        called for operating system copies (default None)
+
+    Returns
+    -------
+    stats : dict
+
+        dictionary with keys ``bytes``, ``seconds``, and ``method``
+
+    Examples
+    --------
+
+    .. code-block:: python
+
+        >>> import hashlib
+        >>> from fs.tempfs import TempFS
+        >>> source, destination = TempFS(), TempFS()
+        >>> _ = source.setcontents('file.txt', b'hello')
+        >>> stats = copy(source, 'file.txt', destination, 'dir/file.txt')
+        >>> stats['bytes']
+        5
+        >>> md5 = hashlib.md5()
+        >>> stats = copy(
+        ...     source, 'file.txt', destination, 'file.txt', hash_obj=md5)
+        >>> stats['method']
+        'stream'
+        >>> md5.hexdigest() == hashlib.md5(b'hello').hexdigest()
+        True
+        >>> source.close()
+        >>> destination.close()
+
+    '''
+
+    start = time.time()
+
+    _makedirs(destination_fs, destination_path)
+
+    source_syspath = _get_syspath(source_fs, source_path)
+    destination_syspath = _get_syspath(destination_fs, destination_path)
+
+    # never write through a hard link into another file's contents
+    if destination_syspath is not None and os.path.isfile(
+            destination_syspath) and (
+                os.stat(destination_syspath).st_nlink > 1):
+
+        os.remove(destination_syspath)
+
+    size = None
+
+    if (
+            hash_obj is None and
+            source_syspath is not None and
+            destination_syspath is not None):
+
+        if os.path.abspath(source_syspath) == os.path.abspath(
+                destination_syspath):
+
+            size, method = os.path.getsize(source_syspath), 'none'
+
+        elif link and hasattr(os, 'link') and (
+                os.stat(source_syspath).st_dev ==
+                os.stat(os.path.dirname(destination_syspath)).st_dev):
+
+            if os.path.exists(destination_syspath):
+                os.remove(destination_syspath)
+
+            os.link(source_syspath, destination_syspath)
+            size, method = os.path.getsize(source_syspath), 'link'
+
+        else:
+            size, method = _copy_syspaths(
+                source_syspath, destination_syspath, chunk_size)
+
+    # filesystems such as Boto3FS transfer local files in parallel parts
+    if size is None and hash_obj is None:
+
+        if source_syspath is not None and hasattr(
+                destination_fs, 'upload_file'):
+
+            destination_fs.upload_file(destination_path, source_syspath)
+            size, method = os.path.getsize(source_syspath), 'upload'
+
+        elif destination_syspath is not None and hasattr(
+                source_fs, 'download_file'):
+
+            source_fs.download_file(source_path, destination_syspath)
+            size, method = os.path.getsize(destination_syspath), 'download'
+
+    if size is None:
+        with source_fs.open(source_path, 'rb') as source:
+            with destination_fs.open(destination_path, 'wb') as destination:
+                size = copy_stream(
+                    source,
+                    [destination],
+                    chunk_size=chunk_size,
+                    hash_obj=hash_obj,
+                    callback=callback)
+
+        method = 'stream'
+
+    return {'bytes': size, 'seconds': time.time() - start, 'method': method}
+
+
+def move(
+        source_fs,
+        source_path,
+        destination_fs,
+        destination_path,
+        chunk_size=None):
+    '''
+    Move a file between filesystems
+
+    Files on the same local device are renamed. Otherwise the file is copied
+    with :py:func:`copy` and the source removed.
+
+    Returns
+    -------
+    stats : dict
+
+        dictionary with keys ``bytes``, ``seconds``, and ``method``
+    '''
+
+    start = time.time()
+
+    source_syspath = _get_syspath(source_fs, source_path)
+    destination_syspath = _get_syspath(destination_fs, destination_path)
+
+    if source_syspath is not None and destination_syspath is not None:
+        _makedirs(destination_fs, destination_path)
+
+        try:
+            size = os.path.getsize(source_syspath)
+            shutil.move(source_syspath, destination_syspath)
+
+            return {
+                'bytes': size,
+                'seconds': time.time() - start,
+                'method': 'rename'}
+
+        except (OSError, IOError):
+            pass
+
+    stats = copy(
+        source_fs,
+        source_path,
+        destination_fs,
+        destination_path,
+        chunk_size=chunk_size)
+
+    source_fs.remove(source_path)
+
+    stats['seconds'] = time.time() - start
+
+    return stats
@@ -10,6 +10,9 @@ import os
 
 from fs.osfs import OSFS
 from fs.s3fs import S3FS
+import boto3
+
+from datafs.services.boto3fs import Boto3FS
 
 from datafs import DataAPI
 from datafs._compat import string_types
@@ -44,13 +47,13 @@ def pytest_generate_tests(metafunc):
 
     if 'mgr_name' in metafunc.fixturenames:
 
-        metafunc.parametrize('mgr_name', ['mongo', 'dynamo'])
+        metafunc.parametrize('mgr_name', ['mongo', 'dynamo', 'sqlite'])
         # metafunc.parametrize('mgr_name', ['mongo'])
 
     if 'fs_name' in metafunc.fixturenames:
 
         metafunc.parametrize(
-            'fs_name', ['OSFS', 'S3FS'])
+            'fs_name', ['OSFS', 'S3FS', 'Boto3FS'])
 
     if 'open_func' in metafunc.fixturenames:
         metafunc.parametrize('open_func', ['open_file', 'get_local_path'])
@@ -121,6 +124,32 @@ def prep_filesystem(fs_name):
         finally:
             m.stop()
 
+    elif fs_name == 'Boto3FS':
+
+        m = moto.mock_s3()
+        m.start()
+
+        try:
+            client_args = {
+                'region_name': 'us-east-1',
+                'aws_access_key_id': 'MY_KEY',
+                'aws_secret_access_key': 'MY_SECRET_KEY'}
+
+            boto3.client('s3', **client_args).create_bucket(
+                Bucket='test-bucket')
+
+            s3 = Boto3FS(
+                'test-bucket',
+                client_args=client_args,
+                part_size=5 * 2**20,
+                max_concurrency=4)
+
+            yield s3
+            s3.close()
+
+        finally:
+            m.stop()
+
 
 @pytest.yield_fixture
 def api(mgr_name, fs_name):
@@ -396,7 +425,7 @@ def datafile_opener(open_func):
         raise NameError('open_func "{}" not recognized'.format(open_func))
 
 
-@pytest.yield_fixture(scope='session', params=['mongo', 'dynamo'])
+@pytest.yield_fixture(scope='session', params=['mongo', 'dynamo', 'sqlite'])
 def api_with_diverse_archives(request):
 
     ITERATIONS = 7
@@ -473,6 +502,9 @@ def api_with_diverse_archives(request):
                         for item in new_archives:
                             batch.put_item(Item=item)
 
+                elif request.param == 'sqlite':
+                    api.manager._create_archives(new_archives)
+
                 else:
                     raise ValueError('Manager "{}" not recognized'.format(
                         request.param))
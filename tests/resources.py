@@ -2,10 +2,12 @@
 from contextlib import contextmanager
 from datafs.managers.manager_dynamo import DynamoDBManager
 from datafs.managers.manager_mongo import MongoDBManager
+from datafs.managers.manager_sqlite import SQLiteManager
 from distutils.version import StrictVersion
 
 import os
 import shutil
+import tempfile
 import time
 
 has_special_dependencies = False
@@ -36,6 +38,9 @@ except NameError:
     string_types = (str,)
 
 
+_sqlite_test_dir = tempfile.mkdtemp()
+
+
 def _close(path):
 
     closed = False
@@ -99,5 +104,28 @@ def prep_manager(mgr_name, table_name='my-new-data-table'):
                 table_name,
                 raise_on_err=False)
 
+    elif mgr_name == 'sqlite':
+
+        # managers with the same table name share a database, as with the
+        # mongo and dynamo test servers
+        database = os.path.join(
+            _sqlite_test_dir, '{}.db'.format(table_name))
+
+        manager_sqlite = SQLiteManager(database, table_name)
+
+        manager_sqlite.create_archive_table(
+            table_name,
+            raise_on_err=False)
+
+        try:
+            yield manager_sqlite
+
+        finally:
+            manager_sqlite.delete_table(
+                table_name,
+                raise_on_err=False)
+
+            manager_sqlite.close()
+
     else:
         raise ValueError('Manager "{}" not recognized'.format(mgr_name))
@@ -1,3 +1,8 @@
+from __future__ import absolute_import
+
+from datafs import DataAPI
+from tests.resources import prep_manager
+
 
 def test_get_all_archives(api_with_diverse_archives):
 
@@ -234,3 +239,70 @@ def test_begins_with_null_tag_search(api_with_diverse_archives):
             )
 
     assert len(variables) == 0
+
+
+def test_dynamo_tag_index(local_auth):
+
+    with prep_manager('dynamo', table_name='tag-index-test') as manager:
+
+        api = DataAPI(username='My Name', contact='my.email@example.com')
+        api.attach_manager(manager)
+        api.attach_authority('auth', local_auth)
+
+        api.create('archive1', tags=['tag1', 'tag2'])
+        api.create('archive2', tags=['tag1'])
+
+        # backfill the index for archives created before it was enabled
+        assert manager.build_tag_index() == 2
+        assert 'tag-index-test.tags' in manager.table_names
+
+        assert list(api.search('tag1', 'tag2')) == ['archive1']
+        assert list(api.search('tag1')) == ['archive1', 'archive2']
+
+        api.create('archive3', tags=['tag2'])
+        api.get_archive('archive2').add_tags('tag2')
+        api.get_archive('archive1').delete_tags('tag2')
+
+        assert list(api.search('tag2')) == ['archive2', 'archive3']
+        assert list(api.search('tag2', prefix='archive3')) == ['archive3']
+        assert list(api.search('tag3')) == []
+
+        api.delete_archive('archive3')
+
+        assert list(api.search('tag2')) == ['archive2']
+
+    assert 'tag-index-test.tags' not in manager.table_names
+
+
+def test_dynamo_parallel_scan(local_auth):
+
+    with prep_manager('dynamo', table_name='parallel-scan-test') as manager:
+
+        api = DataAPI(username='My Name', contact='my.email@example.com')
+        api.attach_manager(manager)
+        api.attach_authority('auth', local_auth)
+
+        for i in range(20):
+            api.create(
+                'archive{}'.format(i),
+                tags=['even' if i % 2 == 0 else 'odd'])
+
+        expected_all = sorted(api.filter())
+        expected_even = sorted(api.search('even'))
+
+        manager._scan_segments = 4
+
+        assert sorted(api.filter()) == expected_all
+        assert len(expected_all) == 20
+
+        assert sorted(api.search('even')) == expected_even
+        assert len(expected_even) == 10
+
+        assert sorted(api.search('odd', prefix='archive1')) == [
+            'archive1', 'archive11', 'archive13', 'archive15',
+            'archive17', 'archive19']
+
+        # stopping early should not block
+        assert len(list(zip(range(3), api.filter()))) == 3
+
+        assert manager.config['scan_segments'] == 4
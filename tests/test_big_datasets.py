@@ -26,21 +26,21 @@ def test_xarray_upload(api1, auth1):
     for i in range(2):
 
         # try reading from the archive
-        with archive.get_local_path() as f:
+        with archive.get_local_path(mode='r') as f:
             with xr.open_dataset(f) as ds:
                 print(ds)
 
         assert len(archive.get_versions()) == i + 1
 
         # try reading from & doing math on the archive
-        with archive.get_local_path() as f:
+        with archive.get_local_path(mode='r') as f:
             with xr.open_dataset(f) as ds:
                 ds = ds * 2
 
         assert len(archive.get_versions()) == i + 1
 
         # try dask read
-        with archive.get_local_path() as f:
+        with archive.get_local_path(mode='r') as f:
             with xr.open_dataset(f) as ds:
                 air2 = ds.air * 2
                 ds.load()
@@ -75,6 +75,6 @@ def test_xarray_upload(api1, auth1):
     assert len(archive.get_versions()) == i + 2
 
     # make sure old version is still ok too
-    with archive.get_local_path(version='0.0.1') as f:
+    with archive.get_local_path(version='0.0.1', mode='r') as f:
         with xr.open_dataset(f) as ds:
             assert (ds.air == airtemps.air).all()
@@ -3,7 +3,10 @@ from __future__ import absolute_import
 
 import os
 
+from fs.osfs import OSFS
+
 from datafs._compat import u
+from datafs.services.cache_index import CacheIndex
 
 
 def test_delete_handling(api, auth1, cache):
@@ -255,3 +258,322 @@ def test_multi_api(api1, api2, auth1, cache1, cache2, opener):
 
         assert len(archive1.get_history()) == 8
         assert u('67890') == u(f1.read())
+
+
+def test_cache_checksum_index(api, auth1, cache, monkeypatch):
+
+    api.attach_authority('auth1', auth1)
+    api.attach_cache(cache)
+
+    with open('test_file.txt', 'w+') as f:
+        f.write('this is an upload test')
+
+    var = api.create('archive1', authority_name='auth1', versioned=True)
+    var.update('test_file.txt', cache=True, remove=True)
+
+    hashed = []
+    hash_file = api.hash_file
+
+    def counted_hash_file(f):
+        hashed.append(1)
+        return hash_file(f)
+
+    monkeypatch.setattr(api, 'hash_file', counted_hash_file)
+
+    # the checksum recorded on upload is reused for cached reads
+    for _ in range(2):
+        with var.open('r') as f:
+            assert u(f.read()) == u('this is an upload test')
+
+    assert len(hashed) == 0
+
+    # a modified cache file is re-hashed and replaced
+    cache.setcontents(var.get_version_path(), b'corrupted')
+
+    with var.open('r') as f:
+        assert u(f.read()) == u('this is an upload test')
+
+    assert len(hashed) == 1
+
+    # the file downloaded from the authority is verified once
+    for _ in range(2):
+        with var.open('r') as f:
+            assert u(f.read()) == u('this is an upload test')
+
+    assert len(hashed) == 2
+
+    # the index persists for other APIs sharing the cache
+    api.attach_cache(cache)
+
+    with var.open('r') as f:
+        f.read()
+
+    assert len(hashed) == 2
+
+    api.attach_cache(cache, verify='always')
+
+    with var.open('r') as f:
+        f.read()
+
+    assert len(hashed) == 3
+
+
+def test_read_only_local_path(api, auth1, cache):
+
+    api.attach_authority('auth1', auth1)
+
+    var = api.create('archive1', authority_name='auth1', versioned=True)
+
+    with var.open('w+') as f:
+        f.write(u('version 1'))
+
+    with var.get_local_path(mode='r') as fp:
+        with open(fp, 'r') as f:
+            assert u(f.read()) == u('version 1')
+
+    # With a cache attached, remote authorities are downloaded once
+    api.attach_cache(cache)
+
+    with var.get_local_path(mode='r') as fp:
+        if auth1.hassyspath(var.get_version_path()):
+            assert fp == auth1.getsyspath(var.get_version_path())
+
+        else:
+            assert fp == cache.getsyspath(var.get_version_path())
+
+        with open(fp, 'r') as f:
+            assert u(f.read()) == u('version 1')
+
+    assert len(var.get_versions()) == 1
+
+
+def test_single_pass_update(api, auth1, cache, monkeypatch, tmpdir):
+
+    api.attach_authority('auth1', auth1)
+    api.attach_cache(cache)
+
+    var = api.create('archive1', authority_name='auth1', versioned=True)
+
+    hashed = []
+    hash_file = api.hash_file
+
+    def counted_hash_file(f):
+        hashed.append(1)
+        return hash_file(f)
+
+    monkeypatch.setattr(api, 'hash_file', counted_hash_file)
+
+    test_file = str(tmpdir.join('test_file.txt'))
+
+    def update(contents):
+        with open(test_file, 'w+') as f:
+            f.write(contents)
+
+        var.update(test_file, cache=True)
+
+    # new contents are hashed while they are uploaded
+    update('this is an upload test')
+    update('this is a longer upload test')
+
+    assert len(hashed) == 0
+    assert len(var.get_versions()) == 2
+
+    checksum = hash_file(test_file)['checksum']
+    assert var.get_latest_hash() == checksum
+
+    for service in [auth1, cache]:
+        with service.open(var.get_version_path(), 'r') as f:
+            assert u(f.read()) == u('this is a longer upload test')
+
+    # files the same size as the latest version are checked first
+    update('this is a longer upload test')
+
+    assert len(hashed) == 1
+    assert len(var.get_versions()) == 2
+
+    update('this is a longer upload text')
+
+    assert len(hashed) == 2
+    assert len(var.get_versions()) == 3
+
+    with var.open('r') as f:
+        assert u(f.read()) == u('this is a longer upload text')
+
+
+def test_bounded_cache(api, auth1, cache, tmpdir):
+
+    api.attach_authority('auth1', auth1)
+    api.attach_cache(cache, max_size=25, prefix_quotas={'team1/': 10})
+
+    archives = {}
+
+    for name in ['archive1', 'archive2', 'archive3', 'team1/archive4']:
+        archives[name] = api.create(
+            name, authority_name='auth1', versioned=True)
+
+        with archives[name].open('w+') as f:
+            f.write(u('{:<10}'.format(name)))
+
+    def cached():
+        return set(
+            name for name, var in archives.items() if var.is_cached())
+
+    # least recently used files are evicted first
+    for name in ['archive1', 'archive2', 'archive3']:
+        archives[name].cache()
+
+        with archives[name].open('r') as f:
+            assert u(f.read()).strip() == u(name)
+
+    assert cached() == set(['archive2', 'archive3'])
+    assert api.cache.index.size == 20
+
+    # pinned and open files are never evicted
+    archives['archive2'].pin()
+
+    with archives['archive3'].open('r') as f:
+        archives['archive1'].cache()
+
+        with archives['archive1'].open('r') as f1:
+            f1.read()
+
+        assert cached() == set(['archive1', 'archive2', 'archive3'])
+        assert u(f.read()).strip() == u('archive3')
+
+    assert cached() == set(['archive2', 'archive3'])
+
+    # prefix quotas are enforced within the overall quota
+    archives['team1/archive4'].cache()
+
+    with archives['team1/archive4'].open('r') as f:
+        f.read()
+
+    assert cached() == set(['archive2', 'team1/archive4'])
+
+    test_file = str(tmpdir.join('test_file.txt'))
+
+    with open(test_file, 'w+') as f:
+        f.write('team 1')
+
+    archives['team1/archive4'].update(test_file, cache=True)
+
+    assert archives['team1/archive4'].is_cached()
+    assert not archives['team1/archive4'].is_cached(
+        archives['team1/archive4'].get_versions()[0])
+
+    archives['archive2'].unpin()
+    assert not archives['archive2'].is_pinned()
+    assert cached() == set(['archive2', 'team1/archive4'])
+
+    # least frequently used files are evicted first with 'lfu'
+    api.attach_cache(cache, max_size=25, eviction='lfu')
+
+    for name in ['archive1', 'archive1', 'archive2', 'archive3']:
+        if not archives[name].is_cached():
+            archives[name].cache()
+
+        with archives[name].open('r') as f:
+            f.read()
+
+    assert cached() == set(['archive1', 'archive3'])
+
+
+def test_bounded_cache_usage(api, auth1, cache, monkeypatch):
+
+    api.attach_authority('auth1', auth1)
+    api.attach_cache(cache, max_size=100)
+
+    archive = api.create('usage_archive', authority_name='auth1')
+
+    with archive.open('w+') as f:
+        f.write(u('hello'))
+
+    if archive.is_cached():
+        archive.remove_from_cache()
+
+    index = api.cache.index
+    downloaded = not auth1.hassyspath(archive.get_version_path())
+
+    # files downloaded to the cache count against its quota at once
+    with archive.get_local_path(mode='r'):
+        assert index.size == (5 if downloaded else 0)
+
+    # download and hash the file
+    archive.cache()
+
+    for _ in range(2):
+        with archive.open('r') as f:
+            f.read()
+
+    index.flush()
+
+    saves = []
+    save = index._save
+
+    def counted_save(entries):
+        saves.append(entries)
+        save(entries)
+
+    monkeypatch.setattr(index, '_save', counted_save)
+
+    # uses of a tracked file are buffered rather than saved on each read
+    for _ in range(3):
+        with archive.open('r') as f:
+            assert u(f.read()) == u('hello')
+
+    assert len(saves) == 0
+
+    key = '/' + archive.get_version_path().lstrip('/')
+    hits = index._load()[key]['hits']
+
+    index.flush()
+
+    assert len(saves) == 1
+    assert index._load()[key]['hits'] == hits + 3
+
+
+def test_shared_cache_index(tmpdir):
+
+    cache = OSFS(str(tmpdir))
+
+    for path in ['arch1', 'arch2', 'arch3']:
+        cache.setcontents(path, b'12345')
+
+    def hasher(f):
+        return {'algorithm': 'len', 'checksum': str(len(f.read()))}
+
+    # two processes sharing one cache
+    index1 = CacheIndex(cache, max_size=10)
+    index1.access('arch1')
+    index1.checksum('arch1', hasher)
+
+    index2 = CacheIndex(cache, max_size=10)
+
+    index1.pin('arch1')
+    index2.checksum('arch2', hasher)
+    index2.access('arch2')
+    index2.access('arch3')
+
+    # the pin set by the other index is kept, so arch2 is evicted instead
+    assert cache.isfile('arch1')
+    assert not cache.isfile('arch2')
+    assert cache.isfile('arch3')
+
+    assert index1.is_pinned('arch1')
+    assert index2.is_pinned('arch1')
+
+    index1.access('arch1')
+
+    # uses of tracked files are written in batches
+    assert CacheIndex(cache)._load()['/arch1']['hits'] == 1
+
+    index1.flush()
+
+    entries = CacheIndex(cache)._load()
+
+    assert entries['/arch1']['hits'] == 2
+    assert entries['/arch1']['checksum']['checksum'] == '5'
+    assert '/arch2' not in entries
+    assert index1.size == index2.size == 10
+
+    assert not any(path.endswith('.partial') for path in cache.listdir())
@@ -2,10 +2,17 @@ from __future__ import absolute_import
 
 import fs.path
 import os
+import boto3
+import moto
+from botocore.config import Config
 
 from datafs import DataAPI
 from datafs.core import data_file
 from datafs.services.service import DataService
+from datafs.services import transfer
+from datafs.services.boto3fs import Boto3FS
+from fs.memoryfs import MemoryFS
+from fs.errors import ResourceNotFoundError
 
 import pytest
 
@@ -328,3 +335,420 @@ def test_delete_handling(local_auth, cache):
 
     with open(csh.fs.getsyspath(p), 'r') as f:
         assert u('test data 1') == f.read()
+
+
+def test_read_only_local_path(local_auth, cache, monkeypatch):
+
+    a1 = DataService(local_auth)
+    csh = DataService(cache)
+
+    a1.fs.makedir(fs.path.dirname(p), recursive=True, allow_recreate=True)
+    a1.fs.setcontents(p, b'test data 1')
+
+    def fail(*args, **kwargs):
+        raise AssertionError('read-only paths should not be copied')
+
+    monkeypatch.setattr(data_file.tempfile, 'mkdtemp', fail)
+
+    # With no file in the cache, the authority's path is returned
+    with data_file.get_local_path(
+            a1, csh, fail, get_checker(a1, p), hasher, p, mode='r') as fp:
+
+        assert fp == a1.fs.getsyspath(p)
+
+        with open(fp, 'r') as f:
+            assert u('test data 1') == f.read()
+
+    # A stale cached file is updated, and the cache path is returned
+    csh.fs.makedir(fs.path.dirname(p), recursive=True, allow_recreate=True)
+    csh.fs.setcontents(p, b'')
+
+    with data_file.get_local_path(
+            a1, csh, fail, get_checker(a1, p), hasher, p, mode='r') as fp:
+
+        assert fp == csh.fs.getsyspath(p)
+
+        with open(fp, 'r') as f:
+            assert u('test data 1') == f.read()
+
+    # Authorities with no system path are downloaded once into the cache
+    remote = DataService(MemoryFS())
+    remote.fs.makedir(fs.path.dirname(p), recursive=True, allow_recreate=True)
+    remote.fs.setcontents(p, b'test data 2')
+
+    csh.fs.remove(p)
+
+    with data_file.get_local_path(
+            remote,
+            csh,
+            fail,
+            lambda chk: True,
+            hasher,
+            p,
+            mode='r') as fp:
+
+        assert fp == csh.fs.getsyspath(p)
+
+        with open(fp, 'r') as f:
+            assert u('test data 2') == f.read()
+
+    with pytest.raises(ResourceNotFoundError):
+        with data_file.get_local_path(
+                a1, None, fail, get_checker(a1, p), hasher, 'missing.txt',
+                mode='r'):
+            pass
+
+
+def test_spooled_write(local_auth, cache, monkeypatch):
+
+    a1 = DataService(local_auth)
+    csh = DataService(cache)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('spooled writes should not use a temp dir')
+
+    monkeypatch.setattr(data_file.tempfile, 'mkdtemp', fail)
+
+    def no_setcontents(*args, **kwargs):
+        raise AssertionError('spooled writes should use the transfer module')
+
+    monkeypatch.setattr(local_auth, 'setcontents', no_setcontents)
+
+    hashed = []
+
+    def counted_hasher(f):
+        hashed.append(1)
+        return hasher(f)
+
+    updates = []
+
+    def record_update(**checksum):
+        updates.append(checksum)
+
+    # Small files are hashed as they are written
+    with data_file.open_file(
+            a1,
+            csh,
+            record_update,
+            get_checker(a1, p),
+            counted_hasher,
+            p,
+            spool_size=1024,
+            new_hash=DataAPI.new_hash,
+            mode='w+') as f:
+
+        f.write(u('test data 1'))
+
+    assert len(hashed) == 0
+    assert updates[-1] == DataAPI.hash_file(a1.fs.getsyspath(p))
+
+    with open(a1.fs.getsyspath(p), 'r') as f:
+        assert u('test data 1') == f.read()
+
+    # Unchanged files are not uploaded
+    with data_file.open_file(
+            a1,
+            csh,
+            record_update,
+            get_checker(a1, p),
+            counted_hasher,
+            p,
+            spool_size=1024,
+            new_hash=DataAPI.new_hash,
+            mode='w+') as f:
+
+        f.write(u('test data 1'))
+
+    assert len(updates) == 1
+
+    # Large or rewritten files are spilled to disk and hashed on close
+    contents = b'0123456789' * 1024
+
+    with data_file.open_file(
+            a1,
+            csh,
+            record_update,
+            get_checker(a1, p),
+            counted_hasher,
+            p,
+            spool_size=1024,
+            new_hash=DataAPI.new_hash,
+            mode='wb') as f:
+
+        f.write(b'x' * len(contents))
+        f.seek(0)
+        f.write(contents)
+
+    assert len(hashed) == 1
+    assert updates[-1] == DataAPI.hash_file(a1.fs.getsyspath(p))
+
+    with open(a1.fs.getsyspath(p), 'rb') as f:
+        assert contents == f.read()
+
+
+def test_transfer(local_auth, cache):
+
+    a1 = DataService(local_auth, chunk_size=7)
+    csh = DataService(cache, link=True)
+
+    contents = b'0123456789' * 10
+    local_auth.makedir(fs.path.dirname(p), recursive=True)
+    local_auth.setcontents(p, contents)
+
+    # Copies between local files are made by the operating system
+    stats = transfer.copy(local_auth, p, cache, p)
+    assert stats['bytes'] == len(contents)
+    assert cache.getcontents(p, 'rb') == contents
+
+    # Data is hashed in chunks while it is copied
+    progress = []
+    md5 = DataAPI.new_hash()
+    mem = MemoryFS()
+
+    stats = transfer.copy(
+        local_auth,
+        p,
+        mem,
+        p,
+        chunk_size=a1.chunk_size,
+        hash_obj=md5,
+        callback=progress.append)
+
+    assert stats['method'] == 'stream'
+    assert progress[:2] == [7, 14]
+    assert progress[-1] == len(contents)
+    assert md5.hexdigest() == DataAPI.hash_file(
+        local_auth.getsyspath(p))['checksum']
+    assert mem.getcontents(p, 'rb') == contents
+
+    # Versioned files may be hard linked into a cache
+    cache.remove(p)
+
+    with data_file._choose_read_fs(
+            a1, csh, p, get_checker(a1, p), hasher, immutable=True):
+        pass
+
+    assert not cache.isfile(p)
+
+    cache.makedir(fs.path.dirname(p), recursive=True, allow_recreate=True)
+    cache.setcontents(p, b'stale')
+
+    with data_file._choose_read_fs(
+            a1, csh, p, get_checker(a1, p), hasher, immutable=True):
+        pass
+
+    assert cache.getcontents(p, 'rb') == contents
+
+    if os.stat(cache.getsyspath(p)).st_nlink > 1:
+
+        # Overwriting a linked file leaves the other copy unchanged
+        mem.setcontents(p, b'new contents')
+        transfer.copy(mem, p, cache, p)
+
+        assert cache.getcontents(p, 'rb') == b'new contents'
+        assert local_auth.getcontents(p, 'rb') == contents
+
+    # Moves between local files are renames
+    cached = cache.getcontents(p, 'rb')
+
+    stats = transfer.move(cache, p, local_auth, 'moved.txt')
+    assert stats['method'] == 'rename'
+    assert not cache.isfile(p)
+    assert local_auth.getcontents('moved.txt', 'rb') == cached
+
+    mem.close()
+
+
+def test_boto3fs_transfers(local_auth):
+
+    m = moto.mock_s3()
+    m.start()
+
+    try:
+        client_args = {'region_name': 'us-east-1'}
+        boto3.client('s3', **client_args).create_bucket(Bucket='test-bucket')
+
+        s3 = Boto3FS(
+            'test-bucket',
+            prefix='data',
+            client_args=client_args,
+            part_size=5 * 2**20,
+            max_concurrency=4)
+
+        # Filesystems with the same connection arguments share a client
+        assert s3._client is Boto3FS(
+            'test-bucket', client_args=client_args)._client
+
+        # Client configs are merged with the connection pool size
+        configured = Boto3FS(
+            'test-bucket',
+            client_args=dict(
+                config=Config(connect_timeout=7), **client_args),
+            max_pool_connections=20)
+
+        assert configured._client.meta.config.max_pool_connections == 20
+        assert configured._client.meta.config.connect_timeout == 7
+
+        contents = os.urandom(2**16) * 176
+        local_auth.makedir(fs.path.dirname(p), recursive=True)
+        local_auth.setcontents(p, contents)
+
+        # Large files are uploaded and downloaded in parts
+        stats = transfer.copy(local_auth, p, s3, p)
+        assert stats['method'] == 'upload'
+        assert s3.getinfo(p)['etag'].endswith('-3"')
+
+        stats = transfer.copy(s3, p, local_auth, 'downloaded')
+        assert stats['method'] == 'download'
+        assert local_auth.getcontents('downloaded', 'rb') == contents
+
+        # Reads only request the ranges read
+        with s3.open(p, 'rb') as f:
+            f.seek(2**20)
+            assert f.read(10) == contents[2**20:2**20 + 10]
+
+        assert s3.listdir(fs.path.dirname(p)) == [fs.path.basename(p)]
+
+        # Files opened for writing are created when closed
+        with s3.open('text.txt', 'w') as f:
+            assert not s3.isfile('text.txt')
+            f.write(u('some text'))
+
+        assert s3.getcontents('text.txt', 'r') == u('some text')
+
+        s3.removedir('path', force=True)
+        assert not s3.exists(p)
+
+    finally:
+        m.stop()
+
+
+def test_ranged_reads():
+
+    m = moto.mock_s3()
+    m.start()
+
+    try:
+        client_args = {'region_name': 'us-east-1'}
+        boto3.client('s3', **client_args).create_bucket(Bucket='test-bucket')
+
+        s3 = Boto3FS('test-bucket', client_args=client_args)
+        a1 = DataService(s3, chunk_size=2**10)
+
+        contents = os.urandom(2**10) * 64
+        s3.makedir(fs.path.dirname(p), recursive=True)
+        s3.setcontents(p, contents)
+
+        ranges = []
+        read_range = s3.read_range
+
+        def counted_read_range(path, start, end):
+            ranges.append((start, end))
+            return read_range(path, start, end)
+
+        s3.read_range = counted_read_range
+
+        # Archives are read from the authority without a cache
+        with data_file.open_file(
+                a1,
+                None,
+                lambda **kwargs: None,
+                lambda chk: True,
+                hasher,
+                p,
+                mode='rb') as f:
+
+            f.seek(40 * 2**10 + 5)
+            assert f.read(10) == contents[40 * 2**10 + 5:40 * 2**10 + 15]
+            assert ranges[0] == (40 * 2**10, 41 * 2**10)
+            assert sum(end - start for start, end in ranges) < 4 * 2**10
+
+            f.seek(0)
+            assert f.read() == contents
+
+        s3.setcontents('text.txt', b'line 1\nline 2\n')
+
+        with data_file.open_file(
+                a1,
+                None,
+                lambda **kwargs: None,
+                lambda chk: True,
+                hasher,
+                'text.txt',
+                mode='r') as f:
+
+            assert f.readlines() == [u('line 1\n'), u('line 2\n')]
+
+    finally:
+        m.stop()
+
+
+def test_upload_and_hash(local_auth, cache, tmpdir, monkeypatch):
+
+    a1 = DataService(local_auth, chunk_size=4)
+    csh = DataService(cache)
+
+    local_auth.makedir(fs.path.dirname(p), recursive=True)
+    local_auth.setcontents(p, b'old contents')
+
+    filepath = str(tmpdir.join('upload.txt'))
+
+    with open(filepath, 'wb') as f:
+        f.write(b'0123456789' * 10)
+
+    class FailingHash(object):
+        def update(self, data):
+            raise IOError('read failed')
+
+    # A failed upload leaves existing files in place
+    with pytest.raises(IOError):
+        data_file.upload_and_hash(
+            filepath, [(a1, p), (csh, p)], FailingHash())
+
+    assert local_auth.getcontents(p, 'rb') == b'old contents'
+    assert local_auth.listdir(fs.path.dirname(p)) == ['name.txt']
+    assert not cache.isfile(p)
+
+    inode = os.stat(local_auth.getsyspath(p)).st_ino
+    overwritten = []
+    overwrite = transfer._overwrite
+
+    def counted_overwrite(source_path, destination_path):
+        overwritten.append(destination_path)
+        overwrite(source_path, destination_path)
+
+    monkeypatch.setattr(transfer, '_overwrite', counted_overwrite)
+
+    checksum = data_file.upload_and_hash(
+        filepath, [(a1, p), (csh, p)], DataAPI.new_hash())
+
+    assert checksum == DataAPI.hash_file(filepath)
+
+    for service in [local_auth, cache]:
+        assert service.getcontents(p, 'rb') == b'0123456789' * 10
+
+    # existing local files are overwritten in place, and new files renamed
+    assert overwritten == [local_auth.getsyspath(p)]
+    assert os.stat(local_auth.getsyspath(p)).st_ino == inode
+    assert cache.listdir(fs.path.dirname(p)) == ['name.txt']
+
+    # Filesystems with upload_file are uploaded to from the local file
+    remote = MemoryFS()
+    uploads = []
+
+    def upload_file(path, syspath):
+        uploads.append(path)
+
+        with open(syspath, 'rb') as f:
+            remote.setcontents(path, f.read())
+
+    remote.upload_file = upload_file
+
+    checksum = data_file.upload_and_hash(
+        filepath, [(DataService(remote), p)], DataAPI.new_hash())
+
+    assert checksum == DataAPI.hash_file(filepath)
+    assert uploads == [p]
+    assert remote.getcontents(p, 'rb') == b'0123456789' * 10
+
+    remote.close()
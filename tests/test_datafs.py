@@ -12,7 +12,8 @@ from __future__ import absolute_import
 
 import pytest
 
-from datafs._compat import u
+from datafs._compat import u, open_filelike
+from datafs.core import hashing
 from tests.resources import prep_manager
 import os
 import tempfile
@@ -211,3 +212,209 @@ def test_api_locks(api, local_auth):
 
     with pytest.raises((PermissionError, NameError)):
         api.attach_authority('auth', local_auth)
+
+
+def test_get_archives(api):
+
+    archive_names = ['bulk_archive_{}'.format(i) for i in range(150)]
+
+    for archive_name in archive_names:
+        api.create(archive_name, metadata={'testval': archive_name})
+
+    archives = api.get_archives(reversed(archive_names))
+
+    assert [arch.archive_name for arch in archives] == list(
+        reversed(archive_names))
+
+    assert archives[0].get_metadata() == {'testval': archive_names[-1]}
+
+    with pytest.raises(KeyError) as excinfo:
+        api.get_archives(
+            ['bulk_archive_0', 'missing_archive_1', 'missing_archive_2'])
+
+    assert 'missing_archive_1' in str(excinfo.value)
+    assert 'missing_archive_2' in str(excinfo.value)
+
+    archives = api.get_archives(
+        ['missing_archive_1', 'bulk_archive_1'], raise_on_err=False)
+
+    assert archives[0] is None
+    assert archives[1].archive_name == 'bulk_archive_1'
+
+    for archive_name in archive_names:
+        api.delete_archive(archive_name)
+
+
+def test_hash_algorithms(archive, monkeypatch):
+
+    with archive.open('wb') as f:
+        f.write(b('old data'))
+
+    md5hash = archive.get_latest_hash()
+    assert archive.get_version_algorithm() == 'md5'
+
+    monkeypatch.setattr(type(archive.api), 'HashAlgorithm', 'sha256')
+    monkeypatch.setattr(type(archive.api), 'HashSegmentSize', 4)
+
+    # Versions hashed with MD5 still verify
+    with archive.open('rb') as f:
+        assert f.read() == b('old data')
+
+    f = tempfile.NamedTemporaryFile(delete=False)
+
+    try:
+        f.write(b('old data'))
+        f.close()
+
+        archive.update(f.name)
+        assert archive.get_latest_hash() == md5hash
+        assert len(archive.get_history()) == 1
+
+        with open(f.name, 'wb') as f_obj:
+            f_obj.write(b('new data'))
+
+        # New versions record the new algorithm. Tree hashes computed in
+        # parallel match those computed incrementally.
+        archive.update(f.name)
+
+        assert archive.get_version_algorithm() == 'sha256-tree-4'
+        assert archive.get_latest_hash() == hashing.hash_file(
+            f.name, 'sha256-tree-4', threads=1)['checksum']
+        assert archive.api.hash_file(f.name) == hashing.hash_file(
+            f.name, 'sha256-tree-4', threads=1)
+
+    finally:
+        os.remove(f.name)
+
+    with archive.open('rb') as f:
+        assert f.read() == b('new data')
+
+    assert [v['algorithm'] for v in archive.get_history()] == [
+        'md5', 'sha256-tree-4']
+
+
+@pytest.mark.parametrize('algorithm', hashing.Algorithms)
+def test_available_hash_algorithms(archive, monkeypatch, algorithm):
+
+    monkeypatch.setattr(type(archive.api), 'HashAlgorithm', algorithm)
+
+    contents = b('0123456789') * 100
+
+    with archive.open('wb') as f:
+        f.write(contents)
+
+    expected = hashing.new_hash(algorithm)
+    expected.update(contents)
+
+    assert archive.get_version_algorithm() == algorithm
+    assert archive.get_latest_hash() == expected.hexdigest()
+
+    with archive.open('rb') as f:
+        assert f.read() == contents
+
+
+def test_unavailable_hash_algorithm(api, monkeypatch):
+
+    monkeypatch.setattr(type(api), 'HashAlgorithm', 'not-an-algorithm')
+
+    with pytest.raises(ValueError) as excinfo:
+        type(api)()
+
+    assert 'not available' in str(excinfo.value)
+
+
+def test_overloaded_hash_file(api, tmpdir):
+
+    class SizeHashAPI(type(api)):
+
+        @classmethod
+        def hash_file(cls, f, algorithm=None):
+            with open_filelike(f, 'rb') as f_obj:
+                return {
+                    'algorithm': 'size',
+                    'checksum': str(len(f_obj.read()))}
+
+    sized = SizeHashAPI(**api.user_config)
+    sized.attach_manager(api.manager)
+    sized.attach_authority('filesys', api.default_authority.fs)
+
+    # APIs overloading hash_file alone don't hash files incrementally
+    assert sized.new_hash() is None
+    assert api.new_hash() is not None
+
+    archive = sized.create('sized_archive')
+
+    with archive.open('w+') as f:
+        f.write(u('some data'))
+
+    assert archive.get_latest_hash() == '9'
+
+    test_file = str(tmpdir.join('test_file.txt'))
+
+    with open(test_file, 'w+') as f:
+        f.write('some more data')
+
+    archive.update(test_file)
+
+    assert archive.get_latest_hash() == '14'
+    assert archive.get_version_algorithm() == 'size'
+
+
+def test_static_hash_file_overload(api, monkeypatch, tmpdir):
+
+    class StaticHashAPI(type(api)):
+
+        @staticmethod
+        def hash_file(f):
+            with open_filelike(f, 'rb') as f_obj:
+                return {
+                    'algorithm': 'size',
+                    'checksum': str(len(f_obj.read()))}
+
+    hashed = StaticHashAPI(**api.user_config)
+    hashed.attach_manager(api.manager)
+    hashed.attach_authority('filesys', api.default_authority.fs)
+
+    assert hashed.new_hash() is None
+
+    archive = hashed.create('static_hash_archive')
+
+    with archive.open('w+') as f:
+        f.write(u('some data'))
+
+    assert archive.get_latest_hash() == '9'
+
+    # versions recorded with another algorithm are checked with the overload
+    monkeypatch.setattr(StaticHashAPI, 'HashAlgorithm', 'sha256')
+
+    with archive.open('r') as f:
+        assert f.read() == u('some data')
+
+    test_file = str(tmpdir.join('test_file.txt'))
+
+    with open(test_file, 'w+') as f:
+        f.write('some more data')
+
+    archive.update(test_file)
+
+    assert archive.get_latest_hash() == '14'
+    assert archive.get_version_algorithm() == 'size'
+
+
+def test_open_mmap(archive):
+
+    contents = b('\x00\x01\x02\x03' * 1024)
+
+    with archive.open('wb') as f:
+        f.write(contents)
+
+    with archive.open_mmap() as mapped:
+        assert mapped[:] == contents
+
+        with pytest.raises(TypeError):
+            mapped[0:1] = b('\x01')
+
+    if hasattr(memoryview, 'release'):
+        with archive.open_mmap(as_memoryview=True) as view:
+            assert view.readonly
+            assert view[4:8].tobytes() == contents[:4]
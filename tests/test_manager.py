@@ -1,8 +1,14 @@
 
 from __future__ import absolute_import
 from datafs.managers.manager import BaseDataManager
+from datafs.managers.listing_cache import ListingCache
+from datafs.managers.manager_sqlite import SQLiteManager
+from datafs.managers.manager_dynamo import DynamoDBManager
+from tests.resources import prep_manager
+from datafs import DataAPI
 from botocore.exceptions import ClientError
 import pytest
+import os
 
 
 @pytest.fixture
@@ -209,3 +215,631 @@ def test_base_manager_search(base_manager):
 def test_base_manager_set_tags(base_manager):
     with pytest.raises(NotImplementedError):
         base_manager._set_tags('archive_name', ['term1', 'term2'])
+
+
+def test_listing_cache_expiry_and_eviction(monkeypatch):
+
+    now = [1000.0]
+    monkeypatch.setattr(
+        'datafs.managers.listing_cache.time.time', lambda: now[0])
+
+    cache = ListingCache(size=2, ttl=10)
+
+    cache.set('arch1', {'tags': ['a']})
+    cache.set('arch2', {'tags': ['b']})
+
+    assert cache.get('arch1') == {'tags': ['a']}
+
+    # arch2 is least recently used and should be evicted
+    cache.set('arch3', {'tags': ['c']})
+    assert cache.get('arch2') is None
+    assert cache.get('arch3') == {'tags': ['c']}
+
+    # cached listings are copies and cannot be modified by callers
+    cache.get('arch1')['tags'].append('z')
+    assert cache.get('arch1') == {'tags': ['a']}
+
+    now[0] += 11
+    assert cache.get('arch1') is None
+
+    info = cache.info()
+    assert info['hits'] == 4
+    assert info['misses'] == 2
+    assert info['currsize'] == 1
+
+
+def test_listing_cache_invalidation(api, monkeypatch):
+
+    api.manager._listing_cache = ListingCache(size=10)
+
+    arch = api.create('cached_archive', metadata={'description': 'first'})
+
+    # each accessor caches only the fields it uses
+    for _ in range(2):
+        before = api.manager.listing_cache_info
+
+        arch.get_metadata()
+        arch.get_tags()
+        arch.get_history()
+
+        after = api.manager.listing_cache_info
+
+    assert after['misses'] == before['misses']
+    assert after['hits'] == before['hits'] + 3
+
+    fetched = []
+    get_archive_listing = api.manager._get_archive_listing
+
+    def recorded(archive_name, fields=None):
+        fetched.append(fields)
+        return get_archive_listing(archive_name, fields=fields)
+
+    monkeypatch.setattr(api.manager, '_get_archive_listing', recorded)
+
+    api.manager._listing_cache.clear()
+    arch.get_tags()
+
+    assert fetched == [['tags']]
+
+    monkeypatch.undo()
+
+    # misses are not cached
+    with pytest.raises(KeyError):
+        api.manager.get_tags('uncached_archive')
+
+    assert api.manager._listing_cache.get('uncached_archive') is None
+
+    arch.update_metadata({'description': 'second'})
+    assert arch.get_metadata() == {'description': 'second'}
+
+    arch.add_tags('tag1')
+    assert arch.get_tags() == ['tag1']
+
+    with arch.open('w+', bumpversion='patch') as f:
+        f.write(u'some contents')
+
+    assert len(arch.get_history()) == 1
+
+    arch.delete()
+
+    with pytest.raises(KeyError):
+        api.manager.get_archive('cached_archive')
+
+
+def test_mongo_search_indexes():
+
+    with prep_manager('mongo', table_name='index-test') as manager:
+
+        assert 'tags_1' in manager.collection.index_information()
+
+        manager._index_fields = ['description']
+        manager.build_tag_index()
+
+        assert 'archive_metadata.description_1' in (
+            manager.collection.index_information())
+
+        for archive_name, tags in [
+                ('proj.a(1)', ['x', 'y']),
+                ('proj.a(2)', ['x']),
+                ('projXa(3)', ['x', 'y'])]:
+
+            manager.create_archive(
+                archive_name, 'auth', archive_name, True, tags=tags)
+
+        assert sorted(manager.search(('x', 'y'))) == ['proj.a(1)', 'projXa(3)']
+        assert list(manager.search(('x', 'y'), begins_with='proj.')) == [
+            'proj.a(1)']
+        assert sorted(manager.search((), begins_with='proj.a(')) == [
+            'proj.a(1)', 'proj.a(2)']
+
+
+def test_mongo_collection_handle_caching(local_auth):
+    '''
+    Count listCollections round trips made while reading and writing
+    '''
+
+    with prep_manager('mongo', table_name='handle-test') as manager:
+
+        api = DataAPI(username='My Name', contact='my.email@example.com')
+        api.attach_manager(manager)
+        api.attach_authority('auth', local_auth)
+
+        list_calls = []
+        get_table_names = manager._get_table_names
+
+        def counting_get_table_names():
+            list_calls.append(1)
+            return get_table_names()
+
+        manager._get_table_names = counting_get_table_names
+
+        arch = api.create('handle_archive')
+
+        # each collection handle is validated once, on first use
+        assert len(list_calls) <= 2
+        del list_calls[:]
+
+        for i in range(5):
+            with arch.open('w+', bumpversion='patch', metadata={'i': i}) as f:
+                f.write(u'contents {}'.format(i))
+
+            arch.add_tags('tag{}'.format(i))
+            api.get_archive('handle_archive').get_metadata()
+
+        assert len(list_calls) == 0
+
+        # a missing archive triggers revalidation of the handles
+        with pytest.raises(KeyError):
+            api.get_archive('missing_archive')
+
+        assert len(list_calls) == 1
+
+        manager.delete_table('handle-test')
+
+        with pytest.raises(KeyError):
+            manager._update('handle_archive', {})
+
+
+class _CountingCollection(object):
+    '''
+    Proxy for a pymongo collection which counts update requests
+    '''
+
+    def __init__(self, coll):
+        self._coll = coll
+        self.updates = 0
+
+    def update_one(self, *args, **kwargs):
+        self.updates += 1
+        return self._coll.update_one(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self._coll, attr)
+
+
+def test_single_write_metadata_update(api):
+
+    arch = api.create(
+        'metadata_archive',
+        metadata={'field{}'.format(i): i for i in range(30)})
+
+    if api.manager.__class__.__name__ == 'MongoDBManager':
+        counter = _CountingCollection(api.manager.collection)
+        api.manager._coll = counter
+
+    updates = {'field{}'.format(i): i * 2 for i in range(20)}
+    updates.update({'field{}'.format(i): None for i in range(20, 30)})
+
+    arch.update_metadata(updates)
+
+    assert arch.get_metadata() == {
+        'field{}'.format(i): i * 2 for i in range(20)}
+
+    with arch.open('w+', bumpversion='patch', metadata={'field0': 'a'}) as f:
+        f.write(u'new contents')
+
+    assert arch.get_metadata()['field0'] == 'a'
+    assert len(arch.get_history()) == 1
+
+    if api.manager.__class__.__name__ == 'MongoDBManager':
+        assert counter.updates == 2
+
+
+def test_tag_and_metadata_updates_without_reads(api, monkeypatch):
+
+    arch = api.create('no_read_archive', metadata={'a': 1}, tags=['t1'])
+
+    def fail(*args, **kwargs):
+        raise AssertionError('updates should not read the archive listing')
+
+    monkeypatch.setattr(api.manager, '_get_archive_listing', fail)
+
+    arch.add_tags('t2', 't3')
+    arch.delete_tags('t1')
+    arch.update_metadata({'a': None, 'b': 2})
+
+    monkeypatch.undo()
+
+    assert sorted(arch.get_tags()) == ['t2', 't3']
+    assert arch.get_metadata() == {'b': 2}
+
+    arch.delete_tags('t2', 't3')
+    assert arch.get_tags() == []
+
+
+def test_tag_order(api):
+
+    arch = api.create('ordered_tags_archive', tags=['foo', 'bar'])
+    arch.add_tags('qux', 'baz')
+
+    # tags stored as a set are sorted, others keep the order they were added
+    if isinstance(api.manager, DynamoDBManager):
+        expected = ['bar', 'baz', 'foo', 'qux']
+    else:
+        expected = ['foo', 'bar', 'qux', 'baz']
+
+    assert arch.get_tags() == expected
+
+    arch.delete_tags('baz')
+    expected.remove('baz')
+
+    assert arch.get_tags() == expected
+
+    with pytest.raises(KeyError):
+        api.manager.add_tags('nonexistant_archive', ['t1'])
+
+
+def test_dynamo_legacy_tag_lists(monkeypatch):
+
+    with prep_manager('dynamo', table_name='legacy-tags') as manager:
+
+        item = manager._create_archive_metadata(
+            'legacy_archive', 'auth', 'legacy_archive', True, tags=['a', 'b'])
+
+        # write tags as a list, as done by earlier versions
+        manager._table.put_item(Item=item)
+
+        manager.add_tags('legacy_archive', ['c'])
+        assert manager.get_tags('legacy_archive') == ['a', 'b', 'c']
+
+        manager.delete_tags('legacy_archive', ['a'])
+        assert manager.get_tags('legacy_archive') == ['b', 'c']
+
+        assert isinstance(
+            manager._get_archive_listing('legacy_archive')['tags'], set)
+
+        # other validation errors are not mistaken for legacy tag lists
+        def invalid(*args, **kwargs):
+            raise ClientError({'Error': {
+                'Code': 'ValidationException',
+                'Message': 'Item size has exceeded the maximum allowed size'}},
+                'UpdateItem')
+
+        monkeypatch.setattr(manager, '_update_archive_item', invalid)
+
+        def fail(*args, **kwargs):
+            raise AssertionError('tags should not be rewritten')
+
+        monkeypatch.setattr(manager, '_get_archive_listing', fail)
+
+        for update in [manager.add_tags, manager.delete_tags]:
+            with pytest.raises(ClientError):
+                update('legacy_archive', ['d'])
+
+
+def test_create_without_reads(api, monkeypatch):
+
+    def fail(*args, **kwargs):
+        raise AssertionError('create should not read the archive listing')
+
+    monkeypatch.setattr(api.manager, '_get_archive_listing', fail)
+
+    api.manager._create_archive(
+        'conditional_archive',
+        api.manager._create_archive_metadata(
+            'conditional_archive', 'auth', 'conditional_archive', True))
+
+    with pytest.raises(KeyError):
+        api.manager._create_archive(
+            'conditional_archive',
+            api.manager._create_archive_metadata(
+                'conditional_archive', 'auth', 'conditional_archive', True))
+
+    monkeypatch.undo()
+
+    assert api.manager.get_archive('conditional_archive')['versioned']
+
+
+def test_create_archives(api):
+
+    api.create('existing_archive', tags=['old'])
+
+    archives = [
+        dict(
+            archive_name=name,
+            authority_name=api.default_authority_name,
+            archive_path=name,
+            versioned=True,
+            tags=['new'])
+        for name in ['bulk_1', 'existing_archive', 'bulk_2', 'bulk_1']]
+
+    conflicts = api.manager.create_archives(archives)
+
+    assert sorted(conflicts) == ['bulk_1', 'existing_archive']
+    assert api.manager.get_tags('existing_archive') == ['old']
+    assert api.manager.get_tags('bulk_2') == ['new']
+    assert api.manager.get_archive('bulk_1')['archive_path'] == 'bulk_1'
+
+    assert api.manager.create_archives([]) == []
+
+
+def test_create_archives_race(api, monkeypatch):
+
+    manager = api.manager
+
+    if not hasattr(manager, '_prepare_archive_item'):
+        return
+
+    prepare = manager._prepare_archive_item
+
+    def create_concurrently(metadata):
+        # another client creates the archive just before it is written
+        if metadata['_id'] == 'raced_archive':
+            with monkeypatch.context() as m:
+                m.setattr(manager, '_prepare_archive_item', prepare)
+                api.create('raced_archive', tags=['first'])
+
+        return prepare(metadata)
+
+    monkeypatch.setattr(
+        manager, '_prepare_archive_item', create_concurrently)
+
+    conflicts = manager.create_archives([
+        dict(
+            archive_name=name,
+            authority_name=api.default_authority_name,
+            archive_path=name,
+            versioned=True,
+            tags=['second'])
+        for name in ['raced_archive', 'unraced_archive']])
+
+    assert conflicts == ['raced_archive']
+    assert manager.get_tags('raced_archive') == ['first']
+    assert manager.get_tags('unraced_archive') == ['second']
+
+
+def test_projected_listing_fetches(api):
+
+    api.create('projected_archive', metadata={'a': 1}, tags=['t1'])
+
+    assert api.manager.get_latest_hash('projected_archive') is None
+
+    for checksum in ['abc', 'def']:
+        api.manager.update(
+            'projected_archive',
+            {'checksum': checksum, 'algorithm': 'md5', 'version': None})
+
+    spec = ['authority_name', 'archive_path', 'versioned']
+
+    listing = api.manager._get_archive_listing(
+        'projected_archive', fields=spec)
+
+    assert set(listing.keys()) == set(spec + ['_id'])
+
+    listings = api.manager._get_archive_listings(
+        ['projected_archive', 'nonexistant_archive'], fields=['tags'])
+
+    assert list(listings.keys()) == ['projected_archive']
+    assert 'version_history' not in listings['projected_archive']
+
+    with pytest.raises(KeyError):
+        api.manager._get_archive_listing('nonexistant_archive', fields=spec)
+
+    assert api.manager.get_latest_hash('projected_archive') == 'def'
+    assert api.manager.get_metadata('projected_archive') == {'a': 1}
+    assert api.manager.get_tags('projected_archive') == ['t1']
+    assert api.manager.get_archive('projected_archive')['versioned']
+    assert len(api.manager.get_version_history('projected_archive')) == 2
+
+
+def test_version_store(api):
+
+    manager = api.manager
+
+    api.create('store_archive', metadata={'a': 1})
+
+    def add_version(checksum, archive_metadata=None):
+        manager.update(
+            'store_archive',
+            {'checksum': checksum, 'algorithm': 'md5', 'version': None},
+            archive_metadata=archive_metadata)
+
+    add_version('v1')
+    add_version('v2')
+
+    legacy_history = manager.get_version_history('store_archive')
+
+    if isinstance(manager, SQLiteManager):
+        # versions are always stored separately
+        assert manager.migrate_version_store() == 0
+
+    else:
+        assert manager.migrate_version_store() == 1
+        assert manager.config['version_store']
+
+        assert manager._get_archive_listing(
+            'store_archive')['version_history'] == []
+
+    assert manager.get_version_history('store_archive') == legacy_history
+
+    add_version('v3')
+    add_version('v4', archive_metadata={'a': None, 'b': 2})
+
+    history = manager.get_version_history('store_archive')
+
+    assert [v['checksum'] for v in history] == ['v1', 'v2', 'v3', 'v4']
+    assert [
+        v['checksum'] for v in manager.get_version_history(
+            'store_archive', limit=2, after=1)] == ['v2', 'v3']
+    assert manager.get_version_history('store_archive', after=4) == []
+
+    assert manager.get_latest_hash('store_archive') == 'v4'
+    assert manager.get_metadata('store_archive') == {'b': 2}
+
+    api.create('empty_archive')
+    assert manager.get_version_history('empty_archive') == []
+    assert manager.get_latest_hash('empty_archive') is None
+
+    with pytest.raises(KeyError):
+        manager.get_version_history('nonexistant_archive')
+
+    with pytest.raises(KeyError):
+        manager.update(
+            'nonexistant_archive', {'checksum': 'v1', 'version': None})
+
+    manager.delete_archive_record('store_archive')
+    api.create('store_archive')
+
+    assert manager.get_version_history('store_archive') == []
+
+
+def test_version_store_interrupted_writes(api, monkeypatch):
+
+    manager = api.manager
+
+    if isinstance(manager, SQLiteManager):
+        # versions are written in a single transaction
+        return
+
+    manager.migrate_version_store()
+    api.create('crash_archive')
+
+    def add_version(checksum):
+        manager.update(
+            'crash_archive',
+            {'checksum': checksum, 'algorithm': 'md5', 'version': None})
+
+    add_version('v1')
+
+    # a record written without advancing the count is kept, not overwritten
+    orphan = {
+        'archive': 'crash_archive',
+        'seq': 2,
+        'checksum': 'orphan',
+        'algorithm': 'md5',
+        'version': None}
+
+    if hasattr(manager, 'version_collection'):
+        manager.version_collection.insert_one(orphan)
+    else:
+        manager._version_table.put_item(Item=orphan)
+
+    # records above the version count are not part of the history
+    assert [v['checksum'] for v in manager.get_version_history(
+        'crash_archive')] == ['v1']
+    assert manager.get_latest_hash('crash_archive') == 'v1'
+
+    add_version('v2')
+
+    assert [v['checksum'] for v in manager.get_version_history(
+        'crash_archive')] == ['v1', 'orphan', 'v2']
+    assert manager.get_version_count('crash_archive') == 3
+    assert manager.get_latest_hash('crash_archive') == 'v2'
+
+    # interrupt the write after the version record is stored
+    def fail(*args, **kwargs):
+        raise IOError('interrupted')
+
+    if hasattr(manager, 'version_collection'):
+        collection = manager.collection
+        monkeypatch.setattr(collection, 'update_one', fail)
+    else:
+        monkeypatch.setattr(manager, '_update_archive_item', fail)
+
+    with pytest.raises(IOError):
+        add_version('v3')
+
+    monkeypatch.undo()
+
+    # the interrupted record is hidden until the count passes it
+    history = manager.get_version_history('crash_archive')
+    assert [v['checksum'] for v in history] == ['v1', 'orphan', 'v2']
+    assert manager.get_version_count('crash_archive') == len(history)
+    assert manager.get_latest_hash('crash_archive') == 'v2'
+    assert [v['checksum'] for v in manager.get_version_histories(
+        ['crash_archive'])['crash_archive']] == ['v1', 'orphan', 'v2']
+
+    add_version('v4')
+
+    history = [v['checksum'] for v in manager.get_version_history(
+        'crash_archive')]
+    assert history == ['v1', 'orphan', 'v2', 'v3', 'v4']
+    assert manager.get_version_count('crash_archive') == len(history)
+    assert manager.get_latest_hash('crash_archive') == 'v4'
+
+    # ``after`` skips a number of versions, so pages never overlap
+    for page_size in range(1, len(history) + 1):
+        paged = []
+
+        while True:
+            page = manager.get_version_history(
+                'crash_archive', limit=page_size, after=len(paged))
+
+            if len(page) == 0:
+                break
+
+            paged.extend(v['checksum'] for v in page)
+
+        assert paged == history
+
+
+def test_legacy_version_count(api):
+
+    manager = api.manager
+
+    if isinstance(manager, SQLiteManager):
+        # the count column is always populated
+        return
+
+    api.create('legacy_count_archive')
+
+    def add_version(checksum):
+        manager.update(
+            'legacy_count_archive',
+            {'checksum': checksum, 'algorithm': 'md5', 'version': None})
+
+    add_version('v1')
+    add_version('v2')
+
+    # archives written before the count was introduced
+    if hasattr(manager, 'version_collection'):
+        manager.collection.update_one(
+            {'_id': 'legacy_count_archive'},
+            {'$unset': {'version_count': ''}})
+    else:
+        manager._table.update_item(
+            Key={'_id': 'legacy_count_archive'},
+            UpdateExpression='REMOVE version_count')
+
+    manager._listing_cache.invalidate('legacy_count_archive')
+
+    assert manager.get_version_count('legacy_count_archive') == 2
+
+    add_version('v3')
+
+    assert manager.get_version_count('legacy_count_archive') == 3
+    assert manager._get_archive_listing(
+        'legacy_count_archive', fields=['version_count'])[
+            'version_count'] == 3
+
+
+def test_sqlite_manager_from_config(tempdir):
+
+    from datafs.config.constructor import APIConstructor
+
+    database = os.path.join(tempdir, 'archives.db')
+
+    manager = APIConstructor._generate_manager({
+        'class': 'SQLiteManager',
+        'kwargs': {'database': database, 'table_name': 'sqlite-test'}})
+
+    assert isinstance(manager, SQLiteManager)
+    assert manager.config['database'] == database
+
+    manager.create_archive_table('sqlite-test')
+
+    try:
+        manager.create_archive('arch1', 'auth', 'arch1', True, tags=['a'])
+
+        # a second manager sees the same archives
+        other = APIConstructor._generate_manager(
+            {'class': 'SQLiteManager', 'kwargs': manager.config})
+
+        assert other.get_tags('arch1') == ['a']
+        assert list(other.search(['a'], begins_with='arch')) == ['arch1']
+
+        other.close()
+
+    finally:
+        manager.delete_table('sqlite-test')
+        manager.close()
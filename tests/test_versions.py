@@ -83,3 +83,220 @@ def test_versioned_fs_functions(api1, auth2, opener):
 
     with opener(archive, 'w+') as f:
         f.write(u('test content v0.0.1'))
+
+
+def test_latest_version_pointers(api1, auth1, monkeypatch):
+
+    api1.attach_authority('auth', auth1)
+
+    archive = api1.create('pointer_archive')
+
+    with archive.open('w+', prerelease='alpha') as f:
+        f.write(u('v0.0.1a1'))
+
+    with archive.open('w+', bumpversion='minor') as f:
+        f.write(u('v0.1'))
+
+    listing = api1.manager._get_archive_listing(
+        'pointer_archive',
+        fields=['latest_version', 'latest_checksum', 'version_count'])
+
+    assert listing['latest_version'] == '0.1'
+    assert listing['latest_checksum'] == archive.get_latest_hash()
+    assert listing['version_count'] == 2
+
+    def fail(*args, **kwargs):
+        raise AssertionError('latest version should not read the history')
+
+    monkeypatch.setattr(api1.manager, 'get_version_history', fail)
+
+    assert archive.get_latest_version() == '0.1'
+    assert archive.get_default_version() == '0.1'
+    assert archive.get_version_hash() == listing['latest_checksum']
+
+    with archive.open('r') as f:
+        assert u(f.read()) == u('v0.1')
+
+    monkeypatch.undo()
+
+    # archives written without the pointer fall back to the history
+    get_cached_listing = api1.manager._get_cached_listing
+
+    def without_pointers(archive_name, fields=None):
+        listing = get_cached_listing(archive_name, fields=fields)
+
+        for field in ['latest_version', 'latest_checksum']:
+            listing.pop(field, None)
+
+        return listing
+
+    monkeypatch.setattr(
+        api1.manager, '_get_cached_listing', without_pointers)
+
+    assert api1.manager.get_latest_version('pointer_archive') == '0.1'
+    assert archive.get_latest_hash() == listing['latest_checksum']
+
+    # version segments are compared as numbers, without a size limit
+    for version in ['0.9999', '0.10000']:
+        api1.manager.update(
+            'pointer_archive',
+            {'checksum': version, 'algorithm': 'md5', 'version': version})
+
+    assert api1.manager.get_latest_version('pointer_archive') == '0.10000'
+
+
+def test_version_index(api1, auth1, monkeypatch):
+
+    api1.attach_authority('auth', auth1)
+
+    archive = api1.create('indexed_archive')
+
+    for content in ['v0.0.1', 'v0.0.2', 'v0.0.3']:
+        with archive.open('w+', bumpversion='patch') as f:
+            f.write(u(content))
+
+    history = archive.get_history()
+
+    fetches = []
+    get_history = archive.get_history
+
+    def counted_get_history(*args, **kwargs):
+        fetches.append(1)
+        return get_history(*args, **kwargs)
+
+    monkeypatch.setattr(archive, 'get_history', counted_get_history)
+
+    for version_metadata in history:
+        assert archive.get_version_hash(
+            version_metadata['version']) == version_metadata['checksum']
+
+        assert archive.get_dependencies(
+            version_metadata['version']) == version_metadata['dependencies']
+
+    assert archive.get_versions() == ['0.0.1', '0.0.2', '0.0.3']
+    assert archive.get_version_index().range('0.0.2') == ['0.0.2', '0.0.3']
+    assert len(fetches) == 1
+
+    with pytest.raises(ValueError):
+        archive.get_version_hash('0.2')
+
+    # the index is rebuilt once the history changes
+    with archive.open('w+', bumpversion='minor') as f:
+        f.write(u('v0.1'))
+
+    del fetches[:]
+
+    assert archive.get_versions()[-1] == '0.1'
+    assert archive.get_version_index().latest() == '0.1'
+    assert len(fetches) == 1
+
+
+def test_version_specifiers(api1, auth1, monkeypatch):
+
+    api1.attach_authority('auth', auth1)
+
+    for archive_name in ['spec_archive_1', 'spec_archive_2']:
+        archive = api1.create(archive_name)
+
+        for bump, content in [
+                ('minor', 'v0.1'),
+                ('patch', 'v0.1.1'),
+                ('minor', 'v0.2'),
+                ('major', 'v1.0')]:
+
+            with archive.open('w+', bumpversion=bump) as f:
+                f.write(u(content))
+
+    archive = api1.get_archive(
+        'spec_archive_1', default_version='>=0.1, <1.0, !=0.2')
+
+    assert archive.get_default_version() == '0.1.1'
+
+    with archive.open('r') as f:
+        assert u(f.read()) == u('v0.1.1')
+
+    archive = api1.get_archive('spec_archive_1', default_version='~=0.1')
+    assert archive.get_default_version() == '0.2'
+
+    with pytest.raises(ValueError):
+        api1.get_archive(
+            'spec_archive_1', default_version='>1.0').get_default_version()
+
+    api1._default_versions.update({
+        'spec_archive_1': '<0.2',
+        'spec_archive_2': '0.2'})
+
+    assert api1.get_archive(
+        'spec_archive_1').get_default_version() == '0.1.1'
+
+    def fail(*args, **kwargs):
+        raise AssertionError('requirements should be resolved in bulk')
+
+    monkeypatch.setattr(api1.manager, 'get_version_history', fail)
+
+    assert api1.resolve_versions() == {
+        'spec_archive_1': '0.1.1',
+        'spec_archive_2': '0.2'}
+
+    assert api1.resolve_versions({'spec_archive_2': None}) == {
+        'spec_archive_2': '1.0'}
+
+    with pytest.raises(KeyError):
+        api1.resolve_versions({'spec_archive_3': None})
+
+    # unversioned archives resolve to None
+    api1.create('spec_archive_4', versioned=False)
+
+    assert api1.resolve_versions({
+        'spec_archive_1': '~=0.1',
+        'spec_archive_4': None}) == {
+            'spec_archive_1': '0.2',
+            'spec_archive_4': None}
+
+    # pins and latest versions are resolved without the version histories
+    monkeypatch.setattr(api1.manager, 'get_version_histories', fail)
+    monkeypatch.setattr(api1.manager, 'get_version_count', fail)
+
+    assert api1.resolve_versions({
+        'spec_archive_1': '0.1',
+        'spec_archive_2': None}) == {
+            'spec_archive_1': '0.1',
+            'spec_archive_2': '1.0'}
+
+    assert api1.get_archive(
+        'spec_archive_2').get_default_version() == '0.2'
+
+    # requirement ranges of many archives are resolved together
+    calls = []
+    get_version_histories = api1.manager._get_version_histories
+
+    def counted(archive_names):
+        calls.append(sorted(archive_names))
+        return get_version_histories(archive_names)
+
+    monkeypatch.setattr(api1.manager, 'get_version_histories', counted)
+    api1._default_versions['spec_archive_2'] = '>=0.2, <1.0'
+
+    assert [
+        archive.get_default_version() for archive in api1.get_archives(
+            ['spec_archive_1', 'spec_archive_2'])] == ['0.1.1', '0.2']
+
+    assert calls == [['spec_archive_1', 'spec_archive_2']]
+
+    # version ranges are recorded as the versions they resolve to
+    monkeypatch.undo()
+
+    api1._default_versions = {
+        'spec_archive_1': '<0.2',
+        'spec_archive_2': '0.2',
+        'spec_archive_4': None}
+
+    archive = api1.create('spec_archive_5')
+
+    with archive.open('w+') as f:
+        f.write(u('v0.0.1'))
+
+    assert archive.get_dependencies() == {
+        'spec_archive_1': '0.1.1',
+        'spec_archive_2': '0.2',
+        'spec_archive_4': None}